@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Asyncio serving mode for the 3D Arena Shooter backend
+
+Runs the same rooms and Socket.IO events as server.py (player_move, shoot,
+player_action, ping, ...) on python-socketio's ASGI server instead of
+threaded Flask-SocketIO. Every connection is a coroutine rather than a
+thread, so one process can hold thousands of mostly idle players:
+
+    uvicorn async_server:app --host 0.0.0.0 --port 5000
+    python async_server.py
+
+Handlers never block the event loop: emits only queue packets on the
+connection, room ticks flush their events once per tick, and log records go
+through a queue to a listener thread that does the actual I/O.
+"""
+
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import resource
+import sys
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import socketio
+
+import game_logic
+import metrics
+import replay
+from rate_limit import RateLimiter
+from rooms import GameRoom, RoomManager, DEFAULT_ROOM, EXPIRY_RESOLUTION
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 5000))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+# Per-connection limits; keep them small so idle sockets stay cheap
+MAX_MESSAGE_SIZE = int(os.environ.get('MAX_MESSAGE_SIZE', 64 * 1024))
+PING_INTERVAL = int(os.environ.get('PING_INTERVAL', 25))
+PING_TIMEOUT = int(os.environ.get('PING_TIMEOUT', 20))
+
+logger = logging.getLogger('arena')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log line, with any extra= fields included"""
+
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=LOG_LEVEL):
+    """Route log records through a queue so the event loop never waits on I/O
+
+    Returns the listener, which must be stopped to flush pending records.
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins='*',
+    # Handlers do not block, so run them inline in the connection's reader
+    # instead of spawning a task per message
+    async_handlers=False,
+    max_http_buffer_size=MAX_MESSAGE_SIZE,
+    ping_interval=PING_INTERVAL,
+    ping_timeout=PING_TIMEOUT,
+    logger=False,
+    engineio_logger=False,
+)
+
+outboxes = {}  # room id -> events the current room emitted since its last flush
+room_tasks = {}  # room id -> tick loop task of the current room
+background_tasks = []
+
+
+def room_outbox(room_id):
+    """Sync emit callable for a room; events are sent by flush_room()
+
+    Always a fresh list: a room reopened under the same id must not share
+    the outbox of one whose tick loop has not finished yet.
+    """
+    outbox = outboxes[room_id] = []
+
+    def emit(event, data, to=None, skip_sid=None):
+        outbox.append((event, data, to, skip_sid))
+    return emit
+
+
+async def flush_room(outbox):
+    """Send the events a room queued in its outbox during its last tick"""
+    if not outbox:
+        return
+    events = outbox[:]
+    del outbox[:len(events)]
+    for event, data, to, skip_sid in events:
+        await sio.emit(event, data, to=to, skip_sid=skip_sid)
+        metrics.count_emit(event, recipient_count(to, skip_sid))
+
+
+def recipient_count(to, skip_sid=None):
+    """Clients an emit to a room id, a single sid or a list of sids reaches"""
+    if isinstance(to, list):
+        return len(to)
+    room = rooms.rooms.get(to)
+    if room is None:
+        return 1
+    return len(room) - (1 if skip_sid is not None and skip_sid in room else 0)
+
+
+def create_room(room_id):
+    return GameRoom(room_id, room_outbox(room_id),
+                    fallback_hit_test=game_logic.check_ray_hit,
+                    log=logging.getLogger('arena.room').debug,
+                    recorder=replay.recorder_for_room(room_id))
+
+
+rooms = RoomManager(create_room)
+rate_limiter = RateLimiter()  # Per-connection budgets for client events
+
+
+async def run_room(room, outbox):
+    """Async tick loop: tick, flush the room's events, sleep until the next tick"""
+    try:
+        for delay in room.ticks():
+            await flush_room(outbox)
+            await asyncio.sleep(delay)
+    except Exception:
+        logger.exception('Room tick loop failed', extra={'room': room.room_id})
+    finally:
+        # A new room may already own the id; only forget what is this room's
+        if outboxes.get(room.room_id) is outbox:
+            del outboxes[room.room_id]
+        if room_tasks.get(room.room_id) is asyncio.current_task():
+            del room_tasks[room.room_id]
+
+
+def start_room(room):
+    """Run a newly created room's tick loop as a task"""
+    outbox = outboxes[room.room_id]  # Created with the room by room_outbox()
+    room_tasks[room.room_id] = asyncio.get_running_loop().create_task(run_room(room, outbox))
+    logger.info('Room started', extra={'room': room.room_id, 'tick_rate': room.tick_rate})
+
+
+async def join_game_room(player_id, room_id):
+    """Add a player to a room and tell the room about it"""
+    await sio.enter_room(player_id, room_id)
+    room, player_state, created = rooms.join(player_id, room_id)
+    if created:
+        start_room(room)
+
+    logger.info('Player joined room', extra={'player': player_id, 'room': room_id, 'players': len(room)})
+
+    await sio.emit('game_state', room.game_state(player_id, message='Welcome to the arena!'), to=player_id)
+    await sio.emit('player_joined', {
+        'player': player_state,
+        'total_players': len(room)
+    }, to=room_id, skip_sid=player_id)
+    metrics.count_emit('player_joined', len(room) - 1)
+
+
+async def leave_game_room(player_id):
+    """Remove a player from its room and tell the remaining players"""
+    room, player_data, closed = rooms.leave(player_id)
+    if room is None:
+        return None
+    await sio.leave_room(player_id, room.room_id)
+
+    if closed:
+        logger.info('Room closed', extra={'room': room.room_id})
+    else:
+        await sio.emit('player_left', {
+            'player_id': player_id,
+            'total_players': len(room)
+        }, to=room.room_id)
+        metrics.count_emit('player_left', len(room))
+    return player_data
+
+
+@sio.event
+@metrics.instrument('connect')
+async def connect(sid, environ, auth=None):
+    start_background_tasks()
+    # Players pick a match with the room query parameter
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    room_id = (query.get('room') or [''])[0] or DEFAULT_ROOM
+    await join_game_room(sid, room_id)
+
+
+@sio.event
+@metrics.instrument('disconnect')
+async def disconnect(sid, reason=None):
+    rate_limiter.forget(sid)
+    if await leave_game_room(sid) is not None:
+        logger.info('Player disconnected', extra={'player': sid, 'reason': str(reason),
+                                                  'players': rooms.total_players()})
+
+
+@sio.on('join_room')
+@metrics.instrument('join_room')
+async def handle_join_room(sid, data):
+    """Move a player to another room (match)"""
+    if not rate_limiter.allow(sid, 'join_room'):
+        metrics.THROTTLED.inc('join_room', 'dropped')
+        return
+    room_id = str((data or {}).get('room') or DEFAULT_ROOM)
+    current = rooms.room_of(sid)
+    if current is not None and current.room_id == room_id:
+        return
+    await leave_game_room(sid)
+    await join_game_room(sid, room_id)
+
+
+@sio.on('player_move')
+@metrics.instrument('player_move')
+async def handle_player_move(sid, data):
+    room = rooms.room_of(sid)
+    if room is None:
+        return
+    if not rate_limiter.allow(sid, 'player_move'):
+        # Over budget: keep only the latest position, applied with the next tick
+        room.defer_move(sid, data)
+        rooms.touch(sid)
+        metrics.THROTTLED.inc('player_move', 'merged')
+        return
+    try:
+        room.apply_move(sid, data)
+        rooms.touch(sid)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning('Invalid movement data', extra={'player': sid, 'error': str(e)})
+        await sio.emit('error', {'message': 'Invalid movement data'}, to=sid)
+
+
+@sio.on('player_action')
+@metrics.instrument('player_action')
+async def handle_player_action(sid, data):
+    room = rooms.room_of(sid)
+    if room is None or not isinstance(data, dict):
+        return
+    if not rate_limiter.allow(sid, 'player_action'):
+        metrics.THROTTLED.inc('player_action', 'dropped')
+        return
+    await sio.emit('player_action', {
+        'player_id': sid,
+        'action_type': data.get('type'),
+        'action_data': data.get('data', {}),
+        'timestamp': time.time()
+    }, to=room.room_id, skip_sid=sid)
+    metrics.count_emit('player_action', len(room) - 1)
+
+
+@sio.on('shoot')
+@metrics.instrument('shoot')
+async def handle_shoot(sid, data):
+    room = rooms.room_of(sid)
+    if room is None:
+        return
+    if not rate_limiter.allow(sid, 'shoot'):
+        metrics.THROTTLED.inc('shoot', 'dropped')
+        return
+    try:
+        # Hits are resolved by the room with all other shots of this tick
+        room.queue_shot(sid, data)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logger.warning('Invalid shoot data', extra={'player': sid, 'error': str(e)})
+        await sio.emit('error', {'message': 'Invalid shoot data'}, to=sid)
+
+
+@sio.on('snapshot_ack')
+@metrics.instrument('snapshot_ack')
+async def handle_snapshot_ack(sid, data):
+    room = rooms.room_of(sid)
+    if room is None:
+        return
+    # Clients ack every snapshot, so this keeps players who stand still from expiring
+    rooms.touch(sid)
+    try:
+        room.acknowledge_snapshot(sid, int(data.get('tick', 0)))
+    except (ValueError, TypeError, AttributeError):
+        pass
+
+
+@sio.on('request_game_state')
+@metrics.instrument('request_game_state')
+async def handle_game_state_request(sid, data=None):
+    room = rooms.room_of(sid)
+    if room is not None:
+        await sio.emit('game_state', room.game_state(sid, timestamp=time.time()), to=sid)
+
+
+@sio.on('ping')
+@metrics.instrument('ping')
+async def handle_ping(sid, data=None):
+    """Latency probe; rtt is the client's last measurement, used for lag compensation"""
+    data = data if isinstance(data, dict) else {}
+    room = rooms.room_of(sid)
+    if room is not None:
+        rooms.touch(sid)
+    if room is not None and 'rtt' in data:
+        try:
+            room.update_latency(sid, data['rtt'])
+        except (ValueError, TypeError, KeyError):
+            pass
+    await sio.emit('pong', {'timestamp': time.time(), 'client_time': data.get('client_time')}, to=sid)
+
+
+async def periodic_cleanup():
+    """Drop players whose idle deadline has passed"""
+    while True:
+        await asyncio.sleep(EXPIRY_RESOLUTION)
+        idle = rooms.expire_idle()
+        for player_id in idle:
+            await leave_game_room(player_id)
+        if idle:
+            logger.info('Cleaned up idle players', extra={'players': idle})
+
+
+def start_background_tasks():
+    if not background_tasks:
+        background_tasks.append(asyncio.get_running_loop().create_task(periodic_cleanup()))
+
+
+def stats():
+    """Connection and memory figures for /health"""
+    return {
+        'status': 'healthy',
+        'mode': 'asyncio',
+        'connections': len(sio.eio.sockets),
+        'players_online': rooms.total_players(),
+        'rooms': rooms.summary(),
+        'collision': game_logic.BACKEND_REPORT,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+async def http_app(scope, receive, send):
+    """Plain HTTP routes served next to Socket.IO"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    if path == '/metrics':
+        await send_text(send, 200, metrics.render(), b'text/plain; version=0.0.4')
+        return
+    if path == '/debug/profile' and metrics.PROFILER_ENABLED:
+        # Sample in a thread while the event loop keeps serving
+        query = parse_qs(scope.get('query_string', b'').decode())
+        seconds = min(float((query.get('seconds') or [5])[0]), 60.0)
+        try:
+            stacks = await asyncio.to_thread(metrics.profile, seconds)
+        except RuntimeError as e:
+            await send_text(send, 409, str(e), b'text/plain')
+            return
+        await send_text(send, 200, stacks, b'text/plain')
+        return
+
+    if path == '/health':
+        status, body = 200, stats()
+    elif path == '/lobby':
+        status, body = 200, {'rooms': rooms.summary(), 'timestamp': datetime.now().isoformat()}
+    elif path == '/':
+        status, body = 200, {'message': '3D Arena Shooter Server is running!'}
+    else:
+        status, body = 404, {'error': 'Not found'}
+
+    await send_text(send, status, json.dumps(body), b'application/json')
+
+
+async def send_text(send, status, text, content_type):
+    payload = text.encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type),
+                            (b'content-length', str(len(payload)).encode()),
+                            (b'access-control-allow-origin', b'*')]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app)
+
+metrics.register_collision_calls(game_logic.CALL_COUNTS)
+metrics.Gauge('arena_players_online', 'Players connected to this process', rooms.total_players)
+metrics.Gauge('arena_rooms', 'Rooms running in this process', lambda: len(rooms))
+metrics.Gauge('arena_connections', 'Open Socket.IO connections', lambda: len(sio.eio.sockets))
+
+
+def main():
+    import uvicorn
+
+    listener = setup_logging()
+    logger.info('Starting 3D Arena Shooter async server', extra={'host': HOST, 'port': PORT})
+    try:
+        uvicorn.run(app, host=HOST, port=PORT, log_config=None, access_log=False,
+                    ws_per_message_deflate=False, backlog=4096)
+    finally:
+        listener.stop()
+
+
+if __name__ == '__main__':
+    main()
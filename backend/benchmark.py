@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the collision paths in game_logic.py
+
+Times each collision entry point on the Python fallback and, when the module
+is built, on cpp_logic, for a range of player counts. One measurement is the
+time of one "sweep": a single hit test against all N players, or N pairwise
+calls for the per-pair functions. sphere_overlaps is one all-pairs pass over
+the N players; its C++ timings depend on COLLISION_THREADS.
+
+    python benchmark.py                               # table of results
+    python benchmark.py --output results.json         # also save them as JSON
+    python benchmark.py --baseline results.json       # fail on regressions
+
+With --baseline the run exits with status 1 if any case got slower than the
+saved one by more than --threshold (default 25%).
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import game_logic
+from player_store import PlayerStore
+
+DEFAULT_PLAYER_COUNTS = (1, 10, 100, 1000, 10000)
+
+
+class use_backend:
+    """Context manager forcing every game_logic entry point onto one path
+
+    Overrides game_logic.CPP_DISPATCH too, so 'cpp' measures the C++ code
+    even where the dispatch table currently prefers Python.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        self.saved = game_logic.CPP_AVAILABLE, dict(game_logic.CPP_DISPATCH)
+        game_logic.CPP_AVAILABLE = self.backend == 'cpp'
+        for name in game_logic.CPP_DISPATCH:
+            game_logic.CPP_DISPATCH[name] = True
+
+    def __exit__(self, *exc):
+        game_logic.CPP_AVAILABLE, dispatch = self.saved
+        game_logic.CPP_DISPATCH.update(dispatch)
+
+
+def available_backends():
+    return ['python', 'cpp'] if game_logic.cpp_logic is not None else ['python']
+
+
+def make_world(count, seed=0):
+    """Random player positions, and a ray aimed at the middle of the crowd"""
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-50, 50, (count, 3))
+    positions[:, 1] = 1.0
+    players = {f'player{i}': {'x': float(p[0]), 'y': float(p[1]), 'z': float(p[2]), 'health': 100}
+               for i, p in enumerate(positions)}
+    ray = {'origin': {'x': -60.0, 'y': 1.0, 'z': 0.0}, 'direction': {'x': 1.0, 'y': 0.0, 'z': 0.0}}
+    return positions, players, ray
+
+
+def case_spheres_intersect_coords(backend, count):
+    positions, _, _ = make_world(count)
+    rows = positions.tolist()
+    spheres_intersect_coords = game_logic.spheres_intersect_coords
+
+    def run():
+        for x, y, z in rows:
+            spheres_intersect_coords(0.0, 1.0, 0.0, 0.5, x, y, z, 0.5)
+    return run
+
+
+def case_ray_sphere_intersect(backend, count):
+    positions, _, _ = make_world(count)
+    if backend == 'cpp':
+        cpp = game_logic.cpp_logic
+        ray = cpp.Ray(cpp.Vector3(-60.0, 1.0, 0.0), cpp.Vector3(1.0, 0.0, 0.0))
+        spheres = [cpp.Sphere(cpp.Vector3(*p), 0.5) for p in positions.tolist()]
+    else:
+        ray = SimpleNamespace(origin=SimpleNamespace(x=-60.0, y=1.0, z=0.0),
+                              direction=SimpleNamespace(x=1.0, y=0.0, z=0.0))
+        spheres = [SimpleNamespace(center=SimpleNamespace(x=x, y=y, z=z), radius=0.5)
+                   for x, y, z in positions.tolist()]
+    ray_sphere_intersect = game_logic.ray_sphere_intersect
+
+    def run():
+        for sphere in spheres:
+            ray_sphere_intersect(ray, sphere)
+    return run
+
+
+def case_check_ray_hit(backend, count):
+    _, players, ray = make_world(count)
+    return lambda: game_logic.check_ray_hit(ray, players)
+
+
+def case_check_ray_hit_store(backend, count):
+    _, players, ray = make_world(count)
+    store = PlayerStore(capacity=max(1, count))
+    for player_id, fields in players.items():
+        store.add(player_id, fields)
+    return lambda: game_logic.check_ray_hit(ray, store)
+
+
+def case_batch_ray_hit_hitboxes(backend, count):
+    """32 shots through the crowd against randomly turned fighter hitboxes"""
+    positions, _, _ = make_world(count)
+    rng = np.random.default_rng(0)
+    rotations = rng.uniform(-math.pi, math.pi, count)
+    origins = np.column_stack([np.full(32, -60.0), np.ones(32), rng.uniform(-50, 50, 32)])
+    directions = np.tile([1.0, 0.0, 0.0], (32, 1))
+    return lambda: game_logic.batch_ray_hit_hitboxes(origins, directions, positions, rotations)
+
+
+def case_sphere_overlaps(backend, count):
+    positions, _, _ = make_world(count)
+    return lambda: game_logic.sphere_overlaps(positions, 0.5)
+
+
+def case_bvh_raycast(backend, count):
+    """32 shots against count static obstacles through their baked BVH"""
+    spheres, nodes = game_logic.build_bvh(game_logic.generate_obstacles(
+        {'seed': 0, 'extent': 50.0, 'obstacles': count}))
+    rng = np.random.default_rng(0)
+    origins = rng.uniform(-50, 50, (32, 3))
+    directions = rng.normal(size=(32, 3))
+    return lambda: game_logic.bvh_raycast(nodes, spheres, origins, directions)
+
+
+def case_simple_ray_hit_detection(backend, count):
+    from server import simple_ray_hit_detection
+    _, players, ray = make_world(count)
+    return lambda: simple_ray_hit_detection(ray, players, None)
+
+
+# name -> (setup(backend, count) returning the timed callable, backends it runs on)
+CASES = {
+    'spheres_intersect_coords': (case_spheres_intersect_coords, ('python', 'cpp')),
+    'ray_sphere_intersect': (case_ray_sphere_intersect, ('python', 'cpp')),
+    'check_ray_hit': (case_check_ray_hit, ('python', 'cpp')),
+    'check_ray_hit_store': (case_check_ray_hit_store, ('python', 'cpp')),
+    'batch_ray_hit_hitboxes': (case_batch_ray_hit_hitboxes, ('python', 'cpp')),
+    'sphere_overlaps': (case_sphere_overlaps, ('python', 'cpp')),
+    'bvh_raycast': (case_bvh_raycast, ('python', 'cpp')),
+    'simple_ray_hit_detection': (case_simple_ray_hit_detection, ('python',)),
+}
+
+
+def time_call(run, min_time=0.2, repeat=5):
+    """Best time per call over repeat rounds of at least min_time each"""
+    run()  # Warm up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def run_benchmarks(cases, counts, min_time=0.2):
+    """Run every case on every backend and count; returns a list of result dicts"""
+    results = []
+    backends = available_backends()
+    for name in cases:
+        setup, case_backends = CASES[name]
+        for backend in backends:
+            if backend not in case_backends:
+                continue
+            for count in counts:
+                with use_backend(backend):
+                    seconds = time_call(setup(backend, count), min_time)
+                results.append({'case': name, 'backend': backend, 'players': count,
+                                'seconds': seconds, 'ns_per_player': seconds / count * 1e9})
+    return results
+
+
+def fastest_backends(results):
+    """Fastest backend per case and player count, for choosing dispatch paths"""
+    best = {}
+    for result in results:
+        key = (result['case'], result['players'])
+        if key not in best or result['seconds'] < best[key]['seconds']:
+            best[key] = result
+    return {f'{case}/{players}': result['backend'] for (case, players), result in sorted(best.items())}
+
+
+def compare(results, baseline, threshold):
+    """Cases slower than the baseline by more than threshold (a fraction)"""
+    previous = {(r['case'], r['backend'], r['players']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['case'], result['backend'], result['players'])
+        if key in previous and result['seconds'] > previous[key] * (1.0 + threshold):
+            regressions.append({**result, 'baseline_seconds': previous[key],
+                                'change': result['seconds'] / previous[key] - 1.0})
+    return regressions
+
+
+def print_table(results):
+    print(f"{'case':<26} {'backend':<8} {'players':>8} {'time':>12} {'per player':>12}")
+    for r in results:
+        print(f"{r['case']:<26} {r['backend']:<8} {r['players']:>8} "
+              f"{format_seconds(r['seconds']):>12} {r['ns_per_player']:>9.1f} ns")
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.2f} us'
+    return f'{seconds * 1e3:.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Python and C++ collision paths")
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--players', type=int, nargs='+', default=list(DEFAULT_PLAYER_COUNTS),
+                        help="player counts to test")
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds spent per measurement")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    parser.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cases, args.players, args.min_time)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpp_available': game_logic.cpp_logic is not None,
+        'results': results,
+        'fastest': fastest_backends(results),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} [{r['backend']}, {r['players']} players]: "
+                  f"{format_seconds(r['baseline_seconds'])} -> {format_seconds(r['seconds'])} "
+                  f"(+{r['change']:.0%})", file=sys.stderr)
+        if regressions:
+            return False
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+    return True
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,356 @@
+# bots.py
+# Server-hosted bots for 3D Arena Shooter
+#
+# Rooms with fewer than BOT_FILL players fill the empty slots with bots.
+# Bots play through the same room methods the socket handlers call for
+# humans (apply_move with sequenced input frames, and queue_shot), so hit
+# detection, snapshots and replays treat them like anyone else. All bots of a
+# room are planned together: steering and aiming are array math over every
+# bot at once (plan_bots), run on a worker pool shared by all rooms, so the
+# tick loop and the socket handlers never wait for it. A plan made from one
+# tick's state is applied on the first tick after it is ready.
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+import game_logic
+import metrics
+
+BOT_FILL = int(os.environ.get('BOT_FILL', 0))  # players per room that bots make up; 0 disables bots
+BOT_POOL = os.environ.get('BOT_POOL', 'thread')  # 'thread', 'process', or 'inline' to plan on the tick
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 2))
+
+BOT_SPEED = 15.0  # units per second
+BOT_PREFERRED_RANGE = 25.0  # bots close in to about this distance, then circle their target
+BOT_SEPARATION = 6.0  # bots steer away from players closer than this
+BOT_LOOKAHEAD = 10.0  # obstacles closer than this along the way are steered around
+BOT_SHOOT_RANGE = 80.0
+BOT_SHOT_INTERVAL = 1.2  # seconds between one bot's shots
+BOT_AIM_ERROR = 0.05  # spread of the aim direction
+BOT_RESPAWN_DELAY = 3.0
+MAX_PLAN_STEP = 0.25  # longest time one plan moves bots for, so a stalled pool does not teleport them
+SPAWN_RADIUS = (30.0, 60.0)
+
+# Upper bound on bots x players compared per NumPy chunk
+PLAN_CHUNK_ELEMENTS = 1 << 16
+
+# Everything plan_bots needs, copied out of the room so the pool never reads
+# live room state. Targets are all players in the room, bots included;
+# bot_slot is each bot's own row among them.
+PlanRequest = namedtuple('PlanRequest', 'map_name extent seed dt bot_position bot_heading bot_slot '
+                                        'bot_ready target_position target_alive')
+# New positions, headings (client rotation convention), shot mask and aim
+# directions per bot, and how long planning took
+Plan = namedtuple('Plan', 'position heading shoot direction seconds')
+
+
+def heading_vector(heading: np.ndarray) -> np.ndarray:
+    """Unit direction a rotation faces; rotation 0 looks down -z, as on the client"""
+    return np.stack([-np.sin(heading), np.zeros_like(heading), -np.cos(heading)], axis=1)
+
+
+def plan_bots(request: PlanRequest) -> Plan:
+    """Steering and aim for a room's live bots, computed for all of them at once
+
+    Each bot seeks the nearest other player until BOT_PREFERRED_RANGE, then
+    circles it; without one it wanders. Bots keep clear of other players and
+    of the arena's edge, turn aside from obstacles ahead (through the map's
+    BVH), and shoot when ready, in range and with a clear line of sight. A
+    pure function of the request, so it can run on a thread or in a process.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(request.seed)
+    position = request.bot_position
+    count = len(position)
+    rows = np.arange(count)
+    targets = request.target_position
+
+    target_distance = np.full(count, np.inf)
+    to_target = np.zeros((count, 3))
+    separation = np.zeros((count, 3))
+    chunk = max(1, PLAN_CHUNK_ELEMENTS // max(len(targets), 1))
+    for start in range(0, count, chunk):
+        stop = min(start + chunk, count)
+        offset = targets[None, :, :] - position[start:stop, None, :]
+        distance = np.sqrt(np.einsum('bpk,bpk->bp', offset, offset))
+        distance[np.arange(stop - start), request.bot_slot[start:stop]] = np.inf
+        distance[:, ~request.target_alive] = np.inf
+
+        nearest = np.argmin(distance, axis=1)
+        local = np.arange(stop - start)
+        target_distance[start:stop] = distance[local, nearest]
+        to_target[start:stop] = offset[local, nearest] / np.maximum(distance[local, nearest], 1e-9)[:, None]
+
+        # Push away from everyone too close, harder the closer they are
+        crowding = np.where(distance < BOT_SEPARATION, 1.0 / np.maximum(distance, 1e-3) ** 2, 0.0)
+        separation[start:stop] = -np.einsum('bp,bpk->bk', crowding, offset)
+    has_target = np.isfinite(target_distance)
+    to_target[~has_target] = 0.0
+
+    # Seek until the preferred range, then circle the target in the xz plane
+    circle = np.stack([-to_target[:, 2], np.zeros(count), to_target[:, 0]], axis=1)
+    closing = np.clip((target_distance - BOT_PREFERRED_RANGE) / BOT_PREFERRED_RANGE, -1.0, 1.0)
+    closing[~has_target] = 0.0
+    heading = request.bot_heading + rng.normal(0.0, 0.5, count) * request.dt
+    desired = np.where(has_target[:, None],
+                       to_target * closing[:, None] + circle * (1.0 - np.abs(closing))[:, None],
+                       heading_vector(heading))
+    desired += separation * BOT_SEPARATION
+
+    # Head back in when past the edge of the arena
+    outside = np.linalg.norm(position, axis=1) > request.extent
+    desired[outside] = -position[outside]
+
+    length = np.linalg.norm(desired, axis=1)
+    desired = np.where(length[:, None] > 1e-9, desired / np.maximum(length, 1e-9)[:, None],
+                       heading_vector(heading))
+
+    # Turn aside, alternately left and right, from obstacles in the way
+    geometry = game_logic.load_static_geometry(request.map_name)
+    blocked = geometry.raycast(position, desired, BOT_LOOKAHEAD)[0] >= 0
+    side = np.where(rows % 2 == 0, 1.0, -1.0)[blocked]
+    desired[blocked] = np.stack([-desired[blocked, 2] * side, desired[blocked, 1],
+                                 desired[blocked, 0] * side], axis=1)
+
+    moved = position + desired * (BOT_SPEED * request.dt)
+    new_heading = np.where(np.abs(desired[:, 0]) + np.abs(desired[:, 2]) > 1e-9,
+                           np.arctan2(-desired[:, 0], -desired[:, 2]), heading)
+
+    # Shoot from the new position at targets in range and in sight
+    aim = to_target + rng.normal(0.0, BOT_AIM_ERROR, (count, 3))
+    aim /= np.maximum(np.linalg.norm(aim, axis=1), 1e-9)[:, None]
+    shoot = request.bot_ready & has_target & (target_distance <= BOT_SHOOT_RANGE)
+    aiming = np.flatnonzero(shoot)
+    if len(aiming):
+        _, cover = geometry.raycast(moved[aiming], to_target[aiming], BOT_SHOOT_RANGE)
+        shoot[aiming[cover < target_distance[aiming]]] = False
+
+    return Plan(moved, new_heading, shoot, aim, time.perf_counter() - started)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def bot_executor(kind: str = BOT_POOL, workers: int = BOT_WORKERS) -> Optional[Executor]:
+    """Pool that plans every room's bots, created on first use; None for 'inline'"""
+    global _pool
+    if kind == 'inline':
+        return None
+    with _pool_lock:
+        if _pool is None:
+            if kind == 'process':
+                # Workers map the baked map geometry themselves (see load_static_geometry)
+                _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            elif kind == 'thread':
+                _pool = ThreadPoolExecutor(workers, thread_name_prefix='bots')
+            else:
+                raise ValueError(f"Unknown BOT_POOL: {kind}")
+        return _pool
+
+
+class BotSquad:
+    """The bots of one room: joining and leaving them, and planning their moves
+
+    update() runs at the start of every room tick. It tops the room up to
+    fill players (or removes bots as humans join), respawns eliminated bots,
+    applies a finished plan and requests the next one. With no executor,
+    plans are made and applied on the tick itself, which keeps offline
+    simulations deterministic.
+    """
+
+    def __init__(self, room, fill: int = BOT_FILL, executor: Optional[Executor] = None):
+        self.room = room
+        self.fill = fill
+        self.executor = executor
+        self.seed = zlib.crc32(room.room_id.encode())
+        self.rng = np.random.default_rng(self.seed)
+        self.ids = []  # bot player ids, in join order
+        self.next_number = 1
+        self.input_seq = {}  # bot id -> last input frame sent
+        self.heading = {}  # bot id -> rotation of its last move
+        self.last_shot = {}  # bot id -> clock time of its last shot
+        self.down_since = {}  # bot id -> clock time it was eliminated
+        self.pending = None  # (future, bot ids) of the plan being made
+        self.plans = 0
+        self.last_planned = None  # clock time of the last plan request
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, player_id: object) -> bool:
+        return player_id in self.input_seq
+
+    def update(self):
+        self.rebalance()
+        self.respawn()
+
+        if self.pending is not None:
+            future, bot_ids = self.pending
+            if not future.done():
+                # The pool is behind; bots keep their last move for this tick
+                metrics.BOT_PLANS_LATE.inc()
+                return
+            self.pending = None
+            try:
+                self.apply(bot_ids, future.result())
+            except Exception as e:
+                self.room.log(f'Bot planning failed in room {self.room.room_id}: {e}')
+
+        request, bot_ids = self.request()
+        if request is None:
+            return
+        if self.executor is None:
+            self.apply(bot_ids, plan_bots(request))
+        else:
+            self.pending = (self.executor.submit(plan_bots, request), bot_ids)
+
+    # Membership
+
+    def rebalance(self):
+        """Add or remove bots so humans and bots make up fill players"""
+        humans = len(self.room)
+        wanted = max(self.fill - humans, 0) if humans > 0 else 0
+        while len(self.ids) < wanted:
+            self.add_bot()
+        while len(self.ids) > wanted:
+            self.remove_bot(self.ids[-1])
+
+    def add_bot(self):
+        bot_id = f'bot-{self.next_number}'
+        self.next_number += 1
+        self.ids.append(bot_id)
+        self.input_seq[bot_id] = 0
+        self.heading[bot_id] = float(self.rng.uniform(-math.pi, math.pi))
+        # Staggered, so a room's bots do not all fire on the same tick
+        self.last_shot[bot_id] = self.room.clock() - float(self.rng.uniform(0.0, BOT_SHOT_INTERVAL))
+        self.room.add_player(bot_id)
+        self.move(bot_id, self.spawn_point(), self.heading[bot_id])
+        self.room.emit('player_joined', {
+            'player': self.room.public_player_state(bot_id),
+            'total_players': len(self.room)
+        })
+
+    def remove_bot(self, bot_id: str):
+        self.room.remove_player(bot_id)
+        self.ids.remove(bot_id)
+        for state in (self.input_seq, self.heading, self.last_shot, self.down_since):
+            state.pop(bot_id, None)
+        self.room.emit('player_left', {'player_id': bot_id, 'total_players': len(self.room)})
+
+    def spawn_point(self):
+        """A random point on a shell around the arena's spawn point"""
+        direction = self.rng.normal(size=3)
+        direction[1] *= 0.2  # mostly level with the arena's middle
+        direction /= max(float(np.linalg.norm(direction)), 1e-9)
+        return (direction * self.rng.uniform(*SPAWN_RADIUS)).tolist()
+
+    def respawn(self):
+        """Bring eliminated bots back at a new spawn point after BOT_RESPAWN_DELAY"""
+        now = self.room.clock()
+        players = self.room.players
+        for bot_id in self.ids:
+            if bot_id not in self.down_since:
+                if players[bot_id]['health'] <= 0:
+                    self.down_since[bot_id] = now
+            elif now - self.down_since[bot_id] >= BOT_RESPAWN_DELAY:
+                del self.down_since[bot_id]
+                self.room.respawn_player(bot_id)
+                self.move(bot_id, self.spawn_point(), self.heading[bot_id])
+
+    # Planning
+
+    def request(self):
+        """A PlanRequest for the live bots, and their ids; (None, None) without any"""
+        now = self.room.clock()
+        dt = min(now - self.last_planned, MAX_PLAN_STEP) if self.last_planned is not None else 0.0
+        self.last_planned = now
+        bot_ids = [bot_id for bot_id in self.ids if bot_id not in self.down_since]
+        if not bot_ids:
+            return None, None
+
+        players = self.room.players
+        with self.room.lock:
+            position, _, health, active = players.arrays()
+            slots = np.flatnonzero(active)
+            row_of_slot = {slot: row for row, slot in enumerate(slots.tolist())}
+            bot_slot = np.array([row_of_slot[players.slot_of[bot_id]] for bot_id in bot_ids], dtype=np.int64)
+            # Copies: the plan may run while the room moves on
+            target_position = position[slots].copy()
+            target_alive = health[slots] > 0
+
+        self.plans += 1
+        request = PlanRequest(
+            map_name=self.room.world.map_name,
+            extent=game_logic.MAPS[self.room.world.map_name]['extent'],
+            seed=(self.seed, self.plans),
+            dt=dt,
+            bot_position=target_position[bot_slot],
+            bot_heading=np.array([self.heading[bot_id] for bot_id in bot_ids]),
+            bot_slot=bot_slot,
+            bot_ready=np.array([now - self.last_shot[bot_id] >= BOT_SHOT_INTERVAL for bot_id in bot_ids]),
+            target_position=target_position,
+            target_alive=target_alive)
+        return request, bot_ids
+
+    def apply(self, bot_ids, plan: Plan):
+        """Send a plan's moves and shots through the room, as a client's would be"""
+        metrics.BOT_PLAN_SECONDS.observe(plan.seconds)
+        now = self.room.clock()
+        positions, headings = plan.position.tolist(), plan.heading.tolist()
+        directions, shoot = plan.direction.tolist(), plan.shoot.tolist()
+        for i, bot_id in enumerate(bot_ids):
+            if bot_id not in self or bot_id in self.down_since:
+                continue  # Removed or eliminated while the plan was made
+            self.move(bot_id, positions[i], headings[i])
+            if shoot[i]:
+                self.last_shot[bot_id] = now
+                self.room.queue_shot(bot_id, {'origin': dict(zip('xyz', positions[i])),
+                                              'direction': dict(zip('xyz', directions[i]))})
+
+    def move(self, bot_id: str, position, heading: float):
+        seq = self.input_seq[bot_id] = self.input_seq[bot_id] + 1
+        self.heading[bot_id] = heading
+        self.room.apply_move(bot_id, {'inputs': [[seq, position[0], position[1], position[2], heading]]})
+
+
+def test_plan_bots():
+    """Test that bots close in on a target, circle it and only shoot with a clear line"""
+    print("Testing bot planning...")
+    geometry = game_logic.load_static_geometry('nebula')
+    # A spot with nothing around it, so only the test's players matter
+    origin = np.array([0.0, 1.0, 0.0])
+    while geometry.overlaps(origin[None, :], 40.0)[0] >= 0:
+        origin += (7.0, 0.0, 3.0)
+    targets = np.array([origin, origin + (60.0, 0.0, 0.0), origin + (0.0, 0.0, 20.0)])
+
+    request = PlanRequest(map_name='nebula', extent=1000.0, seed=(1, 1), dt=0.1,
+                          bot_position=targets[1:], bot_heading=np.zeros(2), bot_slot=np.array([1, 2]),
+                          bot_ready=np.array([True, False]), target_position=targets,
+                          target_alive=np.array([True, True, True]))
+    plan = plan_bots(request)
+    step = np.linalg.norm(plan.position - targets[1:], axis=1)
+    closer = np.linalg.norm(plan.position[0] - origin) < 60.0
+    # The second bot is at its preferred range from the first player: it circles
+    circling = abs(np.linalg.norm(plan.position[1] - origin) - 20.0) < 0.5
+
+    print(f"Moved {step.round(2).tolist()}, closing in: {closer}, circling: {circling}, "
+          f"shooting: {plan.shoot.tolist()}")
+
+    return (np.allclose(step, BOT_SPEED * 0.1) and closer and circling
+            and plan.shoot.tolist() == [True, False])
+
+
+if __name__ == '__main__':
+    print("Running bot tests...")
+    test_plan_bots()
+    print("Tests completed!")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Run the 3D Arena Shooter backend as several worker processes
+
+Each worker is a full server process listening on base port + index and
+owning the rooms that hash to its index (see server.worker_for_room).
+Clients ask any worker's /route endpoint which worker serves their room and
+connect there, so a connection always stays on one process. Cross-worker
+events such as lobby counts and /health aggregation go through the message
+bus: a multiprocessing queue bus by default, or Redis with --bus redis://...
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+
+def run_worker(index, count, bus, base_port, host):
+    """Entry point of one worker process"""
+    os.environ['WORKER_INDEX'] = str(index)
+    os.environ['WORKER_COUNT'] = str(count)
+    os.environ['BASE_PORT'] = str(base_port)
+
+    import server
+    server.configure_worker(index, count, bus or server.bus, base_port)
+    server.start_background_tasks()
+
+    port = base_port + index
+    print(f"Worker {index}/{count} (pid {os.getpid()}) listening on port {port}")
+    server.socketio.run(server.app, host=host, port=port, allow_unsafe_werkzeug=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the game server on several worker processes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument('--base-port', type=int, default=5000,
+                        help="port of worker 0; worker i listens on base port + i")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--bus', default='multiprocessing',
+                        help="'multiprocessing' or a redis:// URL")
+    args = parser.parse_args()
+
+    # Bake every map's obstacle geometry up front, so workers only map the cached files
+    import game_logic
+    for map_name in game_logic.MAPS:
+        game_logic.load_static_geometry(map_name)
+
+    context = multiprocessing.get_context('spawn')
+    if args.bus == 'multiprocessing':
+        import message_bus
+        buses = message_bus.MultiprocessingBus.create_group(args.workers, context)
+    else:
+        # Each worker connects to the shared bus itself, from MESSAGE_BUS
+        os.environ['MESSAGE_BUS'] = args.bus
+        buses = [None] * args.workers
+
+    workers = []
+    for index in range(args.workers):
+        process = context.Process(target=run_worker, name=f'worker-{index}',
+                                  args=(index, args.workers, buses[index], args.base_port, args.host))
+        process.start()
+        workers.append(process)
+
+    print(f"Started {len(workers)} workers on ports {args.base_port}-{args.base_port + len(workers) - 1}")
+
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping workers...")
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+
+    return all(process.exitcode in (0, -15) for process in workers)
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
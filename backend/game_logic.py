@@ -1,17 +1,95 @@
 # game_logic.py
 # Game logic and C++ bindings for 3D Arena Shooter
 
+import hashlib
+import json
 import math
-from typing import Dict, Any, Optional
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, Any, Callable, Optional, Sequence
+
+import numpy as np
 
 try:
     import cpp_logic
     CPP_AVAILABLE = True
-    print("C++ game logic module loaded successfully")
+    CPP_IMPORT_ERROR = None
 except ImportError as e:
     cpp_logic = None
     CPP_AVAILABLE = False
-    print(f"C++ game logic module not available: {e}")
+    CPP_IMPORT_ERROR = str(e)
+
+# Set REQUIRE_CPP_LOGIC=1 in production to fail at startup instead of running
+# on the Python fallbacks or an unoptimized module
+REQUIRE_CPP_LOGIC = os.environ.get('REQUIRE_CPP_LOGIC', '0') == '1'
+CPP_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cpp', 'cpp_logic.cpp')
+
+# Which entry points take the C++ path when it is available, from the results
+# of benchmark.py. The scalar helpers lose to plain Python because the
+# binding's per-call argument conversion costs more than the math itself.
+CPP_DISPATCH = {
+    'spheres_intersect_coords': False,
+    'ray_sphere_intersect': False,
+    'check_ray_hit': True,
+    'batch_ray_hit': True,
+    'batch_ray_hit_hitboxes': True,
+    'sphere_overlaps': True,
+    'bvh_raycast': True,
+    'bvh_sphere_overlaps': True,
+}
+
+# Native threads used by the C++ batch functions; 0 means one per core
+COLLISION_THREADS = int(os.environ.get('COLLISION_THREADS', '0'))
+if CPP_AVAILABLE and hasattr(cpp_logic, 'set_thread_count'):
+    cpp_logic.set_thread_count(COLLISION_THREADS)
+
+def backend_report() -> Dict[str, Any]:
+    """Which collision backend is active and, for C++, how the module was built"""
+    if cpp_logic is None:
+        return {'backend': 'python', 'error': CPP_IMPORT_ERROR,
+                'warnings': ['collision checks use the slower Python fallbacks; build cpp_logic with cpp/build.py']}
+
+    build = dict(getattr(cpp_logic, 'build_info', {}))
+    warnings = []
+    if not build:
+        warnings.append('cpp_logic predates build_info; rebuild it with cpp/build.py')
+    elif not build.get('optimized'):
+        warnings.append(f"cpp_logic was built without optimizations "
+                        f"(build type {build.get('build_type') or 'not set'})")
+    if build.get('source_hash') and os.path.exists(CPP_SOURCE):
+        with open(CPP_SOURCE, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() != build['source_hash']:
+                warnings.append('cpp_logic is older than cpp/cpp_logic.cpp; rebuild it with cpp/build.py')
+    return {
+        'backend': 'cpp' if CPP_AVAILABLE else 'python',
+        'module': getattr(cpp_logic, '__file__', None),
+        'build': build,
+        'threads': cpp_logic.thread_count() if hasattr(cpp_logic, 'thread_count') else 1,
+        'warnings': warnings,
+    }
+
+def print_backend_report(report: Dict[str, Any]):
+    if report['backend'] == 'cpp':
+        build = report['build']
+        print("C++ game logic module loaded successfully: "
+              + ', '.join(filter(None, [build.get('build_type'), build.get('flags'), build.get('compiler'),
+                                        f"collision threads: {report['threads']}"])))
+    else:
+        print(f"C++ game logic module not available: {report.get('error')}")
+    for warning in report['warnings']:
+        print(f"WARNING: {warning}")
+
+BACKEND_REPORT = backend_report()
+print_backend_report(BACKEND_REPORT)
+if REQUIRE_CPP_LOGIC and (cpp_logic is None or not BACKEND_REPORT['build'].get('optimized')):
+    raise ImportError(f"REQUIRE_CPP_LOGIC is set but no optimized cpp_logic is available: "
+                      f"{CPP_IMPORT_ERROR or BACKEND_REPORT['warnings']}")
+
+# Calls per (function, serving backend), exported by the servers' /metrics.
+# Keys are created up front so counting is a single dict update.
+CALL_COUNTS = {(name, backend): 0 for name in CPP_DISPATCH for backend in ('cpp', 'python')}
+CALL_COUNTS['check_ray_hit', 'python_fallback'] = 0
 
 def add(a: int, b: int) -> int:
     """Add two numbers using C++ if available, otherwise Python"""
@@ -22,8 +100,10 @@ def add(a: int, b: int) -> int:
 def spheres_intersect_coords(x1: float, y1: float, z1: float, r1: float,
                            x2: float, y2: float, z2: float, r2: float) -> bool:
     """Check if two spheres intersect using coordinates"""
-    if CPP_AVAILABLE:
+    if CPP_AVAILABLE and CPP_DISPATCH['spheres_intersect_coords']:
+        CALL_COUNTS['spheres_intersect_coords', 'cpp'] += 1
         return cpp_logic.spheres_intersect_coords(x1, y1, z1, r1, x2, y2, z2, r2)
+    CALL_COUNTS['spheres_intersect_coords', 'python'] += 1
     
     # Python fallback implementation
     distance = math.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2)
@@ -47,11 +127,14 @@ def spheres_intersect(sphere1: Any, sphere2: Any) -> bool:
 
 def ray_sphere_intersect(ray: Any, sphere: Any) -> Optional[float]:
     """Check if a ray intersects with a sphere, returns intersection distance or None"""
-    if CPP_AVAILABLE and hasattr(cpp_logic, 'Ray') and hasattr(cpp_logic, 'Sphere'):
+    if (CPP_AVAILABLE and CPP_DISPATCH['ray_sphere_intersect']
+            and hasattr(cpp_logic, 'Ray') and hasattr(cpp_logic, 'Sphere')):
+        CALL_COUNTS['ray_sphere_intersect', 'cpp'] += 1
         t = 0.0
         if cpp_logic.ray_sphere_intersect(ray, sphere, t):
             return t
         return None
+    CALL_COUNTS['ray_sphere_intersect', 'python'] += 1
     
     # Python fallback implementation
     if hasattr(ray, 'origin') and hasattr(ray, 'direction') and hasattr(sphere, 'center'):
@@ -79,20 +162,46 @@ def ray_sphere_intersect(ray: Any, sphere: Any) -> Optional[float]:
     
     return None
 
-def check_ray_hit(ray_data: Dict[str, Any], players: Dict[str, Any]) -> Dict[str, Any]:
-    """Check if a ray hits any players, using C++ if available"""
-    if CPP_AVAILABLE:
+def check_ray_hit(ray_data: Dict[str, Any], players: Dict[str, Any],
+                  exclude_id: Optional[str] = None) -> Dict[str, Any]:
+    """Check if a ray hits any player's hitboxes, using C++ if available
+    
+    exclude_id skips one player, normally the shooter.
+    """
+    if hasattr(players, 'arrays'):
+        # PlayerStore: test against its arrays without building dicts
+        position, rotation, _, active = players.arrays()
+        return check_ray_hit_arrays(ray_data, players.ids, position, rotation, players.hitbox[:len(active)],
+                                    active, exclude=players.slot_of.get(exclude_id, -1))
+    
+    if exclude_id is not None:
+        players = {pid: data for pid, data in players.items() if pid != exclude_id}
+    
+    if CPP_AVAILABLE and CPP_DISPATCH['check_ray_hit']:
         try:
-            return cpp_logic.check_ray_hit_spheres(ray_data, players)
+            result = check_ray_hit_arrays(ray_data, *player_arrays(players))
+            CALL_COUNTS['check_ray_hit', 'cpp'] += 1
+            return result
         except Exception as e:
             print(f"Error in C++ ray hit detection: {e}")
             # Fall back to Python implementation
+            CALL_COUNTS['check_ray_hit', 'python_fallback'] += 1
+    else:
+        CALL_COUNTS['check_ray_hit', 'python'] += 1
     
     # Python fallback implementation
     return python_check_ray_hit(ray_data, players)
 
-def python_check_ray_hit(ray_data: Dict[str, Any], players: Dict[str, Any]) -> Dict[str, Any]:
-    """Python implementation of ray hit detection"""
+def check_ray_hit_arrays(ray_data: Dict[str, Any], ids: Sequence[Optional[str]],
+                         positions: np.ndarray, rotations: Optional[np.ndarray] = None,
+                         hitbox: Any = 0, active: Optional[np.ndarray] = None,
+                         exclude: int = -1) -> Dict[str, Any]:
+    """Ray hit detection against the hitboxes of players given as arrays
+    
+    ids maps each row of the (N, 3) positions to its player id. rotations
+    default to 0 and hitbox is a HITBOX_TABLE set index per row or for all.
+    Rows where active is False and the row given by exclude are skipped.
+    """
     origin = ray_data.get('origin', {})
     direction = ray_data.get('direction', {})
     
@@ -101,73 +210,1272 @@ def python_check_ray_hit(ray_data: Dict[str, Any], players: Dict[str, Any]) -> D
     if not all(key in direction for key in ['x', 'y', 'z']):
         return {'hit': False}
     
-    # Normalize direction
-    dir_length = math.sqrt(direction['x']**2 + direction['y']**2 + direction['z']**2)
-    if dir_length == 0:
+    origins = np.array([[origin['x'], origin['y'], origin['z']]], dtype=np.float64)
+    directions = np.array([[direction['x'], direction['y'], direction['z']]], dtype=np.float64)
+    if rotations is None:
+        rotations = np.zeros(len(positions))
+    index, distance, point, shape = batch_ray_hit_hitboxes(origins, directions, positions, rotations, hitbox,
+                                                           exclude=np.array([exclude], dtype=np.int64),
+                                                           active=active)
+    return ray_hit_result(ids, int(index[0]), float(distance[0]), point[0], shape=int(shape[0]))
+
+def ray_hit_result(ids: Sequence[Optional[str]], index: int, distance: float,
+                   point: np.ndarray, damage: int = 25, shape: int = -1) -> Dict[str, Any]:
+    """Build the hit_data dict sent to clients from one row of batch results
+    
+    With the HITBOX_TABLE shape that was hit, damage is scaled by its
+    multiplier and the region it belongs to is included.
+    """
+    if index < 0:
         return {'hit': False}
+    result = {
+        'hit': True,
+        'target_id': ids[index],
+        'distance': distance,
+        'hit_position': {
+            'x': float(point[0]),
+            'y': float(point[1]),
+            'z': float(point[2])
+        },
+        'damage': damage
+    }
+    if shape >= 0:
+        result['damage'] = int(round(damage * HITBOX_TABLE.multiplier(shape)))
+        result['region'] = HITBOX_TABLE.region(shape)
+    return result
+
+# Upper bound on rays x spheres handled per NumPy chunk, keeps temporaries small
+BATCH_CHUNK_ELEMENTS = 1 << 18
+
+def batch_ray_hit(origins: np.ndarray, directions: np.ndarray, centers: np.ndarray,
+                  radii: Any = 0.5, exclude: Optional[np.ndarray] = None,
+                  active: Optional[np.ndarray] = None,
+                  max_distance: float = math.inf, out: Optional[tuple] = None):
+    """Nearest hit of each of M rays against N spheres
+    
+    origins and directions are (M, 3), centers is (N, 3) and radii a scalar
+    or (N,). exclude gives per ray one sphere index to skip (-1 for none) and
+    active masks out unused spheres. Returns (index, distance, hit_point)
+    arrays of shape (M,), (M,) and (M, 3); misses have index -1, distance inf
+    and a NaN hit point. Results are written into out when given, an
+    (int64, float64, float64) tuple of arrays with those shapes.
+    
+    C-contiguous float64 positions, int64 exclude and bool active arrays (the
+    PlayerStore layout) are read by the C++ code in place, without copies.
+    """
+    origins = np.ascontiguousarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.ascontiguousarray(directions, dtype=np.float64).reshape(-1, 3)
+    centers = np.ascontiguousarray(centers, dtype=np.float64).reshape(-1, 3)
+    radii = np.ascontiguousarray(radii, dtype=np.float64).reshape(-1)
+    if exclude is not None:
+        exclude = np.ascontiguousarray(exclude, dtype=np.int64)
+    if active is not None:
+        active = np.ascontiguousarray(active, dtype=bool)
     
-    dir_x = direction['x'] / dir_length
-    dir_y = direction['y'] / dir_length
-    dir_z = direction['z'] / dir_length
+    if CPP_AVAILABLE and CPP_DISPATCH['batch_ray_hit'] and hasattr(cpp_logic, 'batch_ray_hit_spheres_into'):
+        CALL_COUNTS['batch_ray_hit', 'cpp'] += 1
+        if out is None:
+            ray_count = len(origins)
+            out = (np.empty(ray_count, dtype=np.int64), np.empty(ray_count), np.empty((ray_count, 3)))
+        cpp_logic.batch_ray_hit_spheres_into(origins, directions, centers, radii, *out,
+                                             exclude, active, max_distance)
+        return out
     
-    closest_t = float('inf')
-    closest_player_id = None
-    closest_hit_point = None
+    radii = np.broadcast_to(radii, (len(centers),))
+    if CPP_AVAILABLE and CPP_DISPATCH['batch_ray_hit'] and hasattr(cpp_logic, 'batch_ray_hit_spheres'):
+        # Modules built before batch_ray_hit_spheres_into existed
+        CALL_COUNTS['batch_ray_hit', 'cpp'] += 1
+        result = cpp_logic.batch_ray_hit_spheres(origins, directions, centers, radii,
+                                                 exclude, active, max_distance)
+    else:
+        CALL_COUNTS['batch_ray_hit', 'python'] += 1
+        result = python_batch_ray_hit(origins, directions, centers, radii, exclude, active, max_distance)
+    
+    if out is None:
+        return result
+    for target, values in zip(out, result):
+        target[...] = values
+    return out
+
+def python_batch_ray_hit(origins: np.ndarray, directions: np.ndarray, centers: np.ndarray,
+                         radii: np.ndarray, exclude: Optional[np.ndarray] = None,
+                         active: Optional[np.ndarray] = None,
+                         max_distance: float = math.inf):
+    """NumPy implementation of batch_ray_hit, processing rays in chunks"""
+    ray_count = len(origins)
+    sphere_count = len(centers)
     
+    hit_index = np.full(ray_count, -1, dtype=np.int64)
+    hit_distance = np.full(ray_count, np.inf)
+    hit_point = np.full((ray_count, 3), np.nan)
+    if ray_count == 0 or sphere_count == 0:
+        return hit_index, hit_distance, hit_point
+    
+    lengths = np.sqrt(np.einsum('ij,ij->i', directions, directions))
+    usable = lengths > 0
+    unit = directions / np.where(usable, lengths, 1.0)[:, None]
+    radii_sq = radii * radii
+    
+    chunk = max(1, BATCH_CHUNK_ELEMENTS // sphere_count)
+    for start in range(0, ray_count, chunk):
+        stop = min(start + chunk, ray_count)
+        o = origins[start:stop]
+        d = unit[start:stop]
+        
+        # Unit directions, so the quadratic's a term is 1
+        oc = o[:, None, :] - centers[None, :, :]
+        b = np.einsum('mnk,mk->mn', oc, d)
+        c = np.einsum('mnk,mnk->mn', oc, oc) - radii_sq
+        discriminant = b * b - c
+        
+        valid = (discriminant >= 0) & usable[start:stop, None]
+        if active is not None:
+            valid &= active[None, :]
+        if exclude is not None:
+            rows = np.flatnonzero(exclude[start:stop] >= 0)
+            valid[rows, exclude[start:stop][rows]] = False
+        
+        sqrt_disc = np.sqrt(np.where(valid, discriminant, 0.0))
+        t1 = -b - sqrt_disc
+        t = np.where(t1 > 0, t1, -b + sqrt_disc)
+        t = np.where(valid & (t > 0) & (t <= max_distance), t, np.inf)
+        
+        nearest = np.argmin(t, axis=1)
+        nearest_t = t[np.arange(stop - start), nearest]
+        hit = np.isfinite(nearest_t)
+        
+        hit_index[start:stop] = np.where(hit, nearest, -1)
+        hit_distance[start:stop] = nearest_t
+        hit_point[start:stop][hit] = o[hit] + d[hit] * nearest_t[hit, None]
+    
+    return hit_index, hit_distance, hit_point
+
+def sphere_overlaps(centers: np.ndarray, radii: Any = 0.5, active: Optional[np.ndarray] = None,
+                    candidates: Optional[np.ndarray] = None) -> np.ndarray:
+    """Overlapping (touching counts) pairs of N spheres as a (K, 2) int64 array
+    
+    Without candidates all pairs are tested and the result lists i < j pairs
+    in ascending order. candidates is a (K, 2) array of index pairs from a
+    broadphase such as SpatialGrid; only those are tested and the overlapping
+    ones come back in input order. Spheres where active is False never
+    overlap. The C++ path splits the work over COLLISION_THREADS native
+    threads without holding the GIL; results do not depend on the count.
+    """
+    centers = np.ascontiguousarray(centers, dtype=np.float64).reshape(-1, 3)
+    radii = np.ascontiguousarray(radii, dtype=np.float64).reshape(-1)
+    if active is not None:
+        active = np.ascontiguousarray(active, dtype=bool)
+    if candidates is not None:
+        candidates = np.ascontiguousarray(candidates, dtype=np.int64).reshape(-1, 2)
+    
+    if CPP_AVAILABLE and CPP_DISPATCH['sphere_overlaps'] and hasattr(cpp_logic, 'sphere_overlaps'):
+        CALL_COUNTS['sphere_overlaps', 'cpp'] += 1
+        return cpp_logic.sphere_overlaps(centers, radii, active, candidates)
+    
+    CALL_COUNTS['sphere_overlaps', 'python'] += 1
+    return python_sphere_overlaps(centers, np.broadcast_to(radii, (len(centers),)), active, candidates)
+
+def python_sphere_overlaps(centers: np.ndarray, radii: np.ndarray, active: Optional[np.ndarray] = None,
+                           candidates: Optional[np.ndarray] = None) -> np.ndarray:
+    """NumPy implementation of sphere_overlaps, testing rows in chunks"""
+    if candidates is not None:
+        i, j = candidates[:, 0], candidates[:, 1]
+        reach = radii[i] + radii[j]
+        offset = centers[i] - centers[j]
+        overlap = (np.einsum('ij,ij->i', offset, offset) <= reach * reach) & (i != j)
+        if active is not None:
+            overlap &= active[i] & active[j]
+        return candidates[overlap]
+    
+    count = len(centers)
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    chunk = max(1, BATCH_CHUNK_ELEMENTS // max(count, 1))
+    for start in range(0, count, chunk):
+        stop = min(start + chunk, count)
+        offset = centers[start:stop, None, :] - centers[None, :, :]
+        reach = radii[start:stop, None] + radii[None, :]
+        overlap = np.einsum('mnk,mnk->mn', offset, offset) <= reach * reach
+        # Upper triangle only: each pair once, i < j
+        overlap &= np.arange(count)[None, :] > np.arange(start, stop)[:, None]
+        if active is not None:
+            overlap &= active[start:stop, None] & active[None, :]
+        rows, columns = np.nonzero(overlap)
+        pairs.append(np.stack([rows + start, columns], axis=1).astype(np.int64))
+    return np.concatenate(pairs)
+
+# Hitboxes: players are hit on a set of shapes rather than one sphere. Shapes
+# are given in the player's own frame (x right, y up, facing -z) and turn with
+# its rotation about y; each belongs to a region whose multiplier scales the
+# damage of shots that land on it. Hit tests run in two phases: rays are
+# first tested against every player's bounding sphere, and only the players a
+# ray passes get the shape tests, nearest bounding sphere first, stopping as
+# soon as the next one starts beyond the nearest hit found.
+HITBOX_SPHERE, HITBOX_CAPSULE, HITBOX_BOX = 0, 1, 2
+HITBOX_KINDS = {'sphere': HITBOX_SPHERE, 'capsule': HITBOX_CAPSULE, 'box': HITBOX_BOX}
+HITBOX_REGIONS = ('body', 'head', 'wing')
+
+# One shape: a sphere around a, a capsule around the segment from a to b, or
+# a box centered on a with half extents b. Matches Hitbox in cpp_logic.cpp.
+HITBOX_DTYPE = np.dtype([('kind', '<i4'), ('region', '<i4'), ('a', '<f8', (3,)), ('b', '<f8', (3,)),
+                         ('radius', '<f8'), ('multiplier', '<f8')])
+
+# Hitbox sets by name; players get DEFAULT_HITBOX unless they join with another
+HITBOXES = {
+    # Roughly the client's ship: fuselage, cockpit and wings
+    'fighter': [
+        {'shape': 'capsule', 'region': 'body', 'a': (0.0, 0.0, 1.5), 'b': (0.0, 0.0, -1.2), 'radius': 0.6},
+        {'shape': 'sphere', 'region': 'head', 'a': (0.0, 0.35, -1.4), 'radius': 0.45, 'multiplier': 2.0},
+        {'shape': 'box', 'region': 'wing', 'a': (0.0, 0.0, 0.8), 'b': (1.8, 0.1, 0.5), 'multiplier': 0.5},
+    ],
+}
+DEFAULT_HITBOX = 'fighter'
+
+class HitboxTable:
+    """Hitbox sets flattened into the arrays the hit tests take
+    
+    shapes holds every set's shapes back to back, set i owning
+    shapes[first[i]:first[i + 1]]. bound[i] is the radius around a player's
+    position that contains all shapes of set i however the player is turned.
+    """
+    
+    def __init__(self, sets: Dict[str, list]):
+        self.names = list(sets)
+        if not all(sets[name] for name in self.names):
+            raise ValueError("Hitbox sets must have at least one shape")
+        shapes = [shape for name in self.names for shape in sets[name]]
+        self.shapes = np.zeros(len(shapes), dtype=HITBOX_DTYPE)
+        for i, shape in enumerate(shapes):
+            self.shapes[i] = (HITBOX_KINDS[shape['shape']], HITBOX_REGIONS.index(shape['region']),
+                              shape['a'], shape.get('b', shape['a']), shape.get('radius', 0.0),
+                              shape.get('multiplier', 1.0))
+        self.first = np.cumsum([0] + [len(sets[name]) for name in self.names]).astype(np.int32)
+        
+        shapes = self.shapes
+        a = np.linalg.norm(shapes['a'], axis=1)
+        b = np.linalg.norm(shapes['b'], axis=1)
+        reach = np.where(shapes['kind'] == HITBOX_BOX, a + b,
+                         np.where(shapes['kind'] == HITBOX_CAPSULE, np.maximum(a, b), a) + shapes['radius'])
+        self.bound = np.maximum.reduceat(reach, self.first[:-1])
+        # Plain tuples for the scalar Python tests
+        self.rows = [(int(s['kind']), tuple(s['a'].tolist()), tuple(s['b'].tolist()), float(s['radius']))
+                     for s in shapes]
+    
+    def index(self, name: str) -> int:
+        """Set index of a hitbox set name; raises ValueError for unknown names"""
+        return self.names.index(name)
+    
+    def region(self, shape: int) -> str:
+        return HITBOX_REGIONS[self.shapes['region'][shape]]
+    
+    def multiplier(self, shape: int) -> float:
+        return float(self.shapes['multiplier'][shape])
+
+HITBOX_TABLE = HitboxTable(HITBOXES)
+
+def ray_hitbox_distance(ox: float, oy: float, oz: float, dx: float, dy: float, dz: float,
+                        shape: tuple) -> Optional[float]:
+    """First positive distance along a unit-direction ray to one shape (a HitboxTable row)"""
+    kind, a, b, radius = shape
+    if kind == HITBOX_SPHERE:
+        return ray_sphere_distance(ox, oy, oz, dx, dy, dz, a[0], a[1], a[2], radius)
+    
+    if kind == HITBOX_BOX:
+        # Slab test; a ray parallel to a slab misses unless it starts between its planes
+        t_near, t_far = -math.inf, math.inf
+        for o, d, center, half in ((ox, dx, a[0], b[0]), (oy, dy, a[1], b[1]), (oz, dz, a[2], b[2])):
+            if d == 0:
+                if o < center - half or o > center + half:
+                    return None
+                continue
+            t1 = (center - half - o) / d
+            t2 = (center + half - o) / d
+            t_near = max(t_near, min(t1, t2))
+            t_far = min(t_far, max(t1, t2))
+        if t_near > t_far or t_far <= 0:
+            return None
+        return t_near if t_near > 0 else t_far
+    
+    # Capsule: the nearest of its end spheres and the cylinder between them
+    best = None
+    for cx, cy, cz in (a, b):
+        t = ray_sphere_distance(ox, oy, oz, dx, dy, dz, cx, cy, cz, radius)
+        if t is not None and (best is None or t < best):
+            best = t
+    ux, uy, uz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    length = math.sqrt(ux * ux + uy * uy + uz * uz)
+    if length > 0:
+        ux, uy, uz = ux / length, uy / length, uz / length
+        ocx, ocy, ocz = ox - a[0], oy - a[1], oz - a[2]
+        along = dx * ux + dy * uy + dz * uz
+        start = ocx * ux + ocy * uy + ocz * uz
+        # The ray and its origin with the axis component removed
+        px, py, pz = dx - along * ux, dy - along * uy, dz - along * uz
+        qx, qy, qz = ocx - start * ux, ocy - start * uy, ocz - start * uz
+        qa = px * px + py * py + pz * pz
+        if qa > 1e-12:
+            qb = qx * px + qy * py + qz * pz
+            qc = qx * qx + qy * qy + qz * qz - radius * radius
+            discriminant = qb * qb - qa * qc
+            if discriminant >= 0:
+                sqrt_disc = math.sqrt(discriminant)
+                for t in ((-qb - sqrt_disc) / qa, (-qb + sqrt_disc) / qa):
+                    if t > 0 and 0 <= start + t * along <= length and (best is None or t < best):
+                        best = t
+    return best
+
+def hitbox_ray_hit(origin: Sequence[float], direction: Sequence[float], position: Sequence[float],
+                   rotation: float, hitbox: int, table: Optional[HitboxTable] = None,
+                   max_distance: float = math.inf) -> Optional[tuple]:
+    """Nearest (distance, shape) of a unit-direction ray on one player's hitboxes, or None"""
+    table = HITBOX_TABLE if table is None else table
+    # Into the player's frame: undo its rotation about y
+    cos, sin = math.cos(rotation), math.sin(rotation)
+    x, y, z = origin[0] - position[0], origin[1] - position[1], origin[2] - position[2]
+    ox, oy, oz = x * cos - z * sin, y, x * sin + z * cos
+    dx, dy, dz = direction[0] * cos - direction[2] * sin, direction[1], direction[0] * sin + direction[2] * cos
+    
+    best = None
+    for shape in range(int(table.first[hitbox]), int(table.first[hitbox + 1])):
+        t = ray_hitbox_distance(ox, oy, oz, dx, dy, dz, table.rows[shape])
+        if t is not None and t <= max_distance and (best is None or t < best[0]):
+            best = (t, shape)
+    return best
+
+def batch_ray_hit_hitboxes(origins: np.ndarray, directions: np.ndarray, positions: np.ndarray,
+                           rotations: np.ndarray, hitbox: Any = 0, exclude: Optional[np.ndarray] = None,
+                           active: Optional[np.ndarray] = None, max_distance: float = math.inf,
+                           table: Optional[HitboxTable] = None):
+    """Nearest hitbox hit of each of M rays against N players
+    
+    positions is (N, 3) and rotations (N,); hitbox is each player's set in
+    table (HITBOX_TABLE by default), per player or one for all. exclude and
+    active work as in batch_ray_hit. Returns (index, distance, hit_point,
+    shape) arrays, shape being the row of table.shapes that was hit; misses
+    have index and shape -1, distance inf and a NaN hit point. Equal
+    distances go to the lower player index, then the lower shape.
+    """
+    table = HITBOX_TABLE if table is None else table
+    origins = np.ascontiguousarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.ascontiguousarray(directions, dtype=np.float64).reshape(-1, 3)
+    positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+    rotations = np.ascontiguousarray(rotations, dtype=np.float64).reshape(-1)
+    hitbox = np.ascontiguousarray(np.broadcast_to(np.asarray(hitbox, dtype=np.int32), (len(positions),)))
+    if exclude is not None:
+        exclude = np.ascontiguousarray(exclude, dtype=np.int64)
+    if active is not None:
+        active = np.ascontiguousarray(active, dtype=bool)
+    
+    if CPP_AVAILABLE and CPP_DISPATCH['batch_ray_hit_hitboxes'] and hasattr(cpp_logic, 'batch_ray_hit_hitboxes'):
+        CALL_COUNTS['batch_ray_hit_hitboxes', 'cpp'] += 1
+        return cpp_logic.batch_ray_hit_hitboxes(origins, directions, positions, rotations, hitbox,
+                                                table.shapes, table.first, table.bound,
+                                                exclude, active, max_distance)
+    
+    CALL_COUNTS['batch_ray_hit_hitboxes', 'python'] += 1
+    return python_batch_ray_hit_hitboxes(origins, directions, positions, rotations, hitbox, table,
+                                         exclude, active, max_distance)
+
+def python_batch_ray_hit_hitboxes(origins: np.ndarray, directions: np.ndarray, positions: np.ndarray,
+                                  rotations: np.ndarray, hitbox: np.ndarray, table: HitboxTable,
+                                  exclude: Optional[np.ndarray] = None, active: Optional[np.ndarray] = None,
+                                  max_distance: float = math.inf):
+    """NumPy bounding sphere phase, then the scalar shape tests, nearest first"""
+    ray_count = len(origins)
+    player_count = len(positions)
+    
+    hit_index = np.full(ray_count, -1, dtype=np.int64)
+    hit_distance = np.full(ray_count, np.inf)
+    hit_point = np.full((ray_count, 3), np.nan)
+    hit_shape = np.full(ray_count, -1, dtype=np.int64)
+    if ray_count == 0 or player_count == 0:
+        return hit_index, hit_distance, hit_point, hit_shape
+    
+    # Sums written out term by term (not einsum) so rounding matches cpp_logic
+    # and both paths resolve near-ties to the same shape
+    lengths = np.sqrt(directions[:, 0] * directions[:, 0] + directions[:, 1] * directions[:, 1]
+                      + directions[:, 2] * directions[:, 2])
+    usable = lengths > 0
+    unit = directions / np.where(usable, lengths, 1.0)[:, None]
+    bound = table.bound[hitbox]
+    rows = positions.tolist(), rotations.tolist(), hitbox.tolist()
+    
+    chunk = max(1, BATCH_CHUNK_ELEMENTS // player_count)
+    for start in range(0, ray_count, chunk):
+        stop = min(start + chunk, ray_count)
+        o = origins[start:stop]
+        d = unit[start:stop]
+        
+        # Where each ray enters each bounding sphere (0 if it starts inside), inf if it misses
+        ocx, ocy, ocz = (o[:, None, k] - positions[None, :, k] for k in range(3))
+        b = ocx * d[:, 0, None] + ocy * d[:, 1, None] + ocz * d[:, 2, None]
+        c = (ocx * ocx + ocy * ocy + ocz * ocz) - bound * bound
+        discriminant = b * b - c
+        valid = (discriminant >= 0) & usable[start:stop, None]
+        if active is not None:
+            valid &= active[None, :]
+        if exclude is not None:
+            excluded = np.flatnonzero(exclude[start:stop] >= 0)
+            valid[excluded, exclude[start:stop][excluded]] = False
+        sqrt_disc = np.sqrt(np.where(valid, discriminant, 0.0))
+        entry = np.maximum(-b - sqrt_disc, 0.0)
+        entry = np.where(valid & (-b + sqrt_disc > 0) & (entry <= max_distance), entry, np.inf)
+        
+        for row in np.flatnonzero(np.isfinite(entry).any(axis=1)).tolist():
+            candidates = np.flatnonzero(np.isfinite(entry[row]))
+            candidates = candidates[np.argsort(entry[row, candidates], kind='stable')]
+            origin, direction = o[row].tolist(), d[row].tolist()
+            best_t, best = math.inf, None
+            for j in candidates.tolist():
+                if entry[row, j] > best_t:
+                    break  # The remaining players' bounds all start beyond the nearest hit
+                hit = hitbox_ray_hit(origin, direction, rows[0][j], rows[1][j], rows[2][j], table, max_distance)
+                if hit is not None and (hit[0] < best_t or (hit[0] == best_t and j < best[0])):
+                    best_t, best = hit[0], (j, hit[1])
+            if best is not None:
+                i = start + row
+                hit_index[i], hit_shape[i] = best
+                hit_distance[i] = best_t
+                hit_point[i] = o[row] + d[row] * best_t
+    
+    return hit_index, hit_distance, hit_point, hit_shape
+
+def python_check_ray_hit(ray_data: Dict[str, Any], players: Dict[str, Any]) -> Dict[str, Any]:
+    """Python implementation of ray hit detection, on each player's hitboxes
+    
+    Players are dicts with x, y, z and optionally rotation and hitbox (a
+    set name or HITBOX_TABLE index).
+    """
+    origin = ray_data.get('origin', {})
+    direction = ray_data.get('direction', {})
+    
+    if not all(key in origin for key in ['x', 'y', 'z']):
+        return {'hit': False}
+    if not all(key in direction for key in ['x', 'y', 'z']):
+        return {'hit': False}
+    
+    ids, positions, rotations, hitboxes = player_arrays(players)
+    index, distance, point, shape = python_batch_ray_hit_hitboxes(
+        np.array([[origin['x'], origin['y'], origin['z']]], dtype=np.float64),
+        np.array([[direction['x'], direction['y'], direction['z']]], dtype=np.float64),
+        positions, rotations, hitboxes, HITBOX_TABLE)
+    return ray_hit_result(ids, int(index[0]), float(distance[0]), point[0], shape=int(shape[0]))
+
+def player_arrays(players: Dict[str, Any]):
+    """(ids, positions, rotations, hitbox sets) of a dict of player dicts, skipping ones without a position"""
+    ids, positions, rotations, hitboxes = [], [], [], []
     for player_id, player_data in players.items():
-        if not isinstance(player_data, dict):
+        if not isinstance(player_data, Mapping) or not all(key in player_data for key in ['x', 'y', 'z']):
             continue
+        hitbox = player_data.get('hitbox', 0)
+        ids.append(player_id)
+        positions.append((player_data['x'], player_data['y'], player_data['z']))
+        rotations.append(player_data.get('rotation', 0.0))
+        hitboxes.append(HITBOX_TABLE.index(hitbox) if isinstance(hitbox, str) else hitbox)
+    return (ids, np.array(positions, dtype=np.float64).reshape(-1, 3), np.array(rotations, dtype=np.float64),
+            np.array(hitboxes, dtype=np.int32))
+
+def ray_sphere_distance(ox: float, oy: float, oz: float, dx: float, dy: float, dz: float,
+                        cx: float, cy: float, cz: float, radius: float) -> Optional[float]:
+    """First positive intersection distance of a unit-direction ray with a sphere"""
+    oc_x = ox - cx
+    oc_y = oy - cy
+    oc_z = oz - cz
+    b = oc_x * dx + oc_y * dy + oc_z * dz
+    c = oc_x * oc_x + oc_y * oc_y + oc_z * oc_z - radius * radius
+    discriminant = b * b - c
+    if discriminant < 0:
+        return None
+    sqrt_disc = math.sqrt(discriminant)
+    t = -b - sqrt_disc
+    if t > 0:
+        return t
+    t = -b + sqrt_disc
+    return t if t > 0 else None
+
+def ray_sphere_entry(ox: float, oy: float, oz: float, dx: float, dy: float, dz: float,
+                     cx: float, cy: float, cz: float, radius: float) -> Optional[float]:
+    """Distance at which a unit-direction ray enters a sphere, 0 if it starts inside
+    
+    None if the ray misses the sphere or it lies behind the origin.
+    """
+    oc_x = ox - cx
+    oc_y = oy - cy
+    oc_z = oz - cz
+    b = oc_x * dx + oc_y * dy + oc_z * dz
+    c = oc_x * oc_x + oc_y * oc_y + oc_z * oc_z - radius * radius
+    discriminant = b * b - c
+    if discriminant < 0:
+        return None
+    sqrt_disc = math.sqrt(discriminant)
+    if -b + sqrt_disc <= 0:
+        return None
+    return max(-b - sqrt_disc, 0.0)
+
+class SpatialGrid:
+    """Uniform grid broadphase over spheres, keyed by entity id
+    
+    Each sphere is registered in every cell its bounding box overlaps, so
+    updates are O(1) for entities that are small compared to cell_size.
+    Ray queries walk the cells along the ray with a 3D DDA and stop as soon
+    as the next cell starts beyond the nearest hit found so far.
+    """
+    
+    def __init__(self, cell_size: float = 8.0):
+        self.cell_size = cell_size
+        self.cells = {}    # (i, j, k) -> set of keys
+        self.entries = {}  # key -> (x, y, z, radius, cell range)
+        # Bounds of all cells ever used; lets rays stop once they leave them
+        self.bounds_min = None
+        self.bounds_max = None
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __contains__(self, key: Any) -> bool:
+        return key in self.entries
+    
+    def _cell_range(self, x: float, y: float, z: float, radius: float):
+        size = self.cell_size
+        return (math.floor((x - radius) / size), math.floor((y - radius) / size),
+                math.floor((z - radius) / size), math.floor((x + radius) / size),
+                math.floor((y + radius) / size), math.floor((z + radius) / size))
+    
+    def _cells_in(self, cell_range):
+        x0, y0, z0, x1, y1, z1 = cell_range
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                for k in range(z0, z1 + 1):
+                    yield (i, j, k)
+    
+    def insert(self, key: Any, x: float, y: float, z: float, radius: float = 0.5):
+        """Add an entity, or move it if it is already in the grid"""
+        cell_range = self._cell_range(x, y, z, radius)
+        previous = self.entries.get(key)
+        self.entries[key] = (x, y, z, radius, cell_range)
+        
+        if previous is not None:
+            if previous[4] == cell_range:
+                return  # Still in the same cells, only the position changed
+            self._unlink(key, previous[4])
+        
+        for cell in self._cells_in(cell_range):
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                bucket = self.cells[cell] = set()
+            bucket.add(key)
+        
+        if self.bounds_min is None:
+            self.bounds_min = list(cell_range[:3])
+            self.bounds_max = list(cell_range[3:])
+        else:
+            for axis in range(3):
+                self.bounds_min[axis] = min(self.bounds_min[axis], cell_range[axis])
+                self.bounds_max[axis] = max(self.bounds_max[axis], cell_range[axis + 3])
+    
+    update = insert
+    
+    def remove(self, key: Any):
+        """Remove an entity; unknown keys are ignored"""
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self._unlink(key, previous[4])
+    
+    def _unlink(self, key: Any, cell_range):
+        for cell in self._cells_in(cell_range):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.cells[cell]
+    
+    def query_sphere(self, x: float, y: float, z: float, radius: float) -> list:
+        """Keys of all entities overlapping the given sphere"""
+        found = set()
+        result = []
+        for cell in self._cells_in(self._cell_range(x, y, z, radius)):
+            for key in self.cells.get(cell, ()):
+                if key in found:
+                    continue
+                found.add(key)
+                ex, ey, ez, er, _ = self.entries[key]
+                reach = radius + er
+                if (ex - x) ** 2 + (ey - y) ** 2 + (ez - z) ** 2 <= reach * reach:
+                    result.append(key)
+        return result
+    
+    def ray_cells(self, origin, direction, max_distance: float = math.inf):
+        """Yield (cell, entry distance) along a unit-direction ray (3D DDA)"""
+        if self.bounds_min is None:
+            return
+        size = self.cell_size
+        lo, hi = self.bounds_min, self.bounds_max
+        
+        # Clip the ray to the used bounds first (slab test), so a far-away
+        # origin costs nothing instead of one step per empty cell
+        t_enter, t_exit = 0.0, max_distance
+        for axis in range(3):
+            d = direction[axis]
+            low, high = lo[axis] * size, (hi[axis] + 1) * size
+            if d == 0:
+                if not low <= origin[axis] <= high:
+                    return
+                continue
+            t0, t1 = (low - origin[axis]) / d, (high - origin[axis]) / d
+            if t0 > t1:
+                t0, t1 = t1, t0
+            t_enter, t_exit = max(t_enter, t0), min(t_exit, t1)
+            if t_enter > t_exit:
+                return
+        
+        start = [origin[axis] + direction[axis] * t_enter for axis in range(3)]
+        # Clamp so rounding at the entry face cannot start outside the bounds
+        cell = [min(max(math.floor(start[axis] / size), lo[axis]), hi[axis]) for axis in range(3)]
+        step = [0, 0, 0]
+        t_max = [math.inf] * 3
+        t_delta = [math.inf] * 3
+        for axis in range(3):
+            d = direction[axis]
+            if d > 0:
+                step[axis] = 1
+                t_max[axis] = ((cell[axis] + 1) * size - origin[axis]) / d
+                t_delta[axis] = size / d
+            elif d < 0:
+                step[axis] = -1
+                t_max[axis] = (cell[axis] * size - origin[axis]) / d
+                t_delta[axis] = -size / d
+        
+        t = t_enter
+        while t <= max_distance:
+            # Stop once the ray leaves the used bounds
+            for axis in range(3):
+                if not lo[axis] <= cell[axis] <= hi[axis]:
+                    return
+            yield (cell[0], cell[1], cell[2]), t
             
-        if not all(key in player_data for key in ['x', 'y', 'z']):
-            continue
+            axis = 0 if t_max[0] <= t_max[1] else 1
+            if t_max[2] < t_max[axis]:
+                axis = 2
+            t = t_max[axis]
+            cell[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+    
+    def raycast(self, origin, direction, max_distance: float = math.inf,
+                exclude: Any = None, narrowphase: Optional[Callable] = None) -> Optional[tuple]:
+        """Nearest entity hit by a ray, as (key, distance, hit point, detail) or None
         
-        # Treat player as sphere with radius 0.5
-        player_x = player_data['x']
-        player_y = player_data['y']
-        player_z = player_data['z']
-        player_radius = 0.5
+        origin and direction are (x, y, z) sequences; direction need not be
+        normalized. exclude skips one key, normally the shooter.
         
-        # Ray-sphere intersection test
-        oc_x = origin['x'] - player_x
-        oc_y = origin['y'] - player_y
-        oc_z = origin['z'] - player_z
+        Without narrowphase the entries' spheres are what is hit and detail
+        is None. With it, they only bound their entities: for each entity
+        whose sphere the ray enters before the nearest hit so far,
+        narrowphase(key, origin, unit direction) returns (distance, detail)
+        of a hit on its actual shape, or None.
+        """
+        length = math.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+        if length == 0:
+            return None
+        dx, dy, dz = direction[0] / length, direction[1] / length, direction[2] / length
+        ox, oy, oz = origin[0], origin[1], origin[2]
         
-        a = dir_x**2 + dir_y**2 + dir_z**2
-        b = 2.0 * (oc_x * dir_x + oc_y * dir_y + oc_z * dir_z)
-        c = oc_x**2 + oc_y**2 + oc_z**2 - player_radius**2
+        best_key = best_detail = None
+        best_t = max_distance
+        tested = set()
+        for cell, t_enter in self.ray_cells((ox, oy, oz), (dx, dy, dz), max_distance):
+            if t_enter > best_t:
+                break  # Every remaining cell starts beyond the nearest hit
+            for key in self.cells.get(cell, ()):
+                if key in tested or key == exclude:
+                    continue
+                tested.add(key)
+                ex, ey, ez, er, _ = self.entries[key]
+                if narrowphase is None:
+                    t = ray_sphere_distance(ox, oy, oz, dx, dy, dz, ex, ey, ez, er)
+                    if t is not None and t <= best_t:
+                        best_key, best_t = key, t
+                    continue
+                entry = ray_sphere_entry(ox, oy, oz, dx, dy, dz, ex, ey, ez, er)
+                if entry is None or entry > best_t:
+                    continue
+                hit = narrowphase(key, (ox, oy, oz), (dx, dy, dz))
+                if hit is not None and hit[0] <= best_t:
+                    best_key, (best_t, best_detail) = key, hit
         
-        discriminant = b**2 - 4*a*c
+        if best_key is None:
+            return None
+        return best_key, best_t, (ox + dx * best_t, oy + dy * best_t, oz + dz * best_t), best_detail
+
+# Static map geometry: obstacles laid out from each map's seed, with a
+# bounding volume hierarchy over them that is baked once and cached on disk.
+# Rooms memory-map the cached arrays read-only, so all rooms and worker
+# processes on a machine share one copy and new rooms start without baking.
+# Set MAP_CACHE_DIR to an empty string to bake in memory instead.
+MAP_CACHE_DIR = os.environ.get('MAP_CACHE_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'map_cache'))
+BVH_VERSION = 1  # part of the cache key; bump when the layout or the build changes
+BVH_LEAF_SIZE = 4  # obstacles per leaf
+
+# One BVH node, stored depth first: an interior node's left child follows it
+# and `first` is its right child; a leaf holds `count` obstacles from `first`
+# on. Matches BvhNode in cpp_logic.cpp.
+BVH_NODE_DTYPE = np.dtype([('lower', '<f8', (3,)), ('upper', '<f8', (3,)),
+                           ('first', '<i4'), ('count', '<i4')])
+
+def generate_obstacles(config: Dict[str, Any]) -> np.ndarray:
+    """Static obstacles of a map config as an (N, 4) array of centers and radii"""
+    count = config.get('obstacles', 0)
+    extent = config['extent']
+    # A stream of its own, so the asteroid layout does not depend on it
+    rng = np.random.default_rng([config['seed'], 1])
+    radius = rng.uniform(0.5, 3.0, count)
+    center = rng.uniform(-extent, extent, (count, 3))
+    # Same spawn clearance as the asteroids
+    distance = np.linalg.norm(center, axis=1)
+    clearance = radius + 10.0
+    crowded = distance < clearance
+    center[crowded] *= (clearance[crowded] / np.maximum(distance[crowded], 1e-9))[:, None]
+    return np.column_stack([center, radius])
+
+def build_bvh(spheres: np.ndarray, leaf_size: int = BVH_LEAF_SIZE):
+    """Bake a BVH over (N, 4) spheres; returns (spheres in leaf order, nodes)
+    
+    Each node splits its spheres at the median along the longest axis of
+    their centers' bounds, so the tree is balanced and log2(N / leaf_size)
+    deep. Queries report obstacles by their index in the reordered array.
+    """
+    spheres = np.asarray(spheres, dtype=np.float64).reshape(-1, 4)
+    centers, radii = spheres[:, :3], spheres[:, 3:]
+    lower, upper = centers - radii, centers + radii
+    order = []
+    nodes = []
+    
+    def build(indices):
+        node = len(nodes)
+        nodes.append(None)
+        bounds = (lower[indices].min(axis=0), upper[indices].max(axis=0))
+        if len(indices) <= leaf_size:
+            nodes[node] = bounds + (len(order), len(indices))
+            order.extend(indices.tolist())
+            return node
+        points = centers[indices]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        split = indices[np.argsort(points[:, axis], kind='stable')]
+        half = len(split) // 2
+        build(split[:half])
+        right = build(split[half:])
+        nodes[node] = bounds + (right, 0)
+        return node
+    
+    if len(spheres):
+        build(np.arange(len(spheres)))
+    return np.ascontiguousarray(spheres[order]), np.array(nodes, dtype=BVH_NODE_DTYPE)
+
+def validate_bvh(spheres: np.ndarray, nodes: np.ndarray):
+    """Raise ValueError unless nodes index within spheres and themselves (e.g. a damaged cache)"""
+    if spheres.dtype != np.float64 or spheres.ndim != 2 or spheres.shape[1] != 4:
+        raise ValueError("obstacles must be an (N, 4) float64 array")
+    if nodes.dtype != BVH_NODE_DTYPE or nodes.ndim != 1:
+        raise ValueError("nodes must be a BVH_NODE_DTYPE array")
+    first, count = nodes['first'].astype(np.int64), nodes['count'].astype(np.int64)
+    leaf = count > 0
+    inner = np.flatnonzero(~leaf)
+    if (np.any(first[leaf] + count[leaf] > len(spheres)) or np.any(first < 0)
+            or np.any(first[inner] <= inner + 1) or np.any(first[inner] >= len(nodes))
+            or (len(inner) and inner[-1] + 1 >= len(nodes))):
+        raise ValueError("BVH node indices out of range")
+
+def bvh_raycast(nodes: np.ndarray, spheres: np.ndarray, origins: np.ndarray, directions: np.ndarray,
+                max_distance: float = math.inf):
+    """Nearest obstacle hit by each of M rays, walking a BVH from build_bvh
+    
+    Returns (index, distance) arrays of shape (M,); misses have index -1 and
+    distance inf, equal distances go to the lower index. Each ray only visits
+    the nodes whose bounds it crosses, O(log N) of them for short rays.
+    """
+    origins = np.ascontiguousarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.ascontiguousarray(directions, dtype=np.float64).reshape(-1, 3)
+    if CPP_AVAILABLE and CPP_DISPATCH['bvh_raycast'] and hasattr(cpp_logic, 'bvh_raycast'):
+        CALL_COUNTS['bvh_raycast', 'cpp'] += 1
+        return cpp_logic.bvh_raycast(nodes, spheres, origins, directions, max_distance)
+    
+    CALL_COUNTS['bvh_raycast', 'python'] += 1
+    return python_bvh_raycast(nodes, spheres, origins, directions, max_distance)
+
+def python_bvh_raycast(nodes: np.ndarray, spheres: np.ndarray, origins: np.ndarray,
+                       directions: np.ndarray, max_distance: float = math.inf):
+    """NumPy implementation of bvh_raycast, taking all rays down the tree a level at a time"""
+    ray_count = len(origins)
+    hit_index = np.full(ray_count, -1, dtype=np.int64)
+    hit_distance = np.full(ray_count, np.inf)
+    if ray_count == 0 or len(nodes) == 0:
+        return hit_index, hit_distance
+    
+    lengths = np.sqrt(np.einsum('ij,ij->i', directions, directions))
+    usable = lengths > 0
+    unit = directions / np.where(usable, lengths, 1.0)[:, None]
+    # Axis-parallel rays get a tiny component instead of a division by zero
+    inverse = 1.0 / np.where(np.abs(unit) > 1e-12, unit, 1e-12)
+    lower, upper = nodes['lower'], nodes['upper']
+    first, count = nodes['first'].astype(np.int64), nodes['count'].astype(np.int64)
+    
+    # (ray, node) pairs still to visit
+    rays = np.flatnonzero(usable)
+    node = np.zeros(len(rays), dtype=np.int64)
+    while len(rays):
+        o, inv = origins[rays], inverse[rays]
+        t1 = (lower[node] - o) * inv
+        t2 = (upper[node] - o) * inv
+        near = np.minimum(t1, t2).max(axis=1)
+        far = np.maximum(t1, t2).min(axis=1)
+        crossed = (near <= far) & (far >= 0) & (near <= np.minimum(hit_distance[rays], max_distance))
+        rays, node = rays[crossed], node[crossed]
         
-        if discriminant >= 0:
-            sqrt_disc = math.sqrt(discriminant)
-            t1 = (-b - sqrt_disc) / (2.0 * a)
-            t2 = (-b + sqrt_disc) / (2.0 * a)
+        leaf = count[node] > 0
+        if leaf.any():
+            sizes = count[node[leaf]]
+            pair_rays = np.repeat(rays[leaf], sizes)
+            obstacles = (np.repeat(first[node[leaf]], sizes)
+                         + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes))
             
-            t = None
-            if t1 > 0:
-                t = t1
-            elif t2 > 0:
-                t = t2
+            # Unit directions, so the quadratic's a term is 1
+            oc = origins[pair_rays] - spheres[obstacles, :3]
+            b = np.einsum('ij,ij->i', oc, unit[pair_rays])
+            c = np.einsum('ij,ij->i', oc, oc) - spheres[obstacles, 3] ** 2
+            discriminant = b * b - c
+            sqrt_disc = np.sqrt(np.maximum(discriminant, 0.0))
+            t1 = -b - sqrt_disc
+            t = np.where(t1 > 0, t1, -b + sqrt_disc)
+            t = np.where((discriminant >= 0) & (t > 0) & (t <= max_distance), t, np.inf)
             
-            if t is not None and t < closest_t:
-                closest_t = t
-                closest_player_id = player_id
-                closest_hit_point = {
-                    'x': origin['x'] + dir_x * t,
-                    'y': origin['y'] + dir_y * t,
-                    'z': origin['z'] + dir_z * t
-                }
-    
-    if closest_player_id is not None:
+            # Nearest per ray, then against what earlier leaves found
+            by_ray = np.lexsort((obstacles, t, pair_rays))
+            pair_rays, t, obstacles = pair_rays[by_ray], t[by_ray], obstacles[by_ray]
+            nearest = np.flatnonzero(np.r_[True, pair_rays[1:] != pair_rays[:-1]])
+            pair_rays, t, obstacles = pair_rays[nearest], t[nearest], obstacles[nearest]
+            best = hit_distance[pair_rays]
+            closer = np.isfinite(t) & ((t < best) | ((t == best) & (obstacles < hit_index[pair_rays])))
+            hit_distance[pair_rays[closer]] = t[closer]
+            hit_index[pair_rays[closer]] = obstacles[closer]
+        
+        inner = ~leaf
+        rays = np.concatenate([rays[inner], rays[inner]])
+        node = np.concatenate([node[inner] + 1, first[node[inner]]])
+    
+    return hit_index, hit_distance
+
+def bvh_sphere_overlaps(nodes: np.ndarray, spheres: np.ndarray, centers: np.ndarray,
+                        radii: Any = 0.5) -> np.ndarray:
+    """Lowest index of an obstacle overlapping each of M spheres, -1 for none
+    
+    centers is (M, 3) and radii a scalar or (M,); touching counts as
+    overlapping. Only the BVH nodes around each sphere are visited.
+    """
+    centers = np.ascontiguousarray(centers, dtype=np.float64).reshape(-1, 3)
+    radii = np.ascontiguousarray(radii, dtype=np.float64).reshape(-1)
+    if CPP_AVAILABLE and CPP_DISPATCH['bvh_sphere_overlaps'] and hasattr(cpp_logic, 'bvh_sphere_overlaps'):
+        CALL_COUNTS['bvh_sphere_overlaps', 'cpp'] += 1
+        return cpp_logic.bvh_sphere_overlaps(nodes, spheres, centers, radii)
+    
+    CALL_COUNTS['bvh_sphere_overlaps', 'python'] += 1
+    return python_bvh_sphere_overlaps(nodes, spheres, centers, np.broadcast_to(radii, (len(centers),)))
+
+def python_bvh_sphere_overlaps(nodes: np.ndarray, spheres: np.ndarray, centers: np.ndarray,
+                               radii: np.ndarray) -> np.ndarray:
+    """NumPy implementation of bvh_sphere_overlaps, a tree level at a time"""
+    none = np.iinfo(np.int64).max
+    lowest = np.full(len(centers), none, dtype=np.int64)
+    lower, upper = nodes['lower'], nodes['upper']
+    first, count = nodes['first'].astype(np.int64), nodes['count'].astype(np.int64)
+    
+    queries = np.arange(len(centers)) if len(nodes) else np.empty(0, dtype=np.int64)
+    node = np.zeros(len(queries), dtype=np.int64)
+    while len(queries):
+        c = centers[queries]
+        gap = np.clip(c, lower[node], upper[node]) - c
+        near = np.einsum('ij,ij->i', gap, gap) <= radii[queries] ** 2
+        queries, node = queries[near], node[near]
+        
+        leaf = count[node] > 0
+        if leaf.any():
+            sizes = count[node[leaf]]
+            pair_queries = np.repeat(queries[leaf], sizes)
+            obstacles = (np.repeat(first[node[leaf]], sizes)
+                         + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+            offset = centers[pair_queries] - spheres[obstacles, :3]
+            reach = radii[pair_queries] + spheres[obstacles, 3]
+            overlap = np.einsum('ij,ij->i', offset, offset) <= reach * reach
+            np.minimum.at(lowest, pair_queries[overlap], obstacles[overlap])
+        
+        inner = ~leaf
+        queries = np.concatenate([queries[inner], queries[inner]])
+        node = np.concatenate([node[inner] + 1, first[node[inner]]])
+    
+    return np.where(lowest == none, -1, lowest)
+
+class StaticGeometry:
+    """A map's static obstacles and their BVH, shared read-only by its rooms"""
+    
+    def __init__(self, spheres: np.ndarray, nodes: np.ndarray, key: Optional[str] = None):
+        self.spheres = spheres  # (N, 4) centers and radii, in BVH leaf order
+        self.nodes = nodes  # BVH_NODE_DTYPE
+        self.key = key  # cache key, None if not from a map
+        self._description = None
+    
+    @classmethod
+    def empty(cls) -> 'StaticGeometry':
+        return cls(np.empty((0, 4)), np.empty(0, dtype=BVH_NODE_DTYPE))
+    
+    def __len__(self) -> int:
+        return len(self.spheres)
+    
+    def raycast(self, origins: np.ndarray, directions: np.ndarray, max_distance: float = math.inf):
+        """(index, distance) of the nearest obstacle along each ray; see bvh_raycast"""
+        return bvh_raycast(self.nodes, self.spheres, origins, directions, max_distance)
+    
+    def overlaps(self, centers: np.ndarray, radii: Any) -> np.ndarray:
+        """Lowest obstacle index overlapping each sphere; see bvh_sphere_overlaps"""
+        return bvh_sphere_overlaps(self.nodes, self.spheres, centers, radii)
+    
+    def describe(self) -> list:
+        """[x, y, z, radius] per obstacle for clients, built once"""
+        if self._description is None:
+            self._description = np.round(np.asarray(self.spheres), 2).tolist()
+        return self._description
+
+_static_geometry = {}  # (cache dir, key) -> StaticGeometry loaded by this process
+_static_geometry_lock = threading.Lock()
+
+def map_geometry_key(map_name: str) -> str:
+    """Cache key of a map's baked geometry: map, seed and a hash of what shapes it"""
+    config = MAPS[map_name]
+    shape = json.dumps([BVH_VERSION, BVH_LEAF_SIZE, config], sort_keys=True)
+    return f"{map_name}-{config['seed']}-{hashlib.sha256(shape.encode()).hexdigest()[:12]}"
+
+def load_static_geometry(map_name: str, cache_dir: Optional[str] = None) -> StaticGeometry:
+    """A map's StaticGeometry, baking and caching it on first use
+    
+    Later calls in the process return the same object; other processes map
+    the same cached files.
+    """
+    cache_dir = MAP_CACHE_DIR if cache_dir is None else cache_dir
+    key = map_geometry_key(map_name)
+    with _static_geometry_lock:
+        geometry = _static_geometry.get((cache_dir, key))
+        if geometry is None:
+            geometry = _static_geometry[cache_dir, key] = _load_or_bake(map_name, key, cache_dir)
+    return geometry
+
+def _load_or_bake(map_name: str, key: str, cache_dir: str) -> StaticGeometry:
+    paths = [os.path.join(cache_dir, f'{key}.{part}.npy') for part in ('obstacles', 'bvh')]
+    if cache_dir and all(os.path.exists(path) for path in paths):
+        try:
+            spheres, nodes = (np.load(path, mmap_mode='r') for path in paths)
+            validate_bvh(spheres, nodes)
+            return StaticGeometry(spheres, nodes, key)
+        except (OSError, ValueError) as e:
+            print(f"Rebaking map geometry {key}: {e}")
+    
+    spheres, nodes = build_bvh(generate_obstacles(MAPS[map_name]))
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written aside and renamed into place, so a worker baking the same
+            # map at the same time never sees a partial file. The BVH goes
+            # last: its presence marks a complete entry.
+            for path, array in zip(paths, (spheres, nodes)):
+                partial = f'{path}.{os.getpid()}.tmp'
+                with open(partial, 'wb') as f:
+                    np.save(f, array)
+                os.replace(partial, path)
+            print(f"Baked map geometry {key}: {len(spheres)} obstacles, {len(nodes)} BVH nodes")
+            return StaticGeometry(*(np.load(path, mmap_mode='r') for path in paths), key)
+        except OSError as e:
+            print(f"Could not cache map geometry in {cache_dir}: {e}")
+    return StaticGeometry(spheres, nodes, key)
+
+# Server-side world simulation: asteroids per map and projectiles with
+# travel time, stepped at a fixed rate independent of the room tick rate
+SIMULATION_RATE = int(os.environ.get('SIMULATION_RATE', 60))  # steps per second
+MAX_STEPS_PER_ADVANCE = 8  # beyond this the simulation slows down instead of spiralling
+PROJECTILE_SPEED = float(os.environ.get('PROJECTILE_SPEED', 0))  # units/s, 0 = hitscan shots
+PROJECTILE_RANGE = 150.0
+PROJECTILE_DAMAGE = 25
+ASTEROID_DAMAGE = 10
+
+# Asteroid layouts, generated from a fixed seed so every room on a map (and
+# every server) builds the same field. The first `orbiting` asteroids circle
+# the arena's vertical axis; the rest are static. `obstacles` small static
+# rocks (see StaticGeometry) give cover and block shots.
+MAPS = {
+    'nebula': {'seed': 17, 'asteroids': 15, 'orbiting': 5, 'extent': 100.0, 'obstacles': 600},
+    'crystal-cave': {'seed': 23, 'asteroids': 24, 'orbiting': 8, 'extent': 80.0, 'obstacles': 1200},
+}
+DEFAULT_MAP = os.environ.get('DEFAULT_MAP', 'nebula')
+
+def map_for_room(room_id: str) -> str:
+    """Map played in a room: rooms named after a map (e.g. "crystal-cave-2") use it"""
+    for name in MAPS:
+        if room_id == name or room_id.startswith(name + '-'):
+            return name
+    return DEFAULT_MAP
+
+class WorldSimulation:
+    """Authoritative asteroids and projectiles of one room
+    
+    Asteroids are spheres; orbiting ones rotate about the y axis through the
+    origin. The map's static obstacles come from load_static_geometry and are
+    shared with every other room on the map. Projectiles fly in straight lines
+    until they hit a player, an asteroid or an obstacle, or run out of range;
+    they hit players on their hitboxes, while player_radius is the sphere
+    asteroids and obstacles push players out by. Each step tests all
+    projectiles and all player/asteroid overlaps in batched calls (C++ when
+    available), and obstacles through their BVH.
+    """
+    
+    def __init__(self, map_name: str = DEFAULT_MAP, step_rate: int = SIMULATION_RATE,
+                 player_radius: float = 0.5):
+        if map_name not in MAPS:
+            raise ValueError(f"Unknown map: {map_name}")
+        config = MAPS[map_name]
+        self.map_name = map_name
+        self.step_interval = 1.0 / step_rate
+        self.player_radius = player_radius
+        self.step_count = 0
+        self.time = 0.0
+        self.accumulator = 0.0
+        
+        rng = np.random.default_rng(config['seed'])
+        count = config['asteroids']
+        extent = config['extent']
+        self.asteroid_radius = rng.uniform(2.0, 10.0, count)
+        base = rng.uniform(-extent, extent, (count, 3))
+        # Keep the spawn point at the origin clear
+        distance = np.linalg.norm(base, axis=1)
+        clearance = self.asteroid_radius + 10.0
+        crowded = distance < clearance
+        base[crowded] *= (clearance[crowded] / np.maximum(distance[crowded], 1e-9))[:, None]
+        self.asteroid_base = base  # positions at time 0
+        self.asteroid_orbit = np.zeros(count)  # rad/s about the y axis
+        orbiting = min(config['orbiting'], count)
+        self.asteroid_orbit[:orbiting] = rng.uniform(0.05, 0.2, orbiting) * rng.choice([-1.0, 1.0], orbiting)
+        self.asteroid_spin = rng.uniform(-0.6, 0.6, (count, 3))  # visual only, rad/s
+        self.asteroid_position = base.copy()
+        self.obstacles = load_static_geometry(map_name)
+        
+        self.next_projectile_id = 1
+        self.projectile_ids = np.empty(0, dtype=np.int64)
+        self.projectile_owner = []
+        self.projectile_position = np.empty((0, 3))
+        self.projectile_velocity = np.empty((0, 3))
+        self.projectile_traveled = np.empty(0)
+        self.projectile_range = np.empty(0)
+    
+    def describe(self) -> Dict[str, Any]:
+        """Static description sent to joining clients, who animate the orbits themselves"""
         return {
-            'hit': True,
-            'target_id': closest_player_id,
-            'distance': closest_t,
-            'hit_position': closest_hit_point,
-            'damage': 25
+            'map': self.map_name,
+            'time': self.time,
+            'asteroids': [
+                {'x': float(x), 'y': float(y), 'z': float(z), 'radius': float(radius),
+                 'orbit_speed': float(orbit), 'spin': {'x': float(sx), 'y': float(sy), 'z': float(sz)}}
+                for (x, y, z), radius, orbit, (sx, sy, sz) in zip(
+                    self.asteroid_base.tolist(), self.asteroid_radius, self.asteroid_orbit,
+                    self.asteroid_spin.tolist())
+            ],
+            'obstacles': self.obstacles.describe()
         }
-    else:
-        return {'hit': False}
+    
+    # Projectiles
+    
+    def spawn_projectile(self, owner: str, origin: Sequence[float], direction: Sequence[float],
+                         speed: float = PROJECTILE_SPEED, max_range: float = PROJECTILE_RANGE) -> int:
+        """Launch a projectile and return its id; it first moves on the next step"""
+        direction = np.asarray(direction, dtype=np.float64)
+        length = np.linalg.norm(direction)
+        if length == 0 or speed <= 0:
+            raise ValueError("Projectiles need a direction and a positive speed")
+        projectile_id = self.next_projectile_id
+        self.next_projectile_id += 1
+        self.projectile_ids = np.append(self.projectile_ids, projectile_id)
+        self.projectile_owner.append(owner)
+        self.projectile_position = np.vstack([self.projectile_position, np.asarray(origin, dtype=np.float64)])
+        self.projectile_velocity = np.vstack([self.projectile_velocity, direction / length * speed])
+        self.projectile_traveled = np.append(self.projectile_traveled, 0.0)
+        self.projectile_range = np.append(self.projectile_range, max_range)
+        return projectile_id
+    
+    def remove_owner(self, owner: str):
+        """Drop the projectiles of a player that left"""
+        keep = np.array([o != owner for o in self.projectile_owner], dtype=bool)
+        self._keep_projectiles(keep)
+    
+    def _keep_projectiles(self, keep: np.ndarray):
+        self.projectile_ids = self.projectile_ids[keep]
+        self.projectile_owner = [o for o, k in zip(self.projectile_owner, keep) if k]
+        self.projectile_position = self.projectile_position[keep]
+        self.projectile_velocity = self.projectile_velocity[keep]
+        self.projectile_traveled = self.projectile_traveled[keep]
+        self.projectile_range = self.projectile_range[keep]
+    
+    # Stepping
+    
+    def advance(self, elapsed: float, players: Any):
+        """Run as many fixed steps as fit in elapsed seconds (plus any carried over)
+        
+        players is a PlayerStore; pushback from asteroids is written into its
+        position array. Returns (impacts, collisions) from all steps run.
+        """
+        self.accumulator += max(elapsed, 0.0)
+        steps = int(self.accumulator / self.step_interval)
+        if steps > MAX_STEPS_PER_ADVANCE:
+            steps = MAX_STEPS_PER_ADVANCE
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.step_interval
+        
+        impacts, collisions = [], []
+        for _ in range(steps):
+            step_impacts, step_collisions = self.step(players)
+            impacts.extend(step_impacts)
+            collisions.extend(step_collisions)
+        return impacts, collisions
+    
+    def step(self, players: Any):
+        """Advance one fixed step: asteroids, then projectiles, then pushback"""
+        self.step_count += 1
+        self.time = self.step_count * self.step_interval
+        
+        angle = self.asteroid_orbit * self.time
+        cos, sin = np.cos(angle), np.sin(angle)
+        base = self.asteroid_base
+        self.asteroid_position[:, 0] = base[:, 0] * cos - base[:, 2] * sin
+        self.asteroid_position[:, 2] = base[:, 0] * sin + base[:, 2] * cos
+        
+        return self.step_projectiles(players), self.collide_players(players)
+    
+    def step_projectiles(self, players: Any) -> list:
+        """Move projectiles one step, returning impact dicts for those that hit"""
+        count = len(self.projectile_ids)
+        if count == 0:
+            return []
+        
+        speed = np.linalg.norm(self.projectile_velocity, axis=1)
+        travel = np.minimum(speed * self.step_interval, self.projectile_range - self.projectile_traveled)
+        reach = float(travel.max())
+        origins = self.projectile_position
+        directions = self.projectile_velocity
+        
+        # Each projectile's path this step is a ray segment of length travel
+        position, rotation, _, active = players.arrays()
+        exclude = np.array([players.slot_of.get(owner, -1) for owner in self.projectile_owner], dtype=np.int64)
+        player_index, player_distance, player_point, player_shape = batch_ray_hit_hitboxes(
+            origins, directions, position, rotation, players.hitbox[:len(active)], exclude=exclude,
+            active=active, max_distance=reach)
+        asteroid_index, asteroid_distance, asteroid_point = batch_ray_hit(
+            origins, directions, self.asteroid_position, self.asteroid_radius, max_distance=reach)
+        obstacle_index, obstacle_distance = self.obstacles.raycast(origins, directions, reach)
+        unit = directions / np.maximum(speed, 1e-12)[:, None]
+        
+        hits_player = ((player_distance <= travel) & (player_distance <= asteroid_distance)
+                       & (player_distance <= obstacle_distance))
+        hits_asteroid = ~hits_player & (asteroid_distance <= travel) & (asteroid_distance <= obstacle_distance)
+        hits_obstacle = ~hits_player & ~hits_asteroid & (obstacle_distance <= travel)
+        stopped = hits_player | hits_asteroid | hits_obstacle
+        
+        impacts = []
+        for i in np.flatnonzero(stopped).tolist():
+            asteroid = obstacle = None
+            if hits_player[i]:
+                slot = int(player_index[i])
+                hit = ray_hit_result(players.ids, slot, float(self.projectile_traveled[i] + player_distance[i]),
+                                     player_point[i], damage=PROJECTILE_DAMAGE, shape=int(player_shape[i]))
+            elif hits_asteroid[i]:
+                point = asteroid_point[i]
+                hit = {'hit': False}
+                asteroid = int(asteroid_index[i])
+            else:
+                point = origins[i] + unit[i] * obstacle_distance[i]
+                hit = {'hit': False}
+                obstacle = int(obstacle_index[i])
+            impacts.append({
+                'projectile_id': int(self.projectile_ids[i]),
+                'owner': self.projectile_owner[i],
+                'hit_data': hit,
+                'asteroid': asteroid,
+                'obstacle': obstacle,
+                'position': hit['hit_position'] if hit['hit'] else
+                            {'x': float(point[0]), 'y': float(point[1]), 'z': float(point[2])}
+            })
+        
+        self.projectile_position = origins + unit * travel[:, None]
+        self.projectile_traveled = self.projectile_traveled + travel
+        self._keep_projectiles(~stopped & (self.projectile_traveled < self.projectile_range))
+        return impacts
+    
+    def collide_players(self, players: Any) -> list:
+        """Push players out of asteroids and obstacles they overlap
+        
+        Returns (player id, kind, index, new position) per push, kind being
+        'asteroid' or 'obstacle'; the new position is already stored in
+        players.
+        """
+        position, _, _, active = players.arrays()
+        slots = np.flatnonzero(active)
+        if len(slots) == 0:
+            return []
+        pushes = self.collide_asteroids(position, slots) + self.collide_obstacles(position, slots)
+        return [(players.ids[slot], kind, index, p) for slot, kind, index, p in pushes]
+    
+    def collide_asteroids(self, position: np.ndarray, slots: np.ndarray) -> list:
+        """(slot, 'asteroid', index, position) per player pushed out of an asteroid"""
+        asteroid_count = len(self.asteroid_radius)
+        if asteroid_count == 0:
+            return []
+        
+        player_count = len(slots)
+        centers = np.concatenate([position[slots], self.asteroid_position])
+        radii = np.concatenate([np.full(player_count, self.player_radius), self.asteroid_radius])
+        candidates = np.stack(np.meshgrid(np.arange(player_count), np.arange(asteroid_count) + player_count,
+                                          indexing='ij'), axis=-1).reshape(-1, 2)
+        pairs = sphere_overlaps(centers, radii, candidates=candidates)
+        if len(pairs) == 0:
+            return []
+        
+        # One asteroid per player and step is enough to resolve the overlap
+        _, first = np.unique(pairs[:, 0], return_index=True)
+        pairs = pairs[first]
+        rows, asteroids = pairs[:, 0], pairs[:, 1] - player_count
+        offset = centers[rows] - self.asteroid_position[asteroids]
+        distance = np.linalg.norm(offset, axis=1)
+        away = np.where(distance[:, None] > 0, offset / np.maximum(distance, 1e-12)[:, None], [0.0, 1.0, 0.0])
+        # Slightly past touching, since touching still counts as overlapping
+        pushed = (self.asteroid_position[asteroids]
+                  + away * (self.asteroid_radius[asteroids] + self.player_radius + 1e-3)[:, None])
+        position[slots[rows]] = pushed
+        
+        return [(slot, 'asteroid', int(asteroid), tuple(p))
+                for slot, asteroid, p in zip(slots[rows].tolist(), asteroids.tolist(), pushed.tolist())]
+    
+    def collide_obstacles(self, position: np.ndarray, slots: np.ndarray) -> list:
+        """(slot, 'obstacle', index, position) per player pushed out of an obstacle"""
+        if len(self.obstacles) == 0:
+            return []
+        
+        overlapping = self.obstacles.overlaps(position[slots], self.player_radius)
+        rows = np.flatnonzero(overlapping >= 0)
+        if len(rows) == 0:
+            return []
+        
+        obstacles = overlapping[rows]
+        center, radius = self.obstacles.spheres[obstacles, :3], self.obstacles.spheres[obstacles, 3]
+        offset = position[slots[rows]] - center
+        distance = np.linalg.norm(offset, axis=1)
+        away = np.where(distance[:, None] > 0, offset / np.maximum(distance, 1e-12)[:, None], [0.0, 1.0, 0.0])
+        pushed = center + away * (radius + self.player_radius + 1e-3)[:, None]
+        position[slots[rows]] = pushed
+        
+        return [(slot, 'obstacle', int(obstacle), tuple(p))
+                for slot, obstacle, p in zip(slots[rows].tolist(), obstacles.tolist(), pushed.tolist())]
 
 def create_vector3(x: float = 0.0, y: float = 0.0, z: float = 0.0) -> Any:
     """Create a Vector3 object"""
@@ -226,8 +1534,216 @@ def test_ray_hit_detection():
     
     return result.get('hit', False) and result.get('target_id') == 'player1'
 
+def test_batch_ray_hit():
+    """Test batched ray hit detection against the scalar implementation"""
+    print("Testing batch ray hit detection...")
+    
+    rng = np.random.default_rng(7)
+    origins = rng.uniform(-5, 5, (64, 3))
+    directions = rng.normal(size=(64, 3))
+    centers = rng.uniform(-5, 5, (200, 3))
+    
+    index, distance, _ = batch_ray_hit(origins, directions, centers)
+    
+    matches = 0
+    for i in range(len(origins)):
+        unit = directions[i] / np.linalg.norm(directions[i])
+        hits = [(t, j) for j, t in enumerate(ray_sphere_distance(*origins[i], *unit, *c, 0.5) for c in centers)
+                if t is not None]
+        matches += int((min(hits)[1] if hits else -1) == index[i])
+    
+    hits = int((index >= 0).sum())
+    print(f"Batch ray hits: {hits}/{len(origins)}, matching scalar results: {matches}")
+    
+    return matches == len(origins)
+
+def test_sphere_overlaps():
+    """Test batched sphere overlaps against the NumPy implementation"""
+    print("Testing sphere overlaps...")
+    
+    rng = np.random.default_rng(5)
+    centers = rng.uniform(-50, 50, (2000, 3))
+    radii = rng.uniform(0.5, 2.0, 2000)
+    active = rng.random(2000) > 0.1
+    
+    pairs = sphere_overlaps(centers, radii, active)
+    expected = python_sphere_overlaps(centers, radii, active)
+    # Known overlaps, reversed, mixed with random pairs
+    candidates = rng.permutation(np.concatenate([pairs[:, ::-1], rng.integers(0, 2000, (5000, 2))]))
+    filtered = sphere_overlaps(centers, radii, active, candidates)
+    expected_filtered = python_sphere_overlaps(centers, radii, active, candidates)
+    
+    print(f"Overlapping pairs: {len(pairs)}, candidate pairs overlapping: {len(filtered)}")
+    
+    return np.array_equal(pairs, expected) and np.array_equal(filtered, expected_filtered)
+
+def test_world_simulation():
+    """Test projectile travel time and asteroid pushback"""
+    print("Testing world simulation...")
+    from player_store import PlayerStore
+    
+    world = WorldSimulation('nebula', step_rate=60)
+    players = PlayerStore()
+    players.add('shooter', {'x': 0.0, 'y': 1.0, 'z': 0.0})
+    players.add('target', {'x': 0.0, 'y': 1.0, 'z': -30.0})
+    # Park a third player inside the first asteroid
+    ax, ay, az = world.asteroid_position[0]
+    players.add('crashed', {'x': ax + 0.5, 'y': ay, 'z': az})
+    # Keep the shot's path clear of asteroids
+    world.asteroid_position[1:] = world.asteroid_base[1:] = 1000.0
+    world.asteroid_orbit[0] = 0.0
+    world.obstacles = StaticGeometry.empty()
+    
+    world.spawn_projectile('shooter', (0.0, 1.0, 0.0), (0.0, 0.0, -1.0), speed=60.0)
+    impacts, collisions = [], []
+    for tick in range(24):  # 0.75 s of 30 Hz room ticks
+        if tick == 8:
+            early = len(impacts)
+        tick_impacts, tick_collisions = world.advance(1.0 / 30, players)
+        impacts.extend(tick_impacts)
+        collisions.extend(tick_collisions)
+    
+    pushed = collisions and collisions[0][0] == 'crashed'
+    clear = np.linalg.norm(players.position[2] - world.asteroid_position[0]) > world.asteroid_radius[0]
+    print(f"Impacts after 0.25 s: {early}, after 0.75 s: {len(impacts)}, pushed out: {bool(pushed and clear)}")
+    
+    return (early == 0 and len(impacts) == 1 and impacts[0]['hit_data'].get('target_id') == 'target'
+            and pushed and clear)
+
+def test_spatial_grid():
+    """Test grid ray and sphere queries against brute force"""
+    print("Testing spatial grid...")
+    
+    rng = np.random.default_rng(11)
+    centers = rng.uniform(-100, 100, (500, 3))
+    grid = SpatialGrid(cell_size=8.0)
+    for i, c in enumerate(centers):
+        grid.insert(i, c[0], c[1], c[2], 2.0)
+    # Move half of them to exercise incremental updates
+    centers[::2] += rng.uniform(-10, 10, (250, 3))
+    for i in range(0, len(centers), 2):
+        grid.update(i, centers[i][0], centers[i][1], centers[i][2], 2.0)
+    
+    origins = rng.uniform(-100, 100, (100, 3))
+    directions = rng.normal(size=(100, 3))
+    # Some rays start far outside the grid, aimed at it or away from it
+    origins[:10] = rng.normal(size=(10, 3)) * 1e6
+    directions[:5] = centers[:5] - origins[:5]
+    index, distance, _ = batch_ray_hit(origins, directions, centers, 2.0)
+    
+    ray_matches = 0
+    for i in range(len(origins)):
+        hit = grid.raycast(origins[i], directions[i])
+        ray_matches += int((hit[0] if hit else -1) == index[i])
+    
+    near = grid.query_sphere(0.0, 0.0, 0.0, 30.0)
+    expected = np.flatnonzero(np.linalg.norm(centers, axis=1) <= 32.0)
+    
+    print(f"Grid raycasts matching brute force: {ray_matches}/{len(origins)}")
+    print(f"Sphere query found {len(near)} of {len(expected)} entities")
+    
+    return ray_matches == len(origins) and sorted(near) == expected.tolist()
+
+def test_static_geometry():
+    """Test baked BVH queries against brute force, on both paths, and the disk cache"""
+    print("Testing static map geometry...")
+    import tempfile
+    
+    rng = np.random.default_rng(5)
+    spheres, nodes = build_bvh(generate_obstacles({'seed': 3, 'extent': 100.0, 'obstacles': 2000}))
+    origins = rng.uniform(-100, 100, (300, 3))
+    directions = rng.normal(size=(300, 3))
+    directions[0] = (1.0, 0.0, 0.0)  # axis-parallel
+    expected_index, expected_distance, _ = python_batch_ray_hit(origins, directions, spheres[:, :3],
+                                                                spheres[:, 3], max_distance=80.0)
+    centers = rng.uniform(-100, 100, (300, 3))
+    offset = centers[:, None, :] - spheres[None, :, :3]
+    overlap = np.einsum('mnk,mnk->mn', offset, offset) <= (spheres[None, :, 3] + 2.0) ** 2
+    expected_overlap = np.where(overlap.any(axis=1), overlap.argmax(axis=1), -1)
+    
+    results = [python_bvh_raycast(nodes, spheres, origins, directions, 80.0)
+               + (python_bvh_sphere_overlaps(nodes, spheres, centers, np.full(300, 2.0)),)]
+    if CPP_AVAILABLE and hasattr(cpp_logic, 'bvh_raycast'):
+        results.append(tuple(cpp_logic.bvh_raycast(nodes, spheres, origins, directions, 80.0))
+                       + (cpp_logic.bvh_sphere_overlaps(nodes, spheres, centers, np.array([2.0])),))
+    matches = [np.array_equal(index, expected_index) and np.allclose(distance, expected_distance)
+               and np.array_equal(overlaps, expected_overlap)
+               for index, distance, overlaps in results]
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        baked = load_static_geometry('nebula', cache_dir)
+        _static_geometry.clear()
+        cached = load_static_geometry('nebula', cache_dir)
+        reused = (isinstance(cached.nodes, np.memmap) and cached is not baked
+                  and cached is load_static_geometry('nebula', cache_dir)
+                  and np.array_equal(cached.spheres, baked.spheres))
+        _static_geometry.clear()
+    
+    print(f"{len(spheres)} obstacles, {len(nodes)} nodes; "
+          f"{sum(index >= 0 for index in expected_index)} ray hits, {sum(expected_overlap >= 0)} overlaps")
+    print(f"Matching brute force (python{', cpp' if len(results) > 1 else ''}): {matches}, cache reused: {reused}")
+    
+    return all(matches) and reused
+
+def test_hitboxes():
+    """Test two-phase hitbox hits against every shape of every player, on both paths"""
+    print("Testing hitboxes...")
+    
+    table = HitboxTable({'fighter': HITBOXES['fighter'],
+                         'drone': [{'shape': 'sphere', 'region': 'body', 'a': (0.0, 0.0, 0.0), 'radius': 1.2}]})
+    rng = np.random.default_rng(13)
+    positions = rng.uniform(-20, 20, (300, 3))
+    rotations = rng.uniform(-math.pi, math.pi, 300)
+    hitbox = rng.integers(0, 2, 300).astype(np.int32)
+    active = rng.random(300) > 0.1
+    origins = rng.uniform(-25, 25, (200, 3))
+    directions = rng.normal(size=(200, 3))
+    exclude = rng.integers(-1, 300, 200)
+    # Axis-parallel shots straight at a lone fighter's side, cockpit and wing
+    positions[0], rotations[0], hitbox[0], active[0] = (100.0, 0.0, 0.0), 0.0, 0, True
+    origins[:3] = (90.0, 0.0, 0.0), (100.0, 0.35, -10.0), (101.2, 10.0, 0.8)
+    directions[:3] = (1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, -1.0, 0.0)
+    exclude[:3] = -1
+    origins[3:] -= directions[3:] * 30
+    
+    expected = []
+    for i in range(len(origins)):
+        unit = (directions[i] / np.linalg.norm(directions[i])).tolist()
+        best = (math.inf, -1, -1)
+        for j in np.flatnonzero(active).tolist():
+            hit = hitbox_ray_hit(origins[i].tolist(), unit, positions[j].tolist(), rotations[j], hitbox[j],
+                                 table, 60.0)
+            if j != exclude[i] and hit is not None:
+                best = min(best, (hit[0], j, hit[1]))
+        expected.append(best)
+    expected_distance, expected_index, expected_shape = (np.array(values) for values in zip(*expected))
+    
+    results = [python_batch_ray_hit_hitboxes(origins, directions, positions, rotations, hitbox, table,
+                                             exclude, active, 60.0)]
+    if CPP_AVAILABLE and hasattr(cpp_logic, 'batch_ray_hit_hitboxes'):
+        results.append(cpp_logic.batch_ray_hit_hitboxes(origins, directions, positions, rotations, hitbox,
+                                                        table.shapes, table.first, table.bound,
+                                                        exclude, active, 60.0))
+    matches = [np.array_equal(index, expected_index) and np.array_equal(shape, expected_shape)
+               and np.allclose(distance, expected_distance)
+               for index, distance, _, shape in results]
+    regions = [table.region(shape) for shape in expected_shape[:3]]
+    damage = ray_hit_result(['a'], 0, 1.0, np.zeros(3), shape=1)['damage']
+    
+    print(f"Ray hits: {int((expected_index >= 0).sum())}/{len(origins)}, regions of the aimed shots: {regions}")
+    print(f"Matching brute force (python{', cpp' if len(results) > 1 else ''}): {matches}, "
+          f"head shot damage: {damage}")
+    
+    return all(matches) and regions == ['body', 'head', 'wing'] and damage == 50
+
 if __name__ == "__main__":
     print("Running game logic tests...")
     test_sphere_intersection()
     test_ray_hit_detection()
+    test_batch_ray_hit()
+    test_sphere_overlaps()
+    test_world_simulation()
+    test_spatial_grid()
+    test_static_geometry()
+    test_hitboxes()
     print("Tests completed!") 
\ No newline at end of file
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Load test for the 3D Arena Shooter backend
+
+Connects hundreds or thousands of simulated players to a local server. Each
+bot walks in a circle sending player_move at --move-rate and fires at
+--shoot-rate, decodes its world_snapshot deltas like the browser client and
+acknowledges them. Reported at the end:
+
+  - messages per second sent and received
+  - move latency: player_move emitted -> own new position seen in a snapshot
+  - shot latency: shoot emitted -> own player_shot broadcast received
+  - server and load generator CPU usage
+
+Examples:
+    python loadtest.py --spawn async --bots 500 --duration 30
+    python loadtest.py --url http://localhost:5000 --server-pid 1234 --bots 200
+
+Needs the python-socketio asyncio client (pip install "python-socketio[asyncio_client]").
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+
+import numpy as np
+
+import snapshot
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_COMMANDS = {
+    # The threaded server's __main__ enables the reloader, so start it directly
+    'threaded': [sys.executable, '-c',
+                 'import os, server; server.socketio.run(server.app, host="127.0.0.1", '
+                 'port=int(os.environ["PORT"]), allow_unsafe_werkzeug=True)'],
+    'async': [sys.executable, 'async_server.py'],
+}
+
+
+class LoadStats:
+    """Counters and latency samples shared by all bots"""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.snapshot_bytes = 0
+        self.move_latency = []
+        self.shot_latency = []
+        self.errors = 0
+
+
+class Bot:
+    """One simulated player"""
+
+    def __init__(self, index, stats, args):
+        import socketio
+
+        self.index = index
+        self.stats = stats
+        self.move_rate = args.move_rate
+        self.shoot_rate = args.shoot_rate
+        self.room = f'load-{index % args.rooms}' if args.rooms > 1 else None
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.entity_id = None
+        self.baselines = {}
+        self.pending_moves = deque()  # (quantized x, quantized z, time sent)
+        self.pending_shots = deque()  # time sent
+        self.angle = random.uniform(0, 2 * math.pi)
+        self.radius = random.uniform(5, 60)
+
+        self.client.on('game_state', self.on_game_state)
+        self.client.on('world_snapshot', self.on_snapshot)
+        self.client.on('player_shot', self.on_player_shot)
+        self.client.on('*', self.on_other)
+
+    async def connect(self, url):
+        if self.room:
+            url = f'{url}?room={self.room}'
+        await self.client.connect(url, transports=['websocket'], wait_timeout=30)
+
+    async def on_game_state(self, data):
+        self.stats.received += 1
+        self.entity_id = data['players'][data['player_id']]['entity_id']
+        self.baselines.clear()
+
+    async def on_snapshot(self, data):
+        self.stats.received += 1
+        self.stats.snapshot_bytes += len(data)
+        try:
+            tick, state = snapshot.decode_delta(data, self.baselines)
+        except ValueError:
+            self.stats.errors += 1
+            return
+        self.baselines[tick] = state
+        if len(self.baselines) > snapshot.HISTORY_SIZE:
+            del self.baselines[min(self.baselines)]
+        if '/' in self.client.namespaces:  # Events can arrive before the connect ack
+            await self.client.emit('snapshot_ack', {'tick': tick})
+            self.stats.sent += 1
+
+        own = state.get(self.entity_id)
+        if own is None:
+            return
+        # Moves sent between ticks are coalesced: time the one this snapshot shows
+        for i, (qx, qz, sent) in enumerate(self.pending_moves):
+            if qx == own[0] and qz == own[2]:
+                self.stats.move_latency.append(time.perf_counter() - sent)
+                for _ in range(i + 1):
+                    self.pending_moves.popleft()
+                break
+
+    async def on_player_shot(self, data):
+        self.stats.received += 1
+        if data.get('player_id') == self.client.get_sid() and self.pending_shots:
+            self.stats.shot_latency.append(time.perf_counter() - self.pending_shots.popleft())
+
+    async def on_other(self, event, data=None):
+        self.stats.received += 1
+
+    async def run(self, duration):
+        """Move and shoot until duration seconds have passed"""
+        move_interval = 1.0 / self.move_rate
+        shot_every = max(1, round(self.move_rate / self.shoot_rate)) if self.shoot_rate > 0 else 0
+        end = time.monotonic() + duration
+        next_move = time.monotonic() + random.uniform(0, move_interval)
+        count = 0
+
+        while time.monotonic() < end and self.client.connected:
+            await asyncio.sleep(max(0.0, next_move - time.monotonic()))
+            next_move += move_interval
+            count += 1
+
+            self.angle += 0.05
+            x = self.radius * math.cos(self.angle)
+            z = self.radius * math.sin(self.angle)
+            self.pending_moves.append((snapshot.quantize_position(x), snapshot.quantize_position(z),
+                                       time.perf_counter()))
+            if len(self.pending_moves) > 256:
+                self.pending_moves.popleft()
+            await self.client.emit('player_move', {'x': x, 'y': 1.0, 'z': z, 'rotation': self.angle})
+            self.stats.sent += 1
+
+            if shot_every and count % shot_every == 0:
+                self.pending_shots.append(time.perf_counter())
+                await self.client.emit('shoot', {
+                    'origin': {'x': x, 'y': 1.0, 'z': z},
+                    'direction': {'x': -math.sin(self.angle), 'y': 0.0, 'z': math.cos(self.angle)},
+                    'player_position': {'x': x, 'y': 1.0, 'z': z}
+                })
+                self.stats.sent += 1
+
+    async def close(self):
+        if self.client.connected:
+            await self.client.disconnect()
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc (None where unavailable)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def percentiles(samples):
+    """p50/p95/p99/max of latency samples, in milliseconds"""
+    if not samples:
+        return None
+    values = np.array(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2), 'max_ms': round(float(values.max()), 2)}
+
+
+def start_server(mode, port):
+    """Start a local server process and wait until /health answers"""
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1')
+    process = subprocess.Popen(SERVER_COMMANDS[mode], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} server exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(f'{url}/health', timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start on port {port}')
+
+
+async def run_load_test(args, url, server_pid=None):
+    """Connect the bots, run them for args.duration seconds and summarize"""
+    stats = LoadStats()
+    bots = [Bot(i, stats, args) for i in range(args.bots)]
+
+    # Ramp up in batches so the handshakes do not all time out together
+    connected = []
+    for start in range(0, len(bots), args.ramp_batch):
+        batch = bots[start:start + args.ramp_batch]
+        results = await asyncio.gather(*[bot.connect(url) for bot in batch], return_exceptions=True)
+        for bot, result in zip(batch, results):
+            if isinstance(result, Exception):
+                stats.errors += 1
+            else:
+                connected.append(bot)
+    print(f'Connected {len(connected)}/{len(bots)} bots, running for {args.duration}s...')
+
+    # Only measure the steady state, not the ramp-up
+    stats.sent = stats.received = stats.snapshot_bytes = 0
+    stats.move_latency.clear()
+    stats.shot_latency.clear()
+    server_cpu = cpu_seconds(server_pid) if server_pid else None
+    client_cpu = time.process_time()
+    started = time.monotonic()
+
+    await asyncio.gather(*[bot.run(args.duration) for bot in connected])
+
+    elapsed = time.monotonic() - started
+    server_cpu_end = cpu_seconds(server_pid) if server_pid else None
+    client_cpu = time.process_time() - client_cpu
+    await asyncio.gather(*[bot.close() for bot in connected], return_exceptions=True)
+
+    return {
+        'bots': len(connected),
+        'connect_errors': len(bots) - len(connected),
+        'duration_s': round(elapsed, 2),
+        'sent_per_s': round(stats.sent / elapsed, 1),
+        'received_per_s': round(stats.received / elapsed, 1),
+        'snapshot_kbps': round(stats.snapshot_bytes / elapsed / 1024, 1),
+        'move_latency': percentiles(stats.move_latency),
+        'shot_latency': percentiles(stats.shot_latency),
+        'server_cpu_percent': (round(100 * (server_cpu_end - server_cpu) / elapsed, 1)
+                               if server_cpu is not None and server_cpu_end is not None else None),
+        'client_cpu_percent': round(100 * client_cpu / elapsed, 1),
+        'errors': stats.errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the game server with simulated players")
+    parser.add_argument('--url', help="server to test; default: start one with --spawn")
+    parser.add_argument('--spawn', choices=sorted(SERVER_COMMANDS), default='async',
+                        help="local server to start when --url is not given (default: async)")
+    parser.add_argument('--port', type=int, default=5055, help="port for the spawned server")
+    parser.add_argument('--server-pid', type=int, help="pid of the --url server, for CPU usage")
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--rooms', type=int, default=1, help="spread bots over this many rooms")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds to run after ramp-up")
+    parser.add_argument('--move-rate', type=float, default=30.0, help="player_move messages per second per bot")
+    parser.add_argument('--shoot-rate', type=float, default=1.0, help="shots per second per bot")
+    parser.add_argument('--ramp-batch', type=int, default=50, help="bots connecting at once")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON only")
+    args = parser.parse_args()
+
+    try:
+        import socketio  # noqa: F401
+        import aiohttp  # noqa: F401
+    except ImportError as e:
+        print(f"The load test needs the asyncio Socket.IO client: {e}")
+        return False
+
+    random.seed(args.seed)
+    process = None
+    url, server_pid = args.url, args.server_pid
+    if url is None:
+        process, url = start_server(args.spawn, args.port)
+        server_pid = process.pid
+        print(f'Started {args.spawn} server (pid {server_pid}) at {url}')
+
+    try:
+        report = asyncio.run(run_load_test(args, url, server_pid))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print('\nLoad test results')
+        for key, value in report.items():
+            print(f'  {key}: {value}')
+    return report['bots'] > 0 and report['errors'] == 0
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
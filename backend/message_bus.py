@@ -0,0 +1,190 @@
+# message_bus.py
+# Pluggable publish/subscribe bus for 3D Arena Shooter workers
+#
+# Worker processes use the bus for events that cross process boundaries,
+# such as lobby counts and /health aggregation. Game traffic stays inside
+# the worker that owns the room.
+#
+# Implementations:
+#   LocalBus           - in-process, for a single server process and tests
+#   MultiprocessingBus - one queue per worker, for cluster.py on one machine
+#   RedisBus           - Redis pub/sub, for workers on several machines
+
+import json
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List
+
+MessageCallback = Callable[[str, Any], None]
+
+
+class MessageBus(ABC):
+    """Interface shared by all bus implementations
+
+    Messages must be JSON-serializable. Subscribers are called with
+    (channel, message), from a background thread for out-of-process buses.
+    """
+
+    def __init__(self):
+        self.subscribers = {}  # channel -> list of callbacks
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel: str, callback: MessageCallback):
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(callback)
+
+    @abstractmethod
+    def publish(self, channel: str, message: Any):
+        """Send a message to every subscriber of channel, on all workers"""
+
+    def close(self):
+        pass
+
+    def _deliver(self, channel: str, message: Any):
+        with self.lock:
+            callbacks = list(self.subscribers.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(channel, message)
+            except Exception as e:
+                print(f'Message bus subscriber error on {channel}: {e}')
+
+
+class LocalBus(MessageBus):
+    """Delivers messages synchronously to subscribers in this process"""
+
+    def publish(self, channel: str, message: Any):
+        self._deliver(channel, message)
+
+
+class MultiprocessingBus(MessageBus):
+    """Fan-out bus between worker processes on one machine
+
+    Every worker owns an inbound queue; publishing puts the message on all of
+    them, including the publisher's own. Create the endpoints in the parent
+    with create_group() and hand one to each worker process.
+    """
+
+    def __init__(self, index: int, queues: List[Any]):
+        super().__init__()
+        self.index = index
+        self.queues = queues
+        self.thread = None
+
+    @classmethod
+    def create_group(cls, count: int, context=None) -> List['MultiprocessingBus']:
+        """Create one connected endpoint per worker"""
+        import multiprocessing
+        context = context or multiprocessing.get_context()
+        queues = [context.Queue() for _ in range(count)]
+        return [cls(index, queues) for index in range(count)]
+
+    def __getstate__(self):
+        # Only the queues cross the process boundary
+        return {'index': self.index, 'queues': self.queues}
+
+    def __setstate__(self, state):
+        self.__init__(state['index'], state['queues'])
+
+    def start(self):
+        """Start delivering messages from this endpoint's queue"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._dispatch, name='message-bus', daemon=True)
+            self.thread.start()
+
+    def subscribe(self, channel: str, callback: MessageCallback):
+        super().subscribe(channel, callback)
+        self.start()
+
+    def publish(self, channel: str, message: Any):
+        payload = json.dumps([channel, message])
+        for q in self.queues:
+            q.put(payload)
+
+    def close(self):
+        self.queues[self.index].put(None)
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def _dispatch(self):
+        inbox = self.queues[self.index]
+        while True:
+            try:
+                payload = inbox.get()
+            except (EOFError, OSError):
+                return
+            if payload is None:
+                return
+            channel, message = json.loads(payload)
+            self._deliver(channel, message)
+
+
+class RedisBus(MessageBus):
+    """Bus over Redis pub/sub, for workers spread over several hosts
+
+    Requires the optional redis package.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(f"RedisBus needs the redis package: {e}")
+        self.client = redis.Redis.from_url(url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.thread = None
+
+    def subscribe(self, channel: str, callback: MessageCallback):
+        super().subscribe(channel, callback)
+        self.pubsub.subscribe(**{channel: self._on_message})
+        if self.thread is None:
+            self.thread = self.pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def _on_message(self, item: Dict[str, Any]):
+        channel = item['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        self._deliver(channel, json.loads(item['data']))
+
+    def publish(self, channel: str, message: Any):
+        self.client.publish(channel, json.dumps(message))
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.stop()
+        self.pubsub.close()
+
+
+def create_bus(url: str = 'local') -> MessageBus:
+    """Create a bus from a MESSAGE_BUS style URL ('local' or 'redis://...')"""
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBus(url)
+    if url in ('', 'local'):
+        return LocalBus()
+    raise ValueError(f"Unknown message bus: {url}")
+
+
+def test_multiprocessing_bus():
+    """Test fan-out between two endpoints of a multiprocessing bus"""
+    print("Testing multiprocessing message bus...")
+
+    first, second = MultiprocessingBus.create_group(2)
+    received = queue.Queue()
+    second.subscribe('stats', lambda channel, message: received.put(message))
+    first.publish('stats', {'worker': 0, 'players': 3})
+
+    message = received.get(timeout=5)
+    first.close()
+    second.close()
+    print(f"Received: {message}")
+
+    return message == {'worker': 0, 'players': 3}
+
+
+if __name__ == "__main__":
+    print("Running message bus tests...")
+    test_multiprocessing_bus()
+    print("Tests completed!")
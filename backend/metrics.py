@@ -0,0 +1,311 @@
+# metrics.py
+# Low-overhead instrumentation for 3D Arena Shooter
+#
+# Counters and histograms are plain dicts and lists updated without locks, so
+# recording costs a few hundred nanoseconds. Updates from concurrent threads
+# can occasionally be lost, which is acceptable for monitoring. render()
+# produces the Prometheus text exposition format served at /metrics.
+
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as TallyCounter
+from typing import Callable, Dict, Sequence, Tuple
+
+# Seconds; spans fast handlers (tens of microseconds) to slow ticks
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# The sampling profiler endpoint exposes code paths, so it is opt-in
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+
+REGISTRY = []
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values
+
+    The name is the full sample name, ending in _total.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}  # label values -> count
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        values = self.values
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in list(self.values.items()):
+            yield self.name + format_labels(self.label_names, label_values), value
+
+
+class HistogramSeries:
+    """Bucket counts and sum of one label combination"""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.bounds = tuple(buckets)
+        self.series = {}  # label values -> HistogramSeries
+        REGISTRY.append(self)
+
+    def labels(self, *label_values) -> HistogramSeries:
+        """Series for one label combination; hold on to it in hot paths"""
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = HistogramSeries(self.bounds)
+        return series
+
+    def observe(self, value: float, *label_values):
+        self.labels(*label_values).observe(value)
+
+    def samples(self):
+        for label_values, series in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), series.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield (self.name + '_bucket'
+                       + format_labels(self.label_names, label_values, f'le="{le}"'), cumulative)
+            yield self.name + '_sum' + format_labels(self.label_names, label_values), series.sum
+            yield self.name + '_count' + format_labels(self.label_names, label_values), cumulative
+
+
+class Gauge:
+    """Value read from a callback when metrics are rendered
+
+    The callback returns a number, or a dict of label value tuples to numbers.
+    Pass kind='counter' for totals that are counted elsewhere.
+    """
+
+    def __init__(self, name: str, documentation: str, read: Callable, labels: Sequence[str] = (),
+                 kind: str = 'gauge'):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.read = read
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, dict):
+            for label_values, v in value.items():
+                yield self.name + format_labels(self.label_names, label_values), v
+        else:
+            yield self.name, value
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, value in metric.samples():
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics shared by both servers and the rooms
+
+HANDLER_SECONDS = Histogram('arena_handler_seconds', 'Socket.IO handler run time', ['event'])
+# Derived from the histogram counts so handlers only record one observation
+EVENTS = Gauge('arena_events_total', 'Socket.IO events handled',
+               lambda: {labels: sum(series.counts) for labels, series in list(HANDLER_SECONDS.series.items())},
+               ['event'], kind='counter')
+EVENT_ERRORS = Counter('arena_event_errors_total', 'Socket.IO handlers that raised', ['event'])
+EMITS = Counter('arena_emits_total', 'Events emitted by the server', ['event'])
+EMIT_RECIPIENTS = Counter('arena_emit_recipients_total', 'Clients reached by emitted events', ['event'])
+TICK_SECONDS = Histogram('arena_tick_seconds', 'Room tick duration')
+TICK_ERRORS = Counter('arena_tick_errors_total', 'Room ticks that raised and were skipped')
+SHOTS = Counter('arena_shots_total', 'Shots resolved, by hit test method', ['method'])
+THROTTLED = Counter('arena_throttled_total', 'Client events over their rate limit, merged or dropped',
+                    ['event', 'action'])
+STALE_INPUTS = Counter('arena_stale_inputs_total', 'Batched client inputs dropped as already processed')
+BOT_PLAN_SECONDS = Histogram('arena_bot_plan_seconds', 'Time to plan the bots of one room')
+BOT_PLANS_LATE = Counter('arena_bot_plans_late_total', 'Room ticks whose bot plan was not ready yet')
+
+
+def register_collision_calls(call_counts: Dict[Tuple[str, str], int]):
+    """Expose game_logic's per-backend call counts"""
+    Gauge('arena_collision_calls_total', 'game_logic collision calls by serving backend',
+          lambda: dict(call_counts), ['function', 'backend'], kind='counter')
+
+
+def count_emit(event: str, recipients: int):
+    EMITS.inc(event)
+    EMIT_RECIPIENTS.inc(event, amount=recipients)
+
+
+def instrument(event: str):
+    """Decorator counting and timing a Socket.IO handler (sync or async)"""
+    series = HANDLER_SECONDS.labels(event)
+    counts, bounds = series.counts, series.bounds
+    errors = EVENT_ERRORS
+    clock = time.perf_counter
+
+    def decorate(handler):
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                start = clock()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception:
+                    errors.inc(event)
+                    raise
+                finally:
+                    elapsed = clock() - start
+                    counts[bisect_left(bounds, elapsed)] += 1
+                    series.sum += elapsed
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                errors.inc(event)
+                raise
+            finally:
+                # HistogramSeries.observe, inlined to save a call per event
+                elapsed = clock() - start
+                counts[bisect_left(bounds, elapsed)] += 1
+                series.sum += elapsed
+        return wrapper
+    return decorate
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of all other threads
+
+    Stacks are aggregated in the collapsed format used by flame graph tools:
+    one "outer;inner;leaf count" line per distinct stack.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = TallyCounter()
+        self.samples = 0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks, most frequent first"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+
+profile_lock = threading.Lock()
+
+
+def profile(seconds: float, interval: float = 0.005) -> str:
+    """Sample all threads for a number of seconds; one profile runs at a time"""
+    if not profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        time.sleep(seconds)
+        return profiler.stop()
+    finally:
+        profile_lock.release()
+
+
+def test_metrics():
+    """Test rendering and the handler decorator's overhead"""
+    print("Testing metrics...")
+
+    @instrument('test_event')
+    def handler(value):
+        return value * 2
+
+    iterations = 20000
+    start = time.perf_counter()
+    for i in range(iterations):
+        handler(i)
+    per_call = (time.perf_counter() - start) / iterations
+
+    count_emit('test_event', 3)
+    text = render()
+    print(f"Instrumented call: {per_call * 1e9:.0f} ns")
+
+    # Every sample must belong to the family its TYPE line declares
+    family = kind = None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, kind = line.split()[2:4]
+        elif not line.startswith('#'):
+            name = line.split('{')[0].split(' ')[0]
+            suffixes = ('_bucket', '_sum', '_count') if kind == 'histogram' else ('',)
+            assert any(name == family + suffix for suffix in suffixes), f"{name} is not in family {family}"
+
+    return ('arena_events_total{event="test_event"} 20000' in text
+            and 'arena_handler_seconds_count{event="test_event"} 20000' in text)
+
+
+if __name__ == "__main__":
+    print("Running metrics tests...")
+    test_metrics()
+    print("Tests completed!")
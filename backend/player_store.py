@@ -0,0 +1,328 @@
+# player_store.py
+# Struct-of-arrays player storage for 3D Arena Shooter
+#
+# Player fields live in contiguous NumPy arrays indexed by a stable slot.
+# Slots of players that leave are reused through a free list, so hit tests
+# and snapshots can work on the arrays directly instead of walking a dict of
+# dicts. Handlers keep using the familiar players[player_id]['x'] access
+# through a lightweight dict-like view.
+#
+# Positions are also kept in a fixed-size ring buffer of past ticks, so hit
+# tests can rewind targets to the moment a lagging shooter saw them.
+
+import os
+import time
+from collections.abc import Mapping, MutableMapping
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+PLAYER_FIELDS = ('x', 'y', 'z', 'rotation', 'health', 'connected_at', 'last_update', 'rtt', 'input_seq',
+                 'hitbox')
+
+# Number of past ticks of positions kept per player (about 1 s at 30 Hz)
+HISTORY_LENGTH = int(os.environ.get('POSITION_HISTORY_LENGTH', 32))
+
+DEFAULT_PLAYER = {
+    'x': 0.0,
+    'y': 1.0,  # Player height
+    'z': 0.0,
+    'rotation': 0.0,
+    'health': 100,
+    'hitbox': 0,  # index of the player's hitbox set in game_logic.HITBOX_TABLE
+}
+
+
+class PlayerView(MutableMapping):
+    """Dict-like view of one player's slot in a PlayerStore
+
+    Reads and writes go straight to the store's arrays. A view must not be
+    used after its player has been removed from the store.
+    """
+
+    __slots__ = ('store', 'slot', 'player_id')
+
+    def __init__(self, store: 'PlayerStore', slot: int, player_id: str):
+        self.store = store
+        self.slot = slot
+        self.player_id = player_id
+
+    def __getitem__(self, key: str) -> Any:
+        store, slot = self.store, self.slot
+        if key == 'x':
+            return float(store.position[slot, 0])
+        if key == 'y':
+            return float(store.position[slot, 1])
+        if key == 'z':
+            return float(store.position[slot, 2])
+        if key == 'rotation':
+            return float(store.rotation[slot])
+        if key == 'health':
+            return int(store.health[slot])
+        if key == 'connected_at':
+            return float(store.connected_at[slot])
+        if key == 'last_update':
+            return float(store.last_update[slot])
+        if key == 'rtt':
+            return float(store.rtt[slot])
+        if key == 'input_seq':
+            return int(store.input_seq[slot])
+        if key == 'hitbox':
+            return int(store.hitbox[slot])
+        if key == 'id':
+            return self.player_id
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        store, slot = self.store, self.slot
+        if key == 'x':
+            store.position[slot, 0] = value
+        elif key == 'y':
+            store.position[slot, 1] = value
+        elif key == 'z':
+            store.position[slot, 2] = value
+        elif key == 'rotation':
+            store.rotation[slot] = value
+        elif key == 'health':
+            store.health[slot] = value
+        elif key == 'connected_at':
+            store.connected_at[slot] = value
+        elif key == 'last_update':
+            store.last_update[slot] = value
+        elif key == 'rtt':
+            store.rtt[slot] = value
+        elif key == 'input_seq':
+            store.input_seq[slot] = value
+        elif key == 'hitbox':
+            store.hitbox[slot] = value
+        elif key != 'id':
+            raise KeyError(key)
+
+    def __delitem__(self, key: str):
+        raise TypeError("Player fields cannot be deleted")
+
+    def __iter__(self) -> Iterator[str]:
+        yield 'id'
+        yield from PLAYER_FIELDS
+
+    def __len__(self) -> int:
+        return len(PLAYER_FIELDS) + 1
+
+    def __repr__(self) -> str:
+        return f"PlayerView({dict(self)!r})"
+
+
+class PlayerStore(MutableMapping):
+    """Player records stored as NumPy arrays with a stable id-to-slot index
+
+    Only slots below high_water can be in use; active marks which of them
+    hold a player. Arrays are grown by doubling, so views returned by
+    arrays() are only valid until the next add().
+
+    record_history() snapshots every position into a ring of history_length
+    ticks shared by all players; positions_at() interpolates from it.
+    """
+
+    def __init__(self, capacity: int = 64, history_length: int = HISTORY_LENGTH):
+        self.slot_of = {}  # player id -> slot
+        self.ids = [None] * capacity  # slot -> player id
+        self.free_slots = []
+        self.high_water = 0
+        self.history_length = history_length
+        self.history_time = np.full(history_length, -np.inf)  # time of each ring entry
+        self.history_head = 0  # ring entry written next
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self.capacity = capacity
+        self.position = np.zeros((capacity, 3), dtype=np.float64)
+        self.rotation = np.zeros(capacity, dtype=np.float64)
+        self.health = np.zeros(capacity, dtype=np.int32)
+        self.connected_at = np.zeros(capacity, dtype=np.float64)
+        self.last_update = np.zeros(capacity, dtype=np.float64)
+        self.rtt = np.zeros(capacity, dtype=np.float64)  # smoothed round trip time, seconds
+        self.input_seq = np.zeros(capacity, dtype=np.int64)  # last client input sequence processed
+        self.hitbox = np.zeros(capacity, dtype=np.int32)  # hitbox set, see DEFAULT_PLAYER
+        self.active = np.zeros(capacity, dtype=bool)
+        # Ring entry-major, so recording a tick is one contiguous copy
+        self.history_position = np.zeros((self.history_length, capacity, 3), dtype=np.float64)
+
+    def _grow(self):
+        old = (self.position, self.rotation, self.health, self.connected_at,
+               self.last_update, self.rtt, self.input_seq, self.hitbox, self.active)
+        old_history = self.history_position
+        size = self.capacity
+        self._allocate(size * 2)
+        for new_array, old_array in zip((self.position, self.rotation, self.health, self.connected_at,
+                                         self.last_update, self.rtt, self.input_seq, self.hitbox, self.active), old):
+            new_array[:size] = old_array
+        self.history_position[:, :size] = old_history
+        self.ids.extend([None] * size)
+
+    def add(self, player_id: str, fields: Optional[Mapping] = None, now: Optional[float] = None) -> int:
+        """Insert a player (or overwrite an existing one) and return its slot"""
+        slot = self.slot_of.get(player_id)
+        slot_is_new = slot is None
+        if slot_is_new:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                if self.high_water == self.capacity:
+                    self._grow()
+                slot = self.high_water
+                self.high_water += 1
+            self.slot_of[player_id] = slot
+            self.ids[slot] = player_id
+            self.active[slot] = True
+
+            now = time.time() if now is None else now
+            self.position[slot] = (DEFAULT_PLAYER['x'], DEFAULT_PLAYER['y'], DEFAULT_PLAYER['z'])
+            self.rotation[slot] = DEFAULT_PLAYER['rotation']
+            self.health[slot] = DEFAULT_PLAYER['health']
+            self.connected_at[slot] = now
+            self.last_update[slot] = now
+            self.rtt[slot] = 0.0
+            self.input_seq[slot] = 0
+            self.hitbox[slot] = DEFAULT_PLAYER['hitbox']
+
+        if fields:
+            view = PlayerView(self, slot, player_id)
+            for key, value in fields.items():
+                view[key] = value
+        if slot_is_new:
+            # Overwrite whatever the slot's previous owner left in the history
+            self.history_position[:, slot] = self.position[slot]
+        return slot
+
+    def remove(self, player_id: str) -> Dict[str, Any]:
+        """Remove a player, returning a plain dict copy of its last state"""
+        slot = self.slot_of.pop(player_id)
+        data = dict(PlayerView(self, slot, player_id))
+        self.ids[slot] = None
+        self.active[slot] = False
+        self.free_slots.append(slot)
+        return data
+
+    def slot(self, player_id: str) -> int:
+        return self.slot_of[player_id]
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Zero-copy views over the used slots: (position, rotation, health, active)"""
+        n = self.high_water
+        return self.position[:n], self.rotation[:n], self.health[:n], self.active[:n]
+
+    def record_history(self, now: float):
+        """Store every player's current position as the ring entry for time now"""
+        n = self.high_water
+        self.history_position[self.history_head, :n] = self.position[:n]
+        self.history_time[self.history_head] = now
+        self.history_head = (self.history_head + 1) % self.history_length
+
+    def positions_at(self, when: float) -> np.ndarray:
+        """Positions of the used slots at time when, interpolated from the history
+
+        Times before the oldest entry clamp to it; times after the newest
+        entry return the newest entry, which is what clients last saw.
+        Falls back to the current positions if nothing has been recorded.
+        """
+        n = self.high_water
+        order = (self.history_head + np.arange(self.history_length)) % self.history_length
+        times = self.history_time[order]
+        recorded = order[times > -np.inf]
+        if len(recorded) == 0:
+            return self.position[:n].copy()
+        times = self.history_time[recorded]
+
+        after = int(np.searchsorted(times, when, side='right'))
+        if after == 0:
+            return self.history_position[recorded[0], :n].copy()
+        if after == len(recorded):
+            return self.history_position[recorded[-1], :n].copy()
+
+        before_time, after_time = times[after - 1], times[after]
+        f = (when - before_time) / (after_time - before_time)
+        before = self.history_position[recorded[after - 1], :n]
+        return before + (self.history_position[recorded[after], :n] - before) * f
+
+    def active_slots(self) -> np.ndarray:
+        """Indices of the slots that currently hold a player"""
+        return np.flatnonzero(self.active[:self.high_water])
+
+    def to_dict(self, player_id: str) -> Dict[str, Any]:
+        """Plain dict copy of a player's record"""
+        return dict(self[player_id])
+
+    # Mapping interface so existing handlers can treat the store like a dict
+    def __getitem__(self, player_id: str) -> PlayerView:
+        return PlayerView(self, self.slot_of[player_id], player_id)
+
+    def __setitem__(self, player_id: str, fields: Mapping):
+        self.add(player_id, fields)
+
+    def __delitem__(self, player_id: str):
+        self.remove(player_id)
+
+    def __contains__(self, player_id: object) -> bool:
+        return player_id in self.slot_of
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.slot_of))
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    _missing = object()
+
+    def pop(self, player_id: str, default: Any = _missing) -> Any:
+        if player_id not in self.slot_of:
+            if default is self._missing:
+                raise KeyError(player_id)
+            return default
+        return self.remove(player_id)
+
+
+def test_player_store():
+    """Test slot reuse and dict-style access"""
+    print("Testing player store...")
+
+    store = PlayerStore(capacity=2)
+    store['a'] = {'x': 1.0, 'y': 2.0, 'z': 3.0}
+    store['b'] = {'x': 4.0}
+    store['c'] = {'x': 5.0}  # Forces the arrays to grow
+    store['b']['health'] = store['b']['health'] - 25
+
+    removed = store.pop('b')
+    slot = store.add('d')
+
+    print(f"Removed player: {removed}")
+
+    return (removed['health'] == 75 and slot == 1 and len(store) == 3
+            and store['a']['z'] == 3.0 and list(store.active_slots()) == [0, 1, 2])
+
+
+def test_position_history():
+    """Test rewinding positions through the history ring buffer"""
+    print("Testing position history...")
+
+    store = PlayerStore(capacity=2, history_length=4)
+    store['a'] = {'x': 0.0}
+    for tick in range(6):  # Wraps the ring
+        store['a']['x'] = tick * 10.0
+        store.record_history(float(tick))
+    store['b'] = {'x': 7.0}  # Joins after the last recorded tick
+
+    halfway = store.positions_at(4.5)
+    oldest = store.positions_at(0.0)
+    latest = store.positions_at(9.0)
+
+    print(f"Positions at t=4.5: {halfway[:, 0]}")
+
+    return (halfway[0, 0] == 45.0 and oldest[0, 0] == 20.0 and latest[0, 0] == 50.0
+            and halfway[1, 0] == 7.0)
+
+
+if __name__ == "__main__":
+    print("Running player store tests...")
+    test_player_store()
+    test_position_history()
+    print("Tests completed!")
@@ -0,0 +1,100 @@
+# rate_limit.py
+# Per-connection token buckets for client events in 3D Arena Shooter
+#
+# Every (connection, event) pair gets a bucket that refills at the event's
+# rate up to its burst size; each message spends one token. Checking is a
+# dict lookup and a little arithmetic, with no timers or background work.
+# Updates are not locked: concurrent handlers for one connection can at
+# worst let an extra message through, which is acceptable for throttling.
+
+import os
+import time
+from typing import Callable, Dict, Tuple
+
+# event -> (messages per second, burst). Browsers send player_move every
+# frame; excess moves are merged by the room rather than dropped, so its
+# budget only bounds handler work. Shots are capped well above the client's
+# 200 ms rapid-fire cooldown.
+DEFAULT_BUDGETS = {
+    'player_move': (60.0, 30.0),
+    'player_action': (10.0, 20.0),
+    'shoot': (10.0, 10.0),
+    'join_room': (1.0, 3.0),
+}
+
+
+def parse_budgets(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Budgets from "event=rate/burst,..." (burst defaults to rate); unknown text raises ValueError"""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        budgets[event.strip()] = (float(rate), float(burst or rate))
+    return budgets
+
+
+# RATE_LIMITS overrides or extends the defaults, e.g. "player_move=30/15,shoot=5"
+BUDGETS = {**DEFAULT_BUDGETS, **parse_budgets(os.environ.get('RATE_LIMITS', ''))}
+
+
+class RateLimiter:
+    """Token bucket per connection and event; events without a budget are unlimited"""
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.budgets = dict(BUDGETS if budgets is None else budgets)
+        self.clock = clock
+        self.buckets = {}  # (connection id, event) -> [tokens, time of last refill]
+
+    def allow(self, connection_id: str, event: str) -> bool:
+        """Spend a token for one message; False if the connection is over budget"""
+        budget = self.budgets.get(event)
+        if budget is None:
+            return True
+        rate, burst = budget
+        now = self.clock()
+        key = (connection_id, event)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [burst - 1.0, now]
+            return True
+
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1.0:
+            bucket[0] = tokens - 1.0
+            return True
+        bucket[0] = tokens
+        return False
+
+    def forget(self, connection_id: str):
+        """Drop a closed connection's buckets"""
+        for event in self.budgets:
+            self.buckets.pop((connection_id, event), None)
+
+
+def test_rate_limiter():
+    """Test burst, refill and per-connection isolation"""
+    print("Testing rate limiter...")
+
+    now = [0.0]
+    limiter = RateLimiter({'shoot': (10.0, 5.0)}, clock=lambda: now[0])
+    burst = sum(limiter.allow('a', 'shoot') for _ in range(20))
+    other = limiter.allow('b', 'shoot')
+    # One second at 100 messages per second: about 10 get through
+    allowed = 0
+    for _ in range(100):
+        now[0] += 0.01
+        allowed += limiter.allow('a', 'shoot')
+    unlimited = all(limiter.allow('a', 'ping') for _ in range(100))
+    limiter.forget('a')
+
+    print(f"Burst allowed: {burst}, then {allowed} in 1 s at 100/s")
+    return (burst == 5 and other and 9 <= allowed <= 11 and unlimited
+            and ('a', 'shoot') not in limiter.buckets)
+
+
+if __name__ == "__main__":
+    print("Running rate limiter tests...")
+    test_rate_limiter()
+    print("Tests completed!")
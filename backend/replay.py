@@ -0,0 +1,414 @@
+# replay.py
+# Match replay recording for 3D Arena Shooter
+#
+# A room hands its tick snapshots, the inputs it accepted and the events it
+# emitted to a ReplayRecorder, which only queues them: encoding and disk
+# writes happen on a background thread, so recording costs the game thread a
+# queue put per record. Each match is one append-only binary log.
+#
+# File format (little-endian):
+#   header:  8 byte magic, u16 version, u16 keyframe interval
+#   record:  u8 kind, u32 tick, f64 time, u32 payload length, payload
+#   trailer: u64 offset of the index record, 8 byte magic (written on close)
+#
+# Snapshots are snapshot.py deltas: a full one (keyframe) every keyframe
+# interval ticks and a delta against the previous tick otherwise. Events and
+# inputs are compact JSON. Records tagged tick N happened after snapshot N
+# was taken and before snapshot N+1, so replaying from a keyframe restores
+# the state and every event that follows it. A log whose writer died has no
+# trailer; the reader then rebuilds the keyframe index by scanning headers.
+
+import json
+import mmap
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter, namedtuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import snapshot
+
+# Recording is opt-in: rooms only record when REPLAY_DIR is set
+REPLAY_DIR = os.environ.get('REPLAY_DIR', '')
+KEYFRAME_INTERVAL = int(os.environ.get('REPLAY_KEYFRAME_INTERVAL', 60))  # ticks
+FLUSH_INTERVAL = 1.0  # seconds a record may sit in the writer's buffer
+
+MAGIC = b'ARNRPLY\x00'
+TRAILER_MAGIC = b'ARNRIDX\x00'
+VERSION = 1
+
+FILE_HEADER = struct.Struct('<8sHH')
+RECORD_HEADER = struct.Struct('<BIdI')
+TRAILER = struct.Struct('<Q8s')
+INDEX_ENTRY = struct.Struct('<IQ')  # keyframe tick, record offset
+
+# Record kinds
+RECORD_METADATA = 1
+RECORD_KEYFRAME = 2
+RECORD_DELTA = 3
+RECORD_EVENT = 4  # [event, recipient or null, data]
+RECORD_INPUT = 5  # [player id, event, data]
+RECORD_INDEX = 6
+
+Record = namedtuple('Record', 'kind tick time payload offset')
+
+_CLOSE = object()
+
+
+def compact_json(value: Any) -> bytes:
+    # numpy scalars and arrays can end up in event data
+    return json.dumps(value, separators=(',', ':'),
+                      default=lambda o: o.tolist() if hasattr(o, 'tolist') else str(o)).encode('utf-8')
+
+
+def replay_path(directory: str, room_id: str, started: float) -> str:
+    """Log file for a match; room ids come from clients, so only safe characters are kept"""
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', room_id)[:64] or 'room'
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+    return os.path.join(directory, f'{name}-{stamp}-{os.getpid()}.replay')
+
+
+def recorder_for_room(room_id: str, directory: str = REPLAY_DIR) -> Optional['ReplayRecorder']:
+    """A recorder for a new room, or None when recording is off"""
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return ReplayRecorder(replay_path(directory, room_id, time.time()))
+
+
+class ReplayRecorder:
+    """Append-only replay log written by a background thread
+
+    The record methods are safe to call from any thread and never block on
+    disk. After close() further records are ignored. If the disk fails the
+    recorder logs once and drops everything after that.
+    """
+
+    def __init__(self, path: str, keyframe_interval: int = KEYFRAME_INTERVAL,
+                 flush_interval: float = FLUSH_INTERVAL, log: Callable[[str], None] = print):
+        self.path = path
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.flush_interval = flush_interval
+        self.log = log
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.records = 0
+        self.bytes_written = 0
+
+        # Writer thread state
+        self.file = open(path, 'wb', buffering=1 << 20)
+        self.offset = 0
+        self.index = []  # (keyframe tick, offset)
+        self.previous = None  # (tick, state) of the last snapshot written
+        self.failed = False
+
+        self._write(FILE_HEADER.pack(MAGIC, VERSION, self.keyframe_interval))
+        self.thread = threading.Thread(target=self._run, name='replay-writer', daemon=True)
+        self.thread.start()
+
+    # Game thread side: queue and return
+
+    def metadata(self, data: Dict[str, Any], when: float):
+        if not self.closed:
+            self.queue.put((RECORD_METADATA, 0, when, data))
+
+    def snapshot(self, tick: int, when: float, state: Dict[int, tuple]):
+        """Queue a captured snapshot state; it must not be modified afterwards"""
+        if not self.closed:
+            self.queue.put((RECORD_DELTA, tick, when, state))
+
+    def event(self, tick: int, when: float, event: str, data: Any, to: Optional[str] = None):
+        if not self.closed:
+            self.queue.put((RECORD_EVENT, tick, when, [event, to, data]))
+
+    def input(self, tick: int, when: float, player_id: str, event: str, data: Any):
+        if not self.closed:
+            self.queue.put((RECORD_INPUT, tick, when, [player_id, event, data]))
+
+    def close(self):
+        """Write out everything queued, then the keyframe index, and close the file"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    # Writer thread side
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            # Drain whatever else is queued so it goes out in one write
+            items = [] if item is None else [item]
+            while items and items[-1] is not _CLOSE:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = bool(items) and items[-1] is _CLOSE
+            if closing:
+                items.pop()
+            if items and not self.failed:
+                self._guard(self._write_records, items)
+            if closing:
+                self._guard(self._finish)
+                return
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._guard(self.file.flush)
+                last_flush = time.monotonic()
+
+    def _guard(self, action, *args):
+        if self.failed and action is not self._finish:
+            return
+        try:
+            action(*args)
+        except (OSError, ValueError) as e:
+            if not self.failed:
+                self.log(f'Replay recording to {self.path} failed: {e}')
+            self.failed = True
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.offset += len(data)
+        self.bytes_written += len(data)
+
+    def _write_record(self, kind: int, tick: int, when: float, payload: bytes):
+        self._write(RECORD_HEADER.pack(kind, tick, when, len(payload)) + payload)
+        self.records += 1
+
+    def _write_records(self, items: List[tuple]):
+        for kind, tick, when, data in items:
+            if kind == RECORD_DELTA:
+                self._write_snapshot(tick, when, data)
+            else:
+                self._write_record(kind, tick, when, compact_json(data))
+
+    def _write_snapshot(self, tick: int, when: float, state: Dict[int, tuple]):
+        previous = self.previous
+        if previous is None or tick % self.keyframe_interval == 0:
+            self.index.append((tick, self.offset))
+            self._write_record(RECORD_KEYFRAME, tick, when, snapshot.encode_delta(tick, state))
+        else:
+            data = snapshot.encode_delta(tick, state, previous[0], previous[1])
+            if data is None:  # Nothing moved
+                data = snapshot.HEADER.pack(tick, previous[0], 0, 0)
+            self._write_record(RECORD_DELTA, tick, when, data)
+        self.previous = (tick, state)
+
+    def _finish(self):
+        try:
+            if not self.failed:
+                index_offset = self.offset
+                entries = b''.join(INDEX_ENTRY.pack(tick, offset) for tick, offset in self.index)
+                self._write_record(RECORD_INDEX, 0, 0.0, entries)
+                self._write(TRAILER.pack(index_offset, TRAILER_MAGIC))
+        finally:
+            self.file.close()
+
+
+class ReplayReader:
+    """Memory-mapped view of a replay log with random access by tick"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.keyframe_interval = FILE_HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a replay log")
+        if version != VERSION:
+            raise ValueError(f"Unsupported replay version {version}")
+
+        self.end = len(self.data)
+        self.index = self._read_index()
+        if self.index is None:
+            # No trailer: the recording was cut short, so scan for keyframes
+            self.complete = False
+            self.index = [(record.tick, record.offset) for record in self.records()
+                          if record.kind == RECORD_KEYFRAME]
+        else:
+            self.complete = True
+        self.keyframe_ticks = [tick for tick, _ in self.index]
+        self.metadata = next((json.loads(bytes(record.payload)) for record in self.records()
+                              if record.kind == RECORD_METADATA), {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def _read_index(self) -> Optional[List[Tuple[int, int]]]:
+        if self.end < FILE_HEADER.size + TRAILER.size:
+            return None
+        index_offset, magic = TRAILER.unpack_from(self.data, self.end - TRAILER.size)
+        if magic != TRAILER_MAGIC:
+            return None
+        kind, _, _, length = RECORD_HEADER.unpack_from(self.data, index_offset)
+        if kind != RECORD_INDEX:
+            raise ValueError(f"Corrupt replay index in {self.path}")
+        # Records end where the index starts
+        self.end = index_offset
+        start = index_offset + RECORD_HEADER.size
+        return [INDEX_ENTRY.unpack_from(self.data, start + i)
+                for i in range(0, length, INDEX_ENTRY.size)]
+
+    def records(self, offset: int = FILE_HEADER.size) -> Iterator[Record]:
+        """Records from offset on; payloads are zero-copy views into the file"""
+        data = memoryview(self.data)
+        end = self.end
+        header_size = RECORD_HEADER.size
+        while offset + header_size <= end:
+            kind, tick, when, length = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + header_size
+            if start + length > end:
+                break  # Torn write at the end of an unfinished log
+            yield Record(kind, tick, when, data[start:start + length], offset)
+            offset = start + length
+
+    def keyframe_before(self, tick: int) -> Tuple[int, int]:
+        """(tick, offset) of the last keyframe at or before tick"""
+        position = bisect_right(self.keyframe_ticks, tick) - 1
+        if position < 0:
+            raise KeyError(f"No snapshot at or before tick {tick}")
+        return self.index[position]
+
+    def seek(self, tick: int) -> Iterator[Tuple[Record, Dict[int, tuple]]]:
+        """Records from the keyframe before tick on, each with the snapshot state current at it"""
+        _, offset = self.keyframe_before(tick)
+        baselines = {}
+        state = {}
+        for record in self.records(offset):
+            if record.kind in (RECORD_KEYFRAME, RECORD_DELTA):
+                snapshot_tick, state = snapshot.decode_delta(record.payload, baselines)
+                # Deltas only ever refer to the previous tick
+                baselines = {snapshot_tick: state}
+            yield record, state
+
+    def state_at(self, tick: int) -> Tuple[int, Dict[int, tuple]]:
+        """Quantized entity state of the last snapshot at or before tick, and its tick"""
+        found_tick, found = self.keyframe_before(tick)[0], None
+        for record, state in self.seek(tick):
+            if record.kind in (RECORD_KEYFRAME, RECORD_DELTA):
+                if record.tick > tick:
+                    break
+                found_tick, found = record.tick, state
+        return found_tick, found
+
+    def events(self, start_tick: int = 0, end_tick: Optional[int] = None,
+               kinds: Tuple[int, ...] = (RECORD_EVENT, RECORD_INPUT)) -> Iterator[Tuple[int, float, int, list]]:
+        """(tick, time, kind, decoded JSON) of events and inputs in [start_tick, end_tick]"""
+        try:
+            _, offset = self.keyframe_before(start_tick)
+        except KeyError:
+            offset = FILE_HEADER.size
+        for record in self.records(offset):
+            if end_tick is not None and record.tick > end_tick:
+                break
+            if record.kind in kinds and record.tick >= start_tick:
+                yield record.tick, record.time, record.kind, json.loads(bytes(record.payload))
+
+    def summary(self) -> Dict[str, Any]:
+        kinds = Counter()
+        events = Counter()
+        last_tick = 0
+        for record in self.records():
+            kinds[record.kind] += 1
+            last_tick = max(last_tick, record.tick)
+            if record.kind in (RECORD_EVENT, RECORD_INPUT):
+                event = json.loads(bytes(record.payload))[0 if record.kind == RECORD_EVENT else 1]
+                events[event] += 1
+        return {
+            'metadata': self.metadata,
+            'complete': self.complete,
+            'bytes': len(self.data),
+            'keyframes': len(self.index),
+            'snapshots': kinds[RECORD_KEYFRAME] + kinds[RECORD_DELTA],
+            'last_tick': last_tick,
+            'events': dict(events),
+        }
+
+
+def test_replay_roundtrip():
+    """Test recording, indexed seeking and reading a log without its trailer"""
+    import random
+    import shutil
+    import tempfile
+    print("Testing replay recording...")
+
+    rng = random.Random(7)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'match.replay')
+        recorder = ReplayRecorder(path, keyframe_interval=16, flush_interval=0.01)
+        recorder.metadata({'room': 'test', 'tick_rate': 30}, 0.0)
+        states = {}
+        entities = {1: [0, 32, 0, 0, 100, 0], 2: [320, 32, -64, 1000, 100, 0]}
+        for tick in range(1, 201):
+            for fields in entities.values():
+                fields[0] += rng.randint(-8, 8)
+                fields[5] = tick & 0xFFFF
+            if tick == 100:
+                entities[3] = [0, 32, 0, 0, 100, 0]
+                del entities[1]
+            states[tick] = {entity_id: tuple(fields) for entity_id, fields in entities.items()}
+            recorder.snapshot(tick, tick / 30.0, states[tick])
+            if tick % 10 == 0:
+                recorder.input(tick, tick / 30.0, 'a', 'shoot', {'origin': [0, 1, 0]})
+                recorder.event(tick, tick / 30.0, 'player_health_update', {'player_id': 'b', 'health': 75})
+        recorder.close()
+
+        with ReplayReader(path) as reader:
+            seeks = all(reader.state_at(tick) == (tick, states[tick]) for tick in rng.sample(range(1, 201), 40))
+            events = list(reader.events(95, 115))
+            summary = reader.summary()
+
+        # Cut off the trailer and half a record, as if the server died while writing
+        torn = os.path.join(directory, 'torn.replay')
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(torn, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with ReplayReader(torn) as reader:
+            torn_tick = reader.keyframe_ticks[-1]
+            recovered = not reader.complete and reader.state_at(torn_tick) == (torn_tick, states[torn_tick])
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"Recorded {summary['snapshots']} ticks in {summary['bytes']} bytes, "
+          f"{summary['keyframes']} keyframes")
+
+    return (seeks and recovered and summary['complete'] and len(events) == 4
+            and [e[0] for e in events] == [100, 100, 110, 110])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # python replay.py match.replay [tick]: summarize a log, or dump one tick
+        with ReplayReader(sys.argv[1]) as reader:
+            if len(sys.argv) > 2:
+                tick = int(sys.argv[2])
+                print(reader.state_at(tick))
+                for event in reader.events(tick, tick):
+                    print(event)
+            else:
+                print(json.dumps(reader.summary(), indent=2))
+    else:
+        print("Running replay tests...")
+        test_replay_roundtrip()
+        print("Tests completed!")
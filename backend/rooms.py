@@ -0,0 +1,747 @@
+# rooms.py
+# Per-room game instances for 3D Arena Shooter
+#
+# Each room is an independent match with its own player store, broadphase,
+# world simulation, snapshot history and tick. Rooms do not know about the transport; they
+# send events through the emit callable they are created with, which the
+# server scopes to the room's Socket.IO room. With a ReplayRecorder, a room
+# also logs its snapshots, inputs and events for replays. Rooms short of
+# players are topped up with server-hosted bots (see bots.py).
+
+import math
+import os
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+import numpy as np
+
+import bots
+import game_logic
+import metrics
+import snapshot
+from player_store import PlayerStore
+from replay import ReplayRecorder
+from timer_wheel import TimerWheel
+
+# Authoritative tick loop: movement is recorded as it arrives and sent out
+# once per tick as a single batched snapshot instead of per message.
+TICK_RATE = int(os.environ.get('TICK_RATE', 30))  # ticks per second, e.g. 20/30/60
+
+PLAYER_RADIUS = 0.5  # For pushes out of asteroids and obstacles; shots hit hitboxes
+# Radius of the grid entries bounding players' hitboxes, whichever set they use
+HIT_RADIUS = float(game_logic.HITBOX_TABLE.bound.max())
+
+# Broadphase for hit detection, updated in place as players move. Below
+# BROADPHASE_MIN_PLAYERS a brute-force batch test is cheaper than the grid.
+GRID_CELL_SIZE = float(os.environ.get('GRID_CELL_SIZE', 8.0))
+BROADPHASE_MIN_PLAYERS = int(os.environ.get('BROADPHASE_MIN_PLAYERS', 64))
+
+# Area of interest: clients only receive snapshot updates for entities within
+# this radius of themselves. 0 disables filtering.
+AOI_RADIUS = float(os.environ.get('AOI_RADIUS', 0))
+
+# Lag compensation: shots are tested against where targets were when the
+# shooter saw them, i.e. one round trip ago, but never more than MAX_REWIND
+# seconds back. 0 disables rewinding.
+MAX_REWIND = float(os.environ.get('MAX_REWIND', 0.25))
+RTT_SMOOTHING = 0.2  # weight of a new RTT sample in the running average
+MAX_RTT = 1.0
+
+# Players that send no updates for IDLE_TIMEOUT seconds are dropped; the
+# expiry wheel is checked every EXPIRY_RESOLUTION seconds
+IDLE_TIMEOUT = float(os.environ.get('IDLE_TIMEOUT', 10))
+EXPIRY_RESOLUTION = 0.25
+
+# Asteroid hits push players out every step, but only damage them this often
+ASTEROID_HIT_COOLDOWN = 0.5
+
+# Batched player_move messages carry at most this many input frames; older
+# frames beyond it are ignored, since only the newest position matters
+MAX_INPUTS_PER_MESSAGE = 32
+# Input sequence numbers are stored as int64
+MAX_INPUT_SEQ = 2 ** 63 - 1
+
+# Shots must start within this distance of the shooter's stored position.
+# The web client shoots from its third-person camera, up to ~20 units
+# behind and above the player, and the stored position lags a little.
+MAX_SHOT_ORIGIN_OFFSET = float(os.environ.get('MAX_SHOT_ORIGIN_OFFSET', 30.0))
+
+DEFAULT_ROOM = 'default'
+
+# emit(event, data, to=None, skip_sid=None); to defaults to the whole room
+EmitFunction = Callable[..., None]
+
+
+def finite(value) -> float:
+    """float(value), raising ValueError for NaN and infinities
+
+    Python's json accepts NaN and Infinity, and one of them in the player
+    arrays would break the grid and every snapshot of the room.
+    """
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value!r} is not a finite number")
+    return number
+
+
+def parse_seq(value) -> int:
+    """Input sequence number, raising ValueError unless it is in 0..MAX_INPUT_SEQ"""
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"{value!r} is not a valid input sequence")
+    seq = int(value)
+    if not 0 <= seq <= MAX_INPUT_SEQ:
+        raise ValueError(f"{value!r} is not a valid input sequence")
+    return seq
+
+
+def parse_inputs(batch) -> list:
+    """Validated (seq, x, y, z, rotation) frames of a batched move, in sequence order"""
+    if not isinstance(batch, list):
+        raise TypeError("inputs must be a list")
+    frames = []
+    for frame in batch[-MAX_INPUTS_PER_MESSAGE:]:
+        seq, x, y, z, rotation = frame  # ValueError unless exactly five values
+        frames.append((parse_seq(seq), finite(x), finite(y), finite(z), finite(rotation)))
+    frames.sort()
+    return frames
+
+
+class GameRoom:
+    """One match: its own players, broadphase, snapshots and tick loop"""
+
+    def __init__(self, room_id: str, emit: EmitFunction, tick_rate: int = TICK_RATE,
+                 aoi_radius: float = AOI_RADIUS, clock: Callable[[], float] = time.time,
+                 fallback_hit_test: Optional[Callable] = None,
+                 log: Callable[[str], None] = print, max_rewind: float = MAX_REWIND,
+                 map_name: Optional[str] = None,
+                 projectile_speed: float = game_logic.PROJECTILE_SPEED,
+                 recorder: Optional[ReplayRecorder] = None,
+                 bot_fill: int = bots.BOT_FILL, bot_pool: str = bots.BOT_POOL):
+        self.room_id = room_id
+        self._emit = emit
+        self.tick_rate = tick_rate
+        self.aoi_radius = aoi_radius
+        self.max_rewind = max_rewind
+        self.projectile_speed = projectile_speed
+        self.clock = clock
+        self.fallback_hit_test = fallback_hit_test
+        self.log = log
+        self.recorder = recorder  # replay log of this match, if recording
+
+        self.players = PlayerStore()
+        self.spatial_grid = game_logic.SpatialGrid(cell_size=GRID_CELL_SIZE)
+        self.snapshot_encoder = snapshot.SnapshotEncoder()
+        self.pending_shots = []  # (shooter id, ray data, view time) queued since the last tick
+        self.deferred_moves = {}  # player id -> latest throttled move, applied with the next tick
+        self.world = game_logic.WorldSimulation(map_name or game_logic.map_for_room(room_id),
+                                                player_radius=PLAYER_RADIUS)
+        self.world_updated = None  # clock time the world was last advanced to
+        self.asteroid_hits = {}  # player id -> time of the last asteroid damage
+        self.tick_count = 0
+        self.lock = threading.Lock()
+        # Set here rather than in ticks(): a stop() that lands before the
+        # scheduled tick loop first runs must not be undone by it
+        self.running = True
+        # Bots that fill the room up to bot_fill players, if enabled
+        self.bots = bots.BotSquad(self, bot_fill, bots.bot_executor(bot_pool)) if bot_fill > 0 else None
+        if recorder is not None:
+            recorder.metadata({'room': room_id, 'map': self.world.map_name, 'tick_rate': tick_rate,
+                               'projectile_speed': projectile_speed}, clock())
+
+    def __len__(self) -> int:
+        """Human players in the room; bots do not keep a room open"""
+        return len(self.players) - (len(self.bots) if self.bots is not None else 0)
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.players
+
+    def is_bot(self, player_id: str) -> bool:
+        return self.bots is not None and player_id in self.bots
+
+    def emit(self, event: str, data: Any, to: Optional[str] = None, skip_sid: Optional[str] = None):
+        """Send an event to the whole room, or to one client or a list of clients with to="""
+        if isinstance(to, str) and self.is_bot(to):
+            return  # Bots have no connection; they read the room directly
+        self._emit(event, data, to=to or self.room_id, skip_sid=skip_sid)
+        if self.recorder is not None and event != 'world_snapshot':
+            # Snapshots are recorded once per tick rather than per client
+            self.recorder.event(self.tick_count, self.clock(), event, data, to)
+
+    def record_input(self, player_id: str, event: str, data: Any):
+        if self.recorder is not None:
+            self.recorder.input(self.tick_count, self.clock(), player_id, event, data)
+
+    # Membership
+
+    def add_player(self, player_id: str, hitbox: str = game_logic.DEFAULT_HITBOX) -> Dict[str, Any]:
+        """Add a player with a game_logic.HITBOXES set at the spawn point and return its public state"""
+        now = self.clock()
+        with self.lock:
+            self.players[player_id] = {
+                'x': 0.0,
+                'y': 1.0,  # Player height
+                'z': 0.0,
+                'rotation': 0.0,  # Player rotation
+                'health': 100,
+                'connected_at': now,
+                'last_update': now,
+                'hitbox': game_logic.HITBOX_TABLE.index(hitbox)
+            }
+            self.spatial_grid.insert(player_id, 0.0, 1.0, 0.0, HIT_RADIUS)
+            player_state = self.public_player_state(player_id)
+            # Replays map snapshot entity ids back to players through these
+            self.record_input(player_id, 'join', player_state)
+            return player_state
+
+    def remove_player(self, player_id: str) -> Optional[Dict[str, Any]]:
+        """Drop a player from the store and every structure indexed by it"""
+        with self.lock:
+            player_data = self.players.pop(player_id, None)
+            self.snapshot_encoder.remove_entity(player_id)
+            self.snapshot_encoder.remove_client(player_id)
+            self.spatial_grid.remove(player_id)
+            self.pending_shots = [shot for shot in self.pending_shots if shot[0] != player_id]
+            self.world.remove_owner(player_id)
+            self.deferred_moves.pop(player_id, None)
+            self.asteroid_hits.pop(player_id, None)
+            if player_data is not None:
+                self.record_input(player_id, 'leave', None)
+        return player_data
+
+    def public_player_state(self, player_id: str) -> Dict[str, Any]:
+        """Fields of a player that clients need, plus its snapshot entity id"""
+        player = self.players[player_id]
+        state = {
+            'id': player_id,
+            'entity_id': self.snapshot_encoder.entity_id(player_id),
+            'x': player['x'],
+            'y': player['y'],
+            'z': player['z'],
+            'rotation': player['rotation'],
+            'health': player['health']
+        }
+        if self.is_bot(player_id):
+            state['bot'] = True
+        return state
+
+    def game_state(self, player_id: str, **extra) -> Dict[str, Any]:
+        """Full state of the room as sent to a joining player"""
+        with self.lock:
+            state = {
+                'room': self.room_id,
+                'players': {pid: self.public_player_state(pid) for pid in self.players},
+                'player_id': player_id,
+                'world': self.world.describe()
+            }
+        state.update(extra)
+        return state
+
+    # Input
+
+    def apply_move(self, player_id: str, data: Dict[str, Any]):
+        """Record the latest position; it is sent out with the next tick
+
+        data is either one absolute position ({x, y, z, rotation}) or a batch
+        of client frames ({'inputs': [[seq, x, y, z, rotation], ...]}). Frames
+        are taken in sequence order and ones at or below the player's last
+        processed sequence (resent or reordered) are dropped. Positions are
+        absolute, so the newest fresh frame is what the player ends up with.
+        """
+        batch = data.get('inputs')
+        if batch is not None:
+            frames = parse_inputs(batch)
+        else:
+            frames = None
+            position = {key: finite(data[key]) for key in ('x', 'y', 'z', 'rotation') if key in data}
+        with self.lock:
+            # Supersedes any older move waiting for the tick
+            self.deferred_moves.pop(player_id, None)
+            player = self.players[player_id]
+            if frames is None:
+                player.update(position)
+                player['last_update'] = self.clock()
+            else:
+                last_seq = player['input_seq']
+                fresh = [frame for frame in frames if frame[0] > last_seq]
+                if len(fresh) < len(frames):
+                    metrics.STALE_INPUTS.inc(amount=len(frames) - len(fresh))
+                if not fresh:
+                    return
+                seq, x, y, z, rotation = fresh[-1]
+                player.update({'x': x, 'y': y, 'z': z, 'rotation': rotation,
+                               'input_seq': seq, 'last_update': self.clock()})
+            self.spatial_grid.update(player_id, player['x'], player['y'], player['z'], HIT_RADIUS)
+            if self.recorder is not None:
+                self.record_input(player_id, 'player_move', [player['x'], player['y'], player['z'],
+                                                             player['rotation'], player['input_seq']])
+
+    def defer_move(self, player_id: str, data: Dict[str, Any]):
+        """Keep a move that is over the rate limit; only the latest one is applied, at the next tick"""
+        self.deferred_moves[player_id] = data
+
+    def apply_deferred_moves(self):
+        with self.lock:
+            moves, self.deferred_moves = self.deferred_moves, {}
+        for player_id, data in moves.items():
+            try:
+                self.apply_move(player_id, data)
+            except (KeyError, ValueError, TypeError, AttributeError):
+                pass  # Player left, or the merged message was invalid
+
+    def queue_shot(self, player_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate a shot and queue it for the next tick"""
+        # Extract shooting data
+        ray_origin = data.get('origin', {})
+        ray_direction = data.get('direction', {})
+        player_position = data.get('player_position', {})
+
+        # Validate ray data
+        if not all(key in ray_origin for key in ['x', 'y', 'z']):
+            raise ValueError("Invalid ray origin")
+        if not all(key in ray_direction for key in ['x', 'y', 'z']):
+            raise ValueError("Invalid ray direction")
+
+        player = self.players[player_id]
+
+        # Create ray data for processing
+        ray_data = {
+            'origin': {
+                'x': finite(ray_origin['x']),
+                'y': finite(ray_origin['y']),
+                'z': finite(ray_origin['z'])
+            },
+            'direction': {
+                'x': finite(ray_direction['x']),
+                'y': finite(ray_direction['y']),
+                'z': finite(ray_direction['z'])
+            },
+            'player_position': {
+                'x': finite(player_position.get('x', player['x'])),
+                'y': finite(player_position.get('y', player['y'])),
+                'z': finite(player_position.get('z', player['z']))
+            }
+        }
+        offset = math.dist([ray_data['origin'][k] for k in 'xyz'], [player[k] for k in 'xyz'])
+        if offset > MAX_SHOT_ORIGIN_OFFSET:
+            raise ValueError(f"Ray origin is {offset:.1f} units from the shooter")
+
+        # Hits are resolved with all other shots of this tick
+        with self.lock:
+            self.pending_shots.append((player_id, ray_data, self.view_time(player_id)))
+            self.record_input(player_id, 'shoot', ray_data)
+        return ray_data
+
+    # Lag compensation
+
+    def update_latency(self, player_id: str, rtt: float):
+        """Fold a round trip time measured by the client into its average"""
+        rtt = min(max(float(rtt), 0.0), MAX_RTT)
+        with self.lock:
+            player = self.players[player_id]
+            previous = player['rtt']
+            player['rtt'] = rtt if previous == 0 else previous + (rtt - previous) * RTT_SMOOTHING
+
+    def view_time(self, player_id: str) -> Optional[float]:
+        """Time of the world state a player is currently looking at, None if current"""
+        rewind = min(self.players[player_id]['rtt'], self.max_rewind)
+        return self.clock() - rewind if rewind > 0 else None
+
+    # Hit detection
+
+    def resolve_pending_shots(self):
+        """Resolve every shot queued since the last tick in one batched hit test
+
+        With a projectile speed set, shots are launched as projectiles instead.
+        """
+        with self.lock:
+            shots, self.pending_shots = self.pending_shots, []
+            if not shots:
+                return
+
+            if self.projectile_speed > 0:
+                # Shots become projectiles; their hits are found as the world steps
+                projectiles = [{'id': self.world.spawn_projectile(shooter_id,
+                                                                  [ray['origin'][k] for k in 'xyz'],
+                                                                  [ray['direction'][k] for k in 'xyz'],
+                                                                  self.projectile_speed),
+                                'speed': self.projectile_speed}
+                               for shooter_id, ray, _ in shots]
+                results = [{'hit': False}] * len(shots)
+                metrics.SHOTS.inc('projectile', amount=len(shots))
+            else:
+                projectiles = [None] * len(shots)
+                results = self.resolve_hits(shots)
+
+        for (shooter_id, ray_data, _), hit_data, projectile in zip(shots, results, projectiles):
+            self.apply_shot(shooter_id, ray_data, hit_data, projectile)
+
+    def resolve_hits(self, shots) -> list:
+        """Hit test hitscan shots, falling back to the simple test on errors"""
+        try:
+            return self.ray_hits(shots)
+        except Exception as e:
+            if self.fallback_hit_test is None:
+                raise
+            # Fallback to simple distance-based hit detection
+            self.log(f'Error in batched hit detection: {e}')
+            metrics.SHOTS.inc('fallback', amount=len(shots))
+            return [self.fallback_hit_test(ray, self.players, shooter_id)
+                    for shooter_id, ray, _ in shots]
+
+    def ray_hits(self, shots) -> list:
+        """Hit test shots, rewinding targets for shots with a view time"""
+        results = [None] * len(shots)
+        current = []
+        rewound = {}  # view time -> indices of shots
+        for i, (_, _, when) in enumerate(shots):
+            if when is None:
+                current.append(i)
+            else:
+                rewound.setdefault(when, []).append(i)
+
+        if current:
+            if len(self.players) >= BROADPHASE_MIN_PLAYERS:
+                # The grid only knows current positions
+                hits = [self.grid_ray_hit(shots[i][1], shots[i][0]) for i in current]
+                metrics.SHOTS.inc('grid', amount=len(current))
+            else:
+                hits = self.batch_ray_hits([shots[i] for i in current])
+                metrics.SHOTS.inc('batch', amount=len(current))
+            for i, hit in zip(current, hits):
+                results[i] = hit
+        for when, indices in rewound.items():
+            for i, hit in zip(indices, self.batch_ray_hits([shots[i] for i in indices], when)):
+                results[i] = hit
+        if rewound:
+            metrics.SHOTS.inc('rewound', amount=len(shots) - len(current))
+        return self.block_by_obstacles(shots, results)
+
+    def block_by_obstacles(self, shots, results) -> list:
+        """Turn hits behind a static obstacle into misses that end at it"""
+        if len(self.world.obstacles) == 0:
+            return results
+        origins = np.array([[ray['origin'][k] for k in 'xyz'] for _, ray, _ in shots])
+        directions = np.array([[ray['direction'][k] for k in 'xyz'] for _, ray, _ in shots])
+        index, distance = self.world.obstacles.raycast(origins, directions)
+        for i in np.flatnonzero(index >= 0).tolist():
+            hit = results[i]
+            if not hit.get('hit') or distance[i] < hit['distance']:
+                results[i] = {'hit': False, 'obstacle': int(index[i]), 'distance': float(distance[i])}
+        return results
+
+    def batch_ray_hits(self, shots, when: Optional[float] = None) -> list:
+        """Brute-force hit test of all shots against all players in one call
+
+        With when, targets are tested at their interpolated positions at that
+        time, and players that joined later are ignored. Hitboxes keep their
+        current rotation either way.
+        """
+        players = self.players
+        origins = np.array([[ray['origin'][k] for k in 'xyz'] for _, ray, _ in shots])
+        directions = np.array([[ray['direction'][k] for k in 'xyz'] for _, ray, _ in shots])
+        exclude = np.array([players.slot_of.get(shooter_id, -1) for shooter_id, _, _ in shots])
+        position, _, _, active = players.arrays()
+        if when is not None:
+            position = players.positions_at(when)
+            active = active & (players.connected_at[:len(active)] <= when)
+        count = len(active)
+        index, distance, point, shape = game_logic.batch_ray_hit_hitboxes(
+            origins, directions, position, players.rotation[:count], players.hitbox[:count],
+            exclude=exclude, active=active)
+        return [game_logic.ray_hit_result(players.ids, int(index[i]), float(distance[i]), point[i],
+                                          shape=int(shape[i]))
+                for i in range(len(shots))]
+
+    def grid_ray_hit(self, ray_data: Dict[str, Any], shooter_id: str) -> Dict[str, Any]:
+        """Hit test of one shot that only visits grid cells along the ray"""
+        origin = ray_data['origin']
+        direction = ray_data['direction']
+        players = self.players
+
+        def narrowphase(player_id, ray_origin, unit):
+            slot = players.slot_of[player_id]
+            return game_logic.hitbox_ray_hit(ray_origin, unit, players.position[slot].tolist(),
+                                             float(players.rotation[slot]), int(players.hitbox[slot]))
+
+        hit = self.spatial_grid.raycast((origin['x'], origin['y'], origin['z']),
+                                        (direction['x'], direction['y'], direction['z']),
+                                        exclude=shooter_id, narrowphase=narrowphase)
+        if hit is None:
+            return {'hit': False}
+        target_id, distance, point, shape = hit
+        return game_logic.ray_hit_result([target_id], 0, distance, point, shape=shape)
+
+    def apply_shot(self, player_id: str, ray_data: Dict[str, Any], hit_data: Dict[str, Any],
+                   projectile: Optional[Dict[str, Any]] = None):
+        """Broadcast a resolved or launched shot and apply its damage"""
+        self.log(f'Player {player_id} shot from {ray_data["origin"]} in direction {ray_data["direction"]}')
+
+        # Broadcast shooting event to all players in the room
+        shot = {
+            'player_id': player_id,
+            'ray_data': ray_data,
+            'hit_data': hit_data,
+            'timestamp': self.clock()
+        }
+        if projectile is not None:
+            shot['projectile'] = projectile
+        self.emit('player_shot', shot)
+
+        if hit_data and hit_data.get('hit'):
+            self.apply_hit(player_id, hit_data)
+
+    def apply_hit(self, player_id: str, hit_data: Dict[str, Any]):
+        """Confirm a hit to the shooter and damage the target"""
+        # Send hit confirmation to shooter
+        confirmation = {
+            'target_id': hit_data['target_id'],
+            'hit_position': hit_data['hit_position'],
+            'damage': hit_data.get('damage', 25)
+        }
+        if 'region' in hit_data:
+            confirmation['region'] = hit_data['region']  # Hitbox region, e.g. 'head'
+        self.emit('shot_hit', confirmation, to=player_id)
+
+        self.damage_player(hit_data['target_id'], hit_data.get('damage', 25), player_id)
+
+    def damage_player(self, target_id: str, damage: int, source: Optional[str]):
+        """Lower a player's health and broadcast it; source is the attacker, if any"""
+        with self.lock:
+            if target_id not in self.players:
+                return
+            previous_health = self.players[target_id]['health']
+            health = max(0, previous_health - damage)
+            self.players[target_id]['health'] = health
+
+        # Broadcast health update
+        self.emit('player_health_update', {
+            'player_id': target_id,
+            'health': health
+        })
+
+        # Check if player was eliminated by this hit
+        if health <= 0 < previous_health:
+            self.emit('player_eliminated', {
+                'player_id': target_id,
+                'eliminated_by': source
+            })
+
+    def respawn_player(self, player_id: str):
+        """Restore an eliminated player's health and broadcast it"""
+        with self.lock:
+            if player_id not in self.players:
+                return
+            self.players[player_id]['health'] = 100
+            self.asteroid_hits.pop(player_id, None)
+        self.emit('player_health_update', {'player_id': player_id, 'health': 100})
+
+    # World simulation
+
+    def advance_world(self):
+        """Step asteroids and projectiles up to now and apply what happened"""
+        with self.lock:
+            now = self.clock()
+            elapsed = now - self.world_updated if self.world_updated is not None else 0.0
+            self.world_updated = now
+            impacts, collisions = self.world.advance(elapsed, self.players)
+
+            damaged = []
+            acked = {player_id: self.players[player_id]['input_seq'] for player_id, _, _, _ in collisions}
+            for player_id, _, _, (x, y, z) in collisions:
+                # The simulation already moved the player; keep the broadphase in step
+                self.spatial_grid.update(player_id, x, y, z, HIT_RADIUS)
+                if now - self.asteroid_hits.get(player_id, -ASTEROID_HIT_COOLDOWN) >= ASTEROID_HIT_COOLDOWN:
+                    self.asteroid_hits[player_id] = now
+                    damaged.append(player_id)
+
+        for player_id, kind, index, (x, y, z) in collisions:
+            # Clients own their movement, so tell them where they were pushed
+            self.emit('asteroid_collision', {
+                kind: index,  # 'asteroid' or 'obstacle'
+                'position': {'x': x, 'y': y, 'z': z},
+                # Last input the push applies to; the client replays later ones on top
+                'input_seq': acked[player_id],
+                'damage': game_logic.ASTEROID_DAMAGE if player_id in damaged else 0
+            }, to=player_id)
+        for player_id in damaged:
+            self.damage_player(player_id, game_logic.ASTEROID_DAMAGE, None)
+
+        for impact in impacts:
+            self.emit('projectile_impact', {
+                'projectile_id': impact['projectile_id'],
+                'player_id': impact['owner'],
+                'target_id': impact['hit_data'].get('target_id'),
+                'asteroid': impact['asteroid'],
+                'obstacle': impact['obstacle'],
+                'position': impact['position']
+            })
+            if impact['hit_data']['hit']:
+                self.apply_hit(impact['owner'], impact['hit_data'])
+
+    # Snapshots
+
+    def visible_entities(self, client_id: str) -> Optional[set]:
+        """Entity ids within the client's area of interest, None if unfiltered"""
+        if self.aoi_radius <= 0 or client_id not in self.players:
+            return None
+        player = self.players[client_id]
+        nearby = self.spatial_grid.query_sphere(player['x'], player['y'], player['z'], self.aoi_radius)
+        entity_ids = self.snapshot_encoder.entity_ids
+        visible = {entity_ids.get(pid) for pid in nearby}
+        visible.add(entity_ids.get(client_id))
+        visible.discard(None)
+        return visible
+
+    def tick(self):
+        """Advance the room by one tick: resolve shots, step the world, then send snapshots"""
+        started = time.perf_counter()
+        if self.bots is not None:
+            # Bots move and shoot first, so their inputs go out with this tick
+            self.bots.update()
+        self.apply_deferred_moves()
+        self.resolve_pending_shots()
+        self.advance_world()
+
+        with self.lock:
+            self.tick_count += 1
+            tick = self.tick_count
+            # Remember what this snapshot shows, for rewinding later shots
+            self.players.record_history(self.clock())
+            state = self.snapshot_encoder.capture(tick, self.players)
+            if self.recorder is not None:
+                self.recorder.snapshot(tick, self.clock(), state)
+            client_ids = [player_id for player_id in self.players if not self.is_bot(player_id)]
+            visible = {client_id: self.visible_entities(client_id) for client_id in client_ids}
+
+        # Send each client the delta from its last acknowledged snapshot.
+        # Clients that get the same bytes (usually everyone on the same
+        # baseline) share one emit, so each payload is framed only once.
+        recipients = {}  # snapshot bytes -> client ids
+        for client_id in client_ids:
+            data = self.snapshot_encoder.encode_for(client_id, tick, visible[client_id])
+            if data is not None:
+                recipients.setdefault(data, []).append(client_id)
+        for data, clients in recipients.items():
+            self.emit('world_snapshot', data, to=clients[0] if len(clients) == 1 else clients)
+        metrics.TICK_SECONDS.observe(time.perf_counter() - started)
+
+    def acknowledge_snapshot(self, client_id: str, tick: int):
+        self.snapshot_encoder.acknowledge(client_id, tick)
+
+    def run(self, sleep: Callable[[float], None]):
+        """Tick loop; runs until stop() is called"""
+        for delay in self.ticks():
+            sleep(delay)
+
+    def ticks(self):
+        """Tick the room and yield the delay until the next tick, until stopped
+
+        Lets blocking and asyncio servers share one scheduler: the caller
+        sleeps for each yielded delay in whatever way suits it.
+        """
+        interval = 1.0 / self.tick_rate
+        next_tick = time.monotonic()
+
+        try:
+            while self.running:
+                try:
+                    self.tick()
+                except Exception as e:
+                    # One bad tick must not end the loop while players are still in the room
+                    self.log(f'Error in tick {self.tick_count} of room {self.room_id}: {e!r}')
+                    metrics.TICK_ERRORS.inc()
+
+                # Schedule against the ideal timeline so the rate does not drift
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay < 0:
+                    # Running behind: skip missed ticks instead of bursting
+                    next_tick = time.monotonic()
+                    delay = 0
+                yield delay
+        finally:
+            if self.recorder is not None:
+                # The loop is done with the room, so the log can be finished
+                self.recorder.close()
+
+    def stop(self):
+        self.running = False
+
+
+class RoomManager:
+    """Creates rooms on demand and tracks which room each player is in
+
+    Also owns the idle expiry wheel: join() and touch() push a player's
+    deadline back, and expire_idle() returns the players whose deadline
+    passed, in O(expired players) rather than a scan of everyone.
+    """
+
+    def __init__(self, room_factory: Callable[[str], GameRoom], idle_timeout: float = IDLE_TIMEOUT,
+                 clock: Callable[[], float] = time.time):
+        self.room_factory = room_factory
+        self.rooms = {}         # room id -> GameRoom
+        self.player_rooms = {}  # player id -> room id
+        self.lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.idle_timers = TimerWheel(resolution=EXPIRY_RESOLUTION, start=clock())
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def room_of(self, player_id: str) -> Optional[GameRoom]:
+        room_id = self.player_rooms.get(player_id)
+        return self.rooms.get(room_id) if room_id is not None else None
+
+    def join(self, player_id: str, room_id: str):
+        """Put a player in a room, creating it if needed
+
+        Returns (room, public player state, created).
+        """
+        with self.lock:
+            room = self.rooms.get(room_id)
+            created = room is None
+            if created:
+                room = self.rooms[room_id] = self.room_factory(room_id)
+            self.player_rooms[player_id] = room_id
+            player_state = room.add_player(player_id)
+        self.touch(player_id)
+        return room, player_state, created
+
+    def touch(self, player_id: str):
+        """Record activity from a player, postponing its idle expiry"""
+        self.idle_timers.schedule(player_id, self.clock() + self.idle_timeout)
+
+    def expire_idle(self) -> list:
+        """Players idle for longer than idle_timeout; the caller removes them with leave()"""
+        return [player_id for player_id in self.idle_timers.advance(self.clock())
+                if player_id in self.player_rooms]
+
+    def leave(self, player_id: str):
+        """Take a player out of its room, closing the room once it is empty
+
+        Returns (room, removed player data, room closed), or (None, None, False).
+        """
+        self.idle_timers.cancel(player_id)
+        with self.lock:
+            room_id = self.player_rooms.pop(player_id, None)
+            room = self.rooms.get(room_id) if room_id is not None else None
+        if room is None:
+            return None, None, False
+
+        player_data = room.remove_player(player_id)
+        with self.lock:
+            closed = len(room) == 0 and self.rooms.get(room_id) is room
+            if closed:
+                del self.rooms[room_id]
+                room.stop()
+        return room, player_data, closed
+
+    def total_players(self) -> int:
+        return len(self.player_rooms)
+
+    def summary(self) -> Dict[str, int]:
+        """Player count per room"""
+        with self.lock:
+            return {room_id: len(room) for room_id, room in self.rooms.items()}
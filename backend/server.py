@@ -1,17 +1,161 @@
 from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit, join_room, leave_room
+import flask_socketio
+from flask_socketio import SocketIO, join_room, leave_room
+from socketio import packet as socketio_packet
 import json
+import os
+import threading
 import time
+import zlib
 from datetime import datetime
 import game_logic
+import message_bus
+import metrics
+import replay
+from rate_limit import RateLimiter
+from rooms import GameRoom, RoomManager, DEFAULT_ROOM, EXPIRY_RESOLUTION
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
 
-# Store player data with additional information
-players = {}
 player_count = 0
+background_tasks_started = False
+background_tasks_lock = threading.Lock()
+
+# python-socketio sends a binary event (world_snapshot) as several packets
+# without locking, so a reply emitted by a handler thread while a room's
+# tick thread sends one could land between them and corrupt both. Every
+# emit goes through this lock.
+emit_lock = threading.Lock()
+
+def emit(event, *args, **kwargs):
+    """flask_socketio.emit from a handler, serialized with all other emits"""
+    with emit_lock:
+        flask_socketio.emit(event, *args, **kwargs)
+
+# Cluster mode (see cluster.py): this process is worker WORKER_INDEX of
+# WORKER_COUNT and owns the rooms that hash to it. Worker i listens on
+# BASE_PORT + i. A single `python server.py` is worker 0 of 1.
+WORKER_INDEX = int(os.environ.get('WORKER_INDEX', 0))
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', 1))
+BASE_PORT = int(os.environ.get('BASE_PORT', 5000))
+PUBLIC_HOST = os.environ.get('PUBLIC_HOST', 'localhost')
+STATS_INTERVAL = float(os.environ.get('STATS_INTERVAL', 5))
+
+# Cross-worker events (lobby counts, health) go through the message bus
+bus = message_bus.create_bus(os.environ.get('MESSAGE_BUS', 'local'))
+cluster_stats = {}  # worker index -> latest stats published by that worker
+
+def configure_worker(index, count, worker_bus, base_port=None):
+    """Set this process up as one worker of a cluster (called by cluster.py)"""
+    global WORKER_INDEX, WORKER_COUNT, BASE_PORT, bus
+    WORKER_INDEX = index
+    WORKER_COUNT = count
+    if base_port is not None:
+        BASE_PORT = base_port
+    if worker_bus is not bus:
+        bus = worker_bus
+        bus.subscribe('worker_stats', handle_worker_stats)
+
+def worker_for_room(room_id):
+    """Index of the worker that owns a room; stable across processes"""
+    return zlib.crc32(room_id.encode('utf-8')) % WORKER_COUNT
+
+def worker_url(index):
+    return f'http://{PUBLIC_HOST}:{BASE_PORT + index}'
+
+def local_stats():
+    return {
+        'worker': WORKER_INDEX,
+        'pid': os.getpid(),
+        'players': rooms.total_players(),
+        'rooms': rooms.summary(),
+        'timestamp': time.time()
+    }
+
+def handle_worker_stats(channel, stats):
+    cluster_stats[stats['worker']] = stats
+
+def live_cluster_stats():
+    """Latest stats of every worker that reported recently, including this one"""
+    cutoff = time.time() - 3 * STATS_INTERVAL
+    stats = {index: s for index, s in list(cluster_stats.items()) if s['timestamp'] >= cutoff}
+    stats[WORKER_INDEX] = local_stats()
+    return stats
+
+def publish_stats():
+    """Background task announcing this worker's load to the cluster"""
+    while True:
+        bus.publish('worker_stats', local_stats())
+        socketio.sleep(STATS_INTERVAL)
+
+def room_emit(event, data, to=None, skip_sid=None):
+    """Emit scoped to a room or a single client, usable outside handlers"""
+    with emit_lock:
+        socketio.emit(event, data, to=to, skip_sid=skip_sid)
+    metrics.count_emit(event, recipient_count(to, skip_sid))
+
+def recipient_count(to, skip_sid=None):
+    """Clients an emit to a room id, a single sid or a list of sids reaches"""
+    if isinstance(to, list):
+        return len(to)
+    room = rooms.rooms.get(to)
+    if room is None:
+        return 1
+    return len(room) - (1 if skip_sid is not None and skip_sid in room else 0)
+
+def create_room(room_id):
+    return GameRoom(room_id, room_emit, fallback_hit_test=simple_ray_hit_detection,
+                    recorder=replay.recorder_for_room(room_id))
+
+# Every match runs in its own room with its own players and tick
+rooms = RoomManager(create_room)
+
+# Per-connection budgets for client events (see rate_limit.py)
+rate_limiter = RateLimiter()
+
+def start_room(room):
+    """Run a newly created room's tick loop in the background"""
+    socketio.start_background_task(room.run, socketio.sleep)
+    print(f'Room {room.room_id} started at {room.tick_rate} Hz')
+
+def join_game_room(player_id, room_id):
+    """Add a player to a room and tell the room about it"""
+    join_room(room_id)
+    room, player_state, created = rooms.join(player_id, room_id)
+    if created:
+        start_room(room)
+    
+    print(f'Player {player_id} joined room {room_id}. Players in room: {len(room)}')
+    
+    # Send current room state to the new player
+    emit('game_state', room.game_state(player_id, message='Welcome to the arena!'))
+    
+    # Notify other players in the room about the new player
+    emit('player_joined', {
+        'player': player_state,
+        'total_players': len(room)
+    }, to=room_id, include_self=False)
+    metrics.count_emit('player_joined', len(room) - 1)
+
+def leave_game_room(player_id):
+    """Remove a player from its room and tell the remaining players"""
+    room, player_data, closed = rooms.leave(player_id)
+    if room is None:
+        return None
+    leave_room(room.room_id)
+    
+    if closed:
+        print(f'Room {room.room_id} closed')
+    else:
+        # Notify remaining players about the player that left
+        emit('player_left', {
+            'player_id': player_id,
+            'total_players': len(room)
+        }, to=room.room_id)
+        metrics.count_emit('player_left', len(room))
+    return player_data
 
 @app.route('/')
 def index():
@@ -19,97 +163,144 @@ def index():
 
 @app.route('/health')
 def health_check():
-    return {"status": "healthy", "players_online": len(players), "timestamp": datetime.now().isoformat()}
+    workers = live_cluster_stats()
+    return {
+        "status": "healthy",
+        "players_online": rooms.total_players(),
+        "rooms": rooms.summary(),
+        "worker": WORKER_INDEX,
+        "collision": game_logic.BACKEND_REPORT,
+        "cluster": {
+            "workers": len(workers),
+            "players_online": sum(s['players'] for s in workers.values())
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.route('/lobby')
+def lobby():
+    """Player counts of every room in the cluster"""
+    rooms_online = {}
+    for index, stats in sorted(live_cluster_stats().items()):
+        for room_id, count in stats['rooms'].items():
+            rooms_online[room_id] = {'players': count, 'url': worker_url(index)}
+    return {"rooms": rooms_online, "timestamp": datetime.now().isoformat()}
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of counters, histograms and gauges"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/debug/profile')
+def profile_endpoint():
+    """Sample all threads for ?seconds=N and return collapsed stacks (opt-in)"""
+    if not metrics.PROFILER_ENABLED:
+        return {"error": "Profiler disabled; set PROFILER_ENABLED=1"}, 404
+    seconds = min(float(request.args.get('seconds', 5)), 60.0)
+    try:
+        stacks = metrics.profile(seconds)
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+    return stacks, 200, {'Content-Type': 'text/plain'}
+
+@app.route('/route')
+def route_room():
+    """Sticky routing: tell a client which worker serves a room"""
+    room_id = request.args.get('room') or DEFAULT_ROOM
+    index = worker_for_room(room_id)
+    return {"room": room_id, "worker": index, "url": worker_url(index)}
 
 @socketio.on('connect')
-def handle_connect():
+@metrics.instrument('connect')
+def handle_connect(auth=None):
     global player_count
-    player_count += 1
+    start_background_tasks()
     player_id = request.sid
     
-    # Initialize player data
-    players[player_id] = {
-        'id': player_id,
-        'x': 0.0,
-        'y': 1.0,  # Player height
-        'z': 0.0,
-        'rotation': 0.0,  # Player rotation
-        'health': 100,
-        'connected_at': time.time(),
-        'last_update': time.time()
-    }
-    
-    print(f'Player {player_id} connected. Total players: {len(players)}')
+    # Players pick a match with the room query parameter
+    room_id = request.args.get('room') or DEFAULT_ROOM
+    owner = worker_for_room(room_id)
+    if owner != WORKER_INDEX:
+        # Connections must stay on the worker that owns their room
+        # socket.io clients see the second argument as the error's data
+        raise flask_socketio.ConnectionRefusedError(
+            'room served by another worker',
+            {'redirect': worker_url(owner), 'room': room_id})
     
-    # Send current player data to the new player
-    emit('game_state', {
-        'players': players,
-        'player_id': player_id,
-        'message': 'Welcome to the arena!'
-    })
+    player_count += 1
+    join_game_room(player_id, room_id)
     
-    # Notify other players about the new player
-    emit('player_joined', {
-        'player': players[player_id],
-        'total_players': len(players)
-    }, broadcast=True, include_self=False)
+    print(f'Player {player_id} connected. Total players: {rooms.total_players()}')
 
 @socketio.on('disconnect')
-def handle_disconnect():
+@metrics.instrument('disconnect')
+def handle_disconnect(reason=None):
     global player_count
     player_id = request.sid
+    rate_limiter.forget(player_id)
     
-    if player_id in players:
-        player_data = players.pop(player_id)
+    if leave_game_room(player_id) is not None:
         player_count -= 1
-        
-        print(f'Player {player_id} disconnected. Total players: {len(players)}')
-        
-        # Notify remaining players about the disconnected player
-        emit('player_left', {
-            'player_id': player_id,
-            'total_players': len(players)
-        }, broadcast=True)
+        print(f'Player {player_id} disconnected. Total players: {rooms.total_players()}')
+
+@socketio.on('join_room')
+@metrics.instrument('join_room')
+def handle_join_room(data):
+    """Move a player to another room (match)"""
+    player_id = request.sid
+    if not rate_limiter.allow(player_id, 'join_room'):
+        metrics.THROTTLED.inc('join_room', 'dropped')
+        return
+    room_id = str(data.get('room') or DEFAULT_ROOM)
+    
+    current = rooms.room_of(player_id)
+    if current is not None and current.room_id == room_id:
+        return
+    
+    owner = worker_for_room(room_id)
+    if owner != WORKER_INDEX:
+        emit('redirect', {'room': room_id, 'url': worker_url(owner)})
+        return
+    
+    leave_game_room(player_id)
+    join_game_room(player_id, room_id)
 
 @socketio.on('player_move')
+@metrics.instrument('player_move')
 def handle_player_move(data):
     """Handle player movement updates"""
     player_id = request.sid
+    room = rooms.room_of(player_id)
     
-    if player_id not in players:
+    if room is None:
+        return
+    
+    if not rate_limiter.allow(player_id, 'player_move'):
+        # Over budget: keep only the latest position, applied with the next tick
+        room.defer_move(player_id, data)
+        rooms.touch(player_id)
+        metrics.THROTTLED.inc('player_move', 'merged')
         return
     
     try:
-        # Update player position
-        players[player_id].update({
-            'x': float(data.get('x', players[player_id]['x'])),
-            'y': float(data.get('y', players[player_id]['y'])),
-            'z': float(data.get('z', players[player_id]['z'])),
-            'rotation': float(data.get('rotation', players[player_id]['rotation'])),
-            'last_update': time.time()
-        })
-        
-        # Broadcast updated position to all other players
-        emit('player_moved', {
-            'player_id': player_id,
-            'position': {
-                'x': players[player_id]['x'],
-                'y': players[player_id]['y'],
-                'z': players[player_id]['z'],
-                'rotation': players[player_id]['rotation']
-            }
-        }, broadcast=True, include_self=False)
-        
+        room.apply_move(player_id, data)
+        rooms.touch(player_id)
     except (ValueError, TypeError) as e:
         print(f'Error processing movement data from {player_id}: {e}')
         emit('error', {'message': 'Invalid movement data'})
 
 @socketio.on('player_action')
+@metrics.instrument('player_action')
 def handle_player_action(data):
     """Handle player actions like shooting, jumping, etc."""
     player_id = request.sid
+    room = rooms.room_of(player_id)
+    
+    if room is None:
+        return
     
-    if player_id not in players:
+    if not rate_limiter.allow(player_id, 'player_action'):
+        metrics.THROTTLED.inc('player_action', 'dropped')
         return
     
     action_type = data.get('type')
@@ -117,105 +308,45 @@ def handle_player_action(data):
     
     print(f'Player {player_id} performed action: {action_type}')
     
-    # Broadcast action to all other players
+    # Broadcast action to all other players in the room
     emit('player_action', {
         'player_id': player_id,
         'action_type': action_type,
         'action_data': action_data,
         'timestamp': time.time()
-    }, broadcast=True, include_self=False)
+    }, to=room.room_id, include_self=False)
+    metrics.count_emit('player_action', len(room) - 1)
 
 @socketio.on('shoot')
+@metrics.instrument('shoot')
 def handle_shoot(data):
     """Handle player shooting with ray casting"""
     player_id = request.sid
+    room = rooms.room_of(player_id)
     
-    if player_id not in players:
+    if room is None:
+        return
+    
+    if not rate_limiter.allow(player_id, 'shoot'):
+        metrics.THROTTLED.inc('shoot', 'dropped')
         return
     
     try:
-        # Extract shooting data
-        ray_origin = data.get('origin', {})
-        ray_direction = data.get('direction', {})
-        player_position = data.get('player_position', {})
-        
-        # Validate ray data
-        if not all(key in ray_origin for key in ['x', 'y', 'z']):
-            raise ValueError("Invalid ray origin")
-        if not all(key in ray_direction for key in ['x', 'y', 'z']):
-            raise ValueError("Invalid ray direction")
-        
-        # Create ray data for processing
-        ray_data = {
-            'origin': {
-                'x': float(ray_origin['x']),
-                'y': float(ray_origin['y']),
-                'z': float(ray_origin['z'])
-            },
-            'direction': {
-                'x': float(ray_direction['x']),
-                'y': float(ray_direction['y']),
-                'z': float(ray_direction['z'])
-            },
-            'player_position': {
-                'x': float(player_position.get('x', players[player_id]['x'])),
-                'y': float(player_position.get('y', players[player_id]['y'])),
-                'z': float(player_position.get('z', players[player_id]['z']))
-            }
-        }
-        
-        # Check for hits using game logic (if available)
-        hit_data = None
-        try:
-            hit_data = game_logic.check_ray_hit(ray_data, players)
-        except:
-            # Fallback to simple distance-based hit detection
-            hit_data = simple_ray_hit_detection(ray_data, players, player_id)
-        
-        print(f'Player {player_id} shot from {ray_data["origin"]} in direction {ray_data["direction"]}')
-        
-        # Broadcast shooting event to all players
-        emit('player_shot', {
-            'player_id': player_id,
-            'ray_data': ray_data,
-            'hit_data': hit_data,
-            'timestamp': time.time()
-        }, broadcast=True)
-        
-        # Send hit confirmation to shooter if there was a hit
-        if hit_data and hit_data.get('hit'):
-            emit('shot_hit', {
-                'target_id': hit_data['target_id'],
-                'hit_position': hit_data['hit_position'],
-                'damage': hit_data.get('damage', 25)
-            })
-            
-            # Update target player health if hit
-            target_id = hit_data['target_id']
-            if target_id in players:
-                players[target_id]['health'] = max(0, players[target_id]['health'] - hit_data.get('damage', 25))
-                
-                # Broadcast health update
-                emit('player_health_update', {
-                    'player_id': target_id,
-                    'health': players[target_id]['health']
-                }, broadcast=True)
-                
-                # Check if player was eliminated
-                if players[target_id]['health'] <= 0:
-                    emit('player_eliminated', {
-                        'player_id': target_id,
-                        'eliminated_by': player_id
-                    }, broadcast=True)
-        
+        # Hits are resolved by the room with all other shots of this tick
+        room.queue_shot(player_id, data)
     except (ValueError, TypeError, KeyError) as e:
         print(f'Error processing shoot data from {player_id}: {e}')
         emit('error', {'message': 'Invalid shoot data'})
 
 def simple_ray_hit_detection(ray_data, players, shooter_id):
-    """Simple ray hit detection using distance calculations"""
+    """Simple ray hit detection, one player's hitboxes at a time"""
     ray_origin = ray_data['origin']
     ray_direction = ray_data['direction']
+    length = (ray_direction['x'] ** 2 + ray_direction['y'] ** 2 + ray_direction['z'] ** 2) ** 0.5
+    if length == 0:
+        return {'hit': False}
+    origin = (ray_origin['x'], ray_origin['y'], ray_origin['z'])
+    direction = (ray_direction['x'] / length, ray_direction['y'] / length, ray_direction['z'] / length)
     
     closest_hit = None
     min_distance = float('inf')
@@ -224,118 +355,132 @@ def simple_ray_hit_detection(ray_data, players, shooter_id):
         if player_id == shooter_id:
             continue  # Skip shooter
         
-        # Calculate distance from ray to player
-        player_pos = {
-            'x': player_data['x'],
-            'y': player_data['y'],
-            'z': player_data['z']
-        }
-        
-        # Simple sphere intersection test (player as sphere with radius 0.5)
-        distance = calculate_ray_sphere_intersection(
-            ray_origin, ray_direction, player_pos, 0.5
-        )
+        hit = game_logic.hitbox_ray_hit(origin, direction,
+                                        (player_data['x'], player_data['y'], player_data['z']),
+                                        player_data.get('rotation', 0.0), player_data.get('hitbox', 0))
         
-        if distance is not None and distance < min_distance and distance > 0:
-            min_distance = distance
-            closest_hit = {
-                'hit': True,
-                'target_id': player_id,
-                'hit_position': {
-                    'x': ray_origin['x'] + ray_direction['x'] * distance,
-                    'y': ray_origin['y'] + ray_direction['y'] * distance,
-                    'z': ray_origin['z'] + ray_direction['z'] * distance
-                },
-                'distance': distance,
-                'damage': 25
-            }
+        if hit is not None and hit[0] < min_distance:
+            min_distance = hit[0]
+            closest_hit = game_logic.ray_hit_result(
+                [player_id], 0, min_distance,
+                [origin[k] + direction[k] * min_distance for k in range(3)], shape=hit[1])
     
     return closest_hit or {'hit': False}
 
-def calculate_ray_sphere_intersection(ray_origin, ray_direction, sphere_center, sphere_radius):
-    """Calculate intersection between ray and sphere"""
-    # Vector from ray origin to sphere center
-    oc = {
-        'x': sphere_center['x'] - ray_origin['x'],
-        'y': sphere_center['y'] - ray_origin['y'],
-        'z': sphere_center['z'] - ray_origin['z']
-    }
-    
-    # Project oc onto ray direction
-    tca = oc['x'] * ray_direction['x'] + oc['y'] * ray_direction['y'] + oc['z'] * ray_direction['z']
-    
-    if tca < 0:
-        return None  # Sphere is behind ray origin
-    
-    # Distance from sphere center to ray
-    d2 = (oc['x'] * oc['x'] + oc['y'] * oc['y'] + oc['z'] * oc['z']) - (tca * tca)
-    
-    if d2 > sphere_radius * sphere_radius:
-        return None  # Ray misses sphere
-    
-    # Distance from intersection to projection point
-    thc = (sphere_radius * sphere_radius - d2) ** 0.5
-    
-    # Two intersection points
-    t0 = tca - thc
-    t1 = tca + thc
-    
-    # Return closest positive intersection
-    if t0 > 0:
-        return t0
-    elif t1 > 0:
-        return t1
-    
-    return None
+@socketio.on('snapshot_ack')
+@metrics.instrument('snapshot_ack')
+def handle_snapshot_ack(data):
+    """Record the latest snapshot a client applied, used as its delta baseline"""
+    room = rooms.room_of(request.sid)
+    if room is None:
+        return
+    # Clients ack every snapshot, so this keeps players who stand still from expiring
+    rooms.touch(request.sid)
+    try:
+        room.acknowledge_snapshot(request.sid, int(data.get('tick', 0)))
+    except (ValueError, TypeError, AttributeError):
+        pass
 
 @socketio.on('request_game_state')
+@metrics.instrument('request_game_state')
 def handle_game_state_request():
     """Send current game state to requesting player"""
     player_id = request.sid
+    room = rooms.room_of(player_id)
     
-    emit('game_state', {
-        'players': players,
-        'player_id': player_id,
-        'timestamp': time.time()
-    })
+    if room is None:
+        return
+    
+    emit('game_state', room.game_state(player_id, timestamp=time.time()))
 
 @socketio.on('ping')
-def handle_ping():
-    """Handle ping for latency testing"""
-    emit('pong', {'timestamp': time.time()})
+@metrics.instrument('ping')
+def handle_ping(data=None):
+    """Handle ping for latency testing
 
-# Periodic cleanup of disconnected players
+    Clients echo client_time back from pong to measure their round trip
+    time, and report the last measurement as rtt for lag compensation.
+    """
+    data = data if isinstance(data, dict) else {}
+    room = rooms.room_of(request.sid)
+    if room is not None:
+        rooms.touch(request.sid)
+    if room is not None and 'rtt' in data:
+        try:
+            room.update_latency(request.sid, data['rtt'])
+        except (ValueError, TypeError, KeyError):
+            pass
+    emit('pong', {'timestamp': time.time(), 'client_time': data.get('client_time')})
+
+# Idle player expiry
 def cleanup_disconnected_players():
-    """Remove players who haven't updated in the last 10 seconds"""
-    current_time = time.time()
-    disconnected_players = []
-    
-    for player_id, player_data in players.items():
-        if current_time - player_data['last_update'] > 10:
-            disconnected_players.append(player_id)
-    
-    for player_id in disconnected_players:
-        players.pop(player_id, None)
-        print(f'Cleaned up disconnected player: {player_id}')
+    """Remove players whose idle deadline has passed"""
+    cleaned = {}  # room -> removed player ids
+    for player_id in rooms.expire_idle():
+        room, _, _ = rooms.leave(player_id)
+        if room is not None:
+            # No request context here, so leave the Socket.IO room on the server
+            socketio.server.leave_room(player_id, room.room_id)
+            cleaned.setdefault(room, []).append(player_id)
+            print(f'Cleaned up disconnected player: {player_id}')
     
-    if disconnected_players:
-        emit('players_cleaned', {
+    for room, disconnected_players in cleaned.items():
+        room_emit('players_cleaned', {
             'disconnected_players': disconnected_players,
-            'total_players': len(players)
-        }, broadcast=True)
+            'total_players': len(room)
+        }, to=room.room_id)
 
-# Schedule periodic cleanup
-@socketio.on('connect')
-def schedule_cleanup():
+# Schedule idle expiry and stats publishing (started once, on the first connection)
+def start_background_tasks():
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
     socketio.start_background_task(periodic_cleanup)
+    socketio.start_background_task(publish_stats)
 
 def periodic_cleanup():
-    """Background task for periodic cleanup"""
-    import time
+    """Background task advancing the idle expiry wheel"""
     while True:
-        time.sleep(30)  # Run every 30 seconds
+        socketio.sleep(EXPIRY_RESOLUTION)
         cleanup_disconnected_players()
 
+bus.subscribe('worker_stats', handle_worker_stats)
+
+metrics.register_collision_calls(game_logic.CALL_COUNTS)
+metrics.Gauge('arena_players_online', 'Players connected to this worker', rooms.total_players)
+metrics.Gauge('arena_rooms', 'Rooms running on this worker', lambda: len(rooms))
+
+def test_sticky_redirect():
+    """Test that a connection to another worker's room is refused with its URL"""
+    print("Testing sticky room redirect...")
+    index, count = WORKER_INDEX, WORKER_COUNT
+    configure_worker(0, 2, bus)
+    try:
+        local_room = next(f'room-{i}' for i in range(100) if worker_for_room(f'room-{i}') == 0)
+        remote_room = next(f'room-{i}' for i in range(100) if worker_for_room(f'room-{i}') == 1)
+        client = socketio.test_client(app, query_string=f'room={local_room}')
+        accepted = client.is_connected()
+        client.disconnect()
+
+        # The test client drops CONNECT_ERROR payloads, so record them on the way out
+        refusals = []
+        send_packet = socketio.server._send_packet
+        def record_packet(eio_sid, pkt):
+            if pkt.packet_type == socketio_packet.CONNECT_ERROR:
+                refusals.append(pkt.data)
+            send_packet(eio_sid, pkt)
+        socketio.server._send_packet = record_packet
+        client.connect(query_string=f'room={remote_room}')
+    finally:
+        configure_worker(index, count, bus)
+    print(f"Refusals: {refusals}")
+
+    return (accepted and not client.is_connected() and
+            refusals == [{'message': 'room served by another worker',
+                          'data': {'redirect': worker_url(1), 'room': remote_room}}])
+
 if __name__ == '__main__':
     print("Starting 3D Arena Shooter Server...")
     print("Server will be available at http://localhost:5000")
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Headless, deterministic simulation of one game room
+
+Drives a rooms.GameRoom the way the Socket.IO handlers do (join, player_move,
+shoot, snapshot acks) without sockets or a server, on a virtual clock that
+moves one tick interval per tick, so it runs as fast as the CPU allows.
+Inputs come from scripted bots or from a replay log recorded with REPLAY_DIR;
+with --room-bots, the room also hosts its own server bots, planned on the
+tick so runs stay deterministic.
+Reported at the end:
+
+  - simulated ticks per second and the speed-up over real time
+  - per-tick cost, split into inputs (moves and shots handled), server bots,
+    deferred moves, shot resolution, world simulation and snapshots
+  - events emitted, and a digest of them that is identical across runs
+    with the same arguments, whichever collision backend serves them
+
+Examples:
+    python simulate.py --players 200 --ticks 900
+    python simulate.py --players 500 --backend python --tick-rate 60
+    python simulate.py --replay replays/default-20250101-120000-1234.replay
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+import game_logic
+import rooms
+import snapshot
+from benchmark import available_backends, use_backend
+from loadtest import percentiles
+from replay import RECORD_INPUT, ReplayReader, compact_json
+
+PHASES = ('inputs', 'bots', 'deferred_moves', 'shots', 'world', 'snapshots')
+
+# The C++ and Python collision paths differ in the last bits of hit
+# distances and positions; the digest only looks at this many decimals
+DIGEST_DECIMALS = 6
+
+
+def rounded(value):
+    """Event data with floats rounded to DIGEST_DECIMALS, for digesting"""
+    if isinstance(value, float):
+        return round(value, DIGEST_DECIMALS)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [rounded(item) for item in value]
+    return value
+
+
+class VirtualClock:
+    """Clock the runner advances by hand; stands in for time.time"""
+
+    def __init__(self, start: float = 1_000_000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class EmittedEvents:
+    """Collects what the room emits: event counts and a running digest"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.digest = hashlib.sha256()
+        self.snapshot_bytes = 0
+        self.acks = []  # (client id, tick) to acknowledge before the next tick
+
+    def emit(self, event, data, to=None, skip_sid=None):
+        self.counts[event] += 1  # Emits, not recipients
+        if event == 'world_snapshot':
+            clients = to if isinstance(to, list) else [to]
+            tick = snapshot.HEADER.unpack_from(data)[0]
+            for client_id in clients:
+                self.snapshot_bytes += len(data)
+                self.acks.append((client_id, tick))
+                self.digest.update(data)
+        else:
+            self.digest.update(compact_json([event, to, rounded(data)]))
+
+
+class Timed:
+    """Wraps a room method, adding its run time to one phase"""
+
+    def __init__(self, function, totals, phase):
+        self.function = function
+        self.totals = totals
+        self.phase = phase
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.totals[self.phase] += time.perf_counter() - start
+
+
+class ScriptedPlayers:
+    """Seeded bots that wander the arena and shoot at each other
+
+    Like the browser client, bots send their movement as sequenced input
+    frames, batched input_batch ticks to a message.
+    """
+
+    def __init__(self, count, tick_rate, shoot_rate, seed, input_batch=1, extent=40.0, speed=6.0):
+        self.rng = random.Random(seed)
+        self.input_batch = input_batch  # ticks of input frames per player_move message
+        self.seq = 0
+        self.unsent = {}  # player id -> [seq, x, y, z, rotation] frames not sent yet
+        self.ids = [f'bot{i:05d}' for i in range(count)]
+        self.tick_rate = tick_rate
+        self.shoot_chance = shoot_rate / tick_rate
+        self.extent = extent
+        self.step = speed / tick_rate
+        self.position = {pid: [self.rng.uniform(-extent, extent), 1.0, self.rng.uniform(-extent, extent)]
+                         for pid in self.ids}
+        self.heading = {pid: self.rng.uniform(0, 2 * math.pi) for pid in self.ids}
+
+    def inputs(self, tick):
+        """(player id, event, data) sent during one tick"""
+        rng = self.rng
+        events = [(pid, 'join', None) for pid in self.ids] if tick == 1 else []
+        for pid in self.ids:
+            heading = self.heading[pid] = self.heading[pid] + rng.uniform(-0.2, 0.2)
+            position = self.position[pid]
+            position[0] += math.cos(heading) * self.step
+            position[2] += math.sin(heading) * self.step
+            if abs(position[0]) > self.extent or abs(position[2]) > self.extent:
+                # Turn back towards the middle
+                self.heading[pid] = math.atan2(-position[2], -position[0])
+            self.seq += 1
+            frames = self.unsent.setdefault(pid, [])
+            frames.append([self.seq, position[0], position[1], position[2], heading])
+            if tick % self.input_batch == 0:
+                events.append((pid, 'player_move', {'inputs': frames}))
+                self.unsent[pid] = []
+
+            if len(self.ids) > 1 and rng.random() < self.shoot_chance:
+                target = self.position[rng.choice(self.ids)]
+                direction = [target[i] - position[i] + rng.gauss(0, 0.3) for i in range(3)]
+                length = math.sqrt(sum(d * d for d in direction)) or 1.0
+                events.append((pid, 'shoot', {
+                    'origin': dict(zip('xyz', position)),
+                    'direction': dict(zip('xyz', (d / length for d in direction)))}))
+        return events
+
+
+class ReplayedPlayers:
+    """Inputs of a recorded match, tick by tick"""
+
+    def __init__(self, path):
+        with ReplayReader(path) as reader:
+            self.metadata = reader.metadata
+            self.by_tick = defaultdict(list)
+            for tick, _, _, (player_id, event, data) in reader.events(kinds=(RECORD_INPUT,)):
+                if event == 'player_move':
+                    # [x, y, z, rotation, last input sequence]; older logs lack the sequence
+                    if len(data) > 4 and data[4]:
+                        data = {'inputs': [[data[4]] + data[:4]]}
+                    else:
+                        data = dict(zip(('x', 'y', 'z', 'rotation'), data))
+                # Inputs recorded after snapshot N are replayed before tick N + 1
+                self.by_tick[tick + 1].append((player_id, event, data))
+        self.last_tick = max(self.by_tick, default=0)
+
+    def inputs(self, tick):
+        return self.by_tick.get(tick, ())
+
+
+def apply_input(room, player_id, event, data):
+    """What the server's handlers do with one client message"""
+    if event == 'join':
+        room.add_player(player_id)
+    elif event == 'leave':
+        room.remove_player(player_id)
+    elif player_id not in room:
+        return
+    elif event == 'player_move':
+        room.apply_move(player_id, data)
+    elif event == 'shoot':
+        room.queue_shot(player_id, data)
+
+
+def run_simulation(source, ticks, tick_rate, map_name=None, projectile_speed=game_logic.PROJECTILE_SPEED,
+                   room_bots=0):
+    """Run ticks room ticks fed by source; returns the report dict"""
+    clock = VirtualClock()
+    events = EmittedEvents()
+    room = rooms.GameRoom('simulation', events.emit, tick_rate=tick_rate, clock=clock,
+                          fallback_hit_test=game_logic.check_ray_hit, log=lambda message: None,
+                          map_name=map_name, projectile_speed=projectile_speed,
+                          bot_fill=room_bots, bot_pool='inline')
+
+    totals = Counter()
+    room.apply_deferred_moves = Timed(room.apply_deferred_moves, totals, 'deferred_moves')
+    room.resolve_pending_shots = Timed(room.resolve_pending_shots, totals, 'shots')
+    room.advance_world = Timed(room.advance_world, totals, 'world')
+    if room.bots is not None:
+        room.bots.update = Timed(room.bots.update, totals, 'bots')
+    interval = 1.0 / tick_rate
+    samples = {phase: [] for phase in PHASES + ('tick',)}
+    perf_counter = time.perf_counter
+
+    started = perf_counter()
+    for tick in range(1, ticks + 1):
+        clock.now += interval
+        totals.clear()
+
+        start = perf_counter()
+        for client_id, acked in events.acks:
+            room.acknowledge_snapshot(client_id, acked)
+        events.acks.clear()
+        for player_id, event, data in source.inputs(tick):
+            apply_input(room, player_id, event, data)
+        inputs_done = perf_counter()
+        room.tick()
+        end = perf_counter()
+
+        samples['inputs'].append(inputs_done - start)
+        for phase in ('bots', 'deferred_moves', 'shots', 'world'):
+            samples[phase].append(totals[phase])
+        # Whatever the tick spent outside the timed phases: snapshot capture and encoding
+        samples['snapshots'].append(end - inputs_done - sum(totals.values()))
+        samples['tick'].append(end - start)
+    elapsed = perf_counter() - started
+
+    return {
+        'ticks': ticks,
+        'tick_rate': tick_rate,
+        'players': len(room),
+        'room_bots': len(room.bots) if room.bots is not None else 0,
+        'elapsed_s': round(elapsed, 3),
+        'ticks_per_s': round(ticks / elapsed, 1),
+        'speedup': round(ticks / tick_rate / elapsed, 2),
+        'cost': {phase: percentiles(values) for phase, values in samples.items()},
+        'mean_ms': {phase: round(float(np.mean(values)) * 1000.0, 4) for phase, values in samples.items()},
+        'events': dict(sorted(events.counts.items())),
+        'snapshot_bytes': events.snapshot_bytes,
+        'digest': events.digest.hexdigest()[:16],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a game room offline, faster than real time")
+    parser.add_argument('--players', type=int, default=100, help="scripted bots (ignored with --replay)")
+    parser.add_argument('--ticks', type=int, help="ticks to run (default: 30 s of play, or the whole replay)")
+    parser.add_argument('--tick-rate', type=int, help=f"ticks per second (default: {rooms.TICK_RATE}, "
+                                                      "or the replay's)")
+    parser.add_argument('--shoot-rate', type=float, default=1.0, help="shots per second per bot")
+    parser.add_argument('--room-bots', type=int, default=0,
+                        help="fill the room up to this many players with server bots")
+    parser.add_argument('--input-batch', type=int, default=1, help="ticks of movement per player_move message")
+    parser.add_argument('--map', choices=sorted(game_logic.MAPS), help="map (default: the replay's or DEFAULT_MAP)")
+    parser.add_argument('--projectile-speed', type=float, help="0 for hitscan shots")
+    parser.add_argument('--replay', help="replay log whose inputs to play back instead of bots")
+    parser.add_argument('--backend', choices=['auto', 'python', 'cpp'], default='auto',
+                        help="collision backend; auto keeps game_logic's dispatch")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON only")
+    args = parser.parse_args()
+
+    if args.replay:
+        source = ReplayedPlayers(args.replay)
+        metadata = source.metadata
+        tick_rate = args.tick_rate or metadata.get('tick_rate', rooms.TICK_RATE)
+        ticks = args.ticks or source.last_tick
+        map_name = args.map or metadata.get('map')
+        projectile_speed = metadata.get('projectile_speed', game_logic.PROJECTILE_SPEED)
+    else:
+        tick_rate = args.tick_rate or rooms.TICK_RATE
+        source = ScriptedPlayers(args.players, tick_rate, args.shoot_rate, args.seed, max(1, args.input_batch))
+        ticks = args.ticks or 30 * tick_rate
+        map_name = args.map
+        projectile_speed = game_logic.PROJECTILE_SPEED
+    if args.projectile_speed is not None:
+        projectile_speed = args.projectile_speed
+
+    if args.backend != 'auto' and args.backend not in available_backends():
+        print(f"Backend {args.backend} is not available (is cpp_logic built?)")
+        return False
+
+    if args.backend == 'auto':
+        report = run_simulation(source, ticks, tick_rate, map_name, projectile_speed, args.room_bots)
+    else:
+        with use_backend(args.backend):
+            report = run_simulation(source, ticks, tick_rate, map_name, projectile_speed, args.room_bots)
+    report['backend'] = args.backend
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print('\nSimulation results')
+        for key, value in report.items():
+            if key == 'cost':
+                for phase, stats in value.items():
+                    print(f'  cost {phase}: {stats}')
+            else:
+                print(f'  {key}: {value}')
+    return True
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,333 @@
+# snapshot.py
+# Compact binary world snapshots for 3D Arena Shooter
+#
+# Socket ids are mapped to small integer entity ids, positions and rotation
+# are quantized to 16 bits, and each client only receives the fields that
+# changed since the last snapshot it acknowledged.
+#
+# Wire format (little-endian):
+#   header:  u32 tick, u32 baseline tick (0 = full snapshot),
+#            u16 update count, u16 removed count
+#   update:  u16 entity id, u8 field mask, then the fields present in mask:
+#            x/y/z as i16, rotation as u16, health as u8, input sequence as u16
+#
+# The input sequence is the last client input the server processed for that
+# player, truncated to 16 bits; each client reads its own entity's value as
+# the acknowledgement of its inputs, so snapshots stay shareable.
+#   removed: u16 entity id per removed entity
+
+import math
+import struct
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Positions are stored in 1/32 unit steps, giving a +-1024 unit range
+POSITION_SCALE = 32.0
+POSITION_LIMIT = 32767
+# Rotation is wrapped to [0, 2*pi) and spread over the full u16 range
+ROTATION_SCALE = 65536.0 / (2.0 * math.pi)
+
+# Field mask bits, in wire order
+FIELD_X = 0x01
+FIELD_Y = 0x02
+FIELD_Z = 0x04
+FIELD_ROTATION = 0x08
+FIELD_HEALTH = 0x10
+FIELD_INPUT_SEQ = 0x20
+ALL_FIELDS = FIELD_X | FIELD_Y | FIELD_Z | FIELD_ROTATION | FIELD_HEALTH | FIELD_INPUT_SEQ
+
+FIELD_FORMATS = (
+    (FIELD_X, 'h'),
+    (FIELD_Y, 'h'),
+    (FIELD_Z, 'h'),
+    (FIELD_ROTATION, 'H'),
+    (FIELD_HEALTH, 'B'),
+    (FIELD_INPUT_SEQ, 'H'),
+)
+
+HEADER = struct.Struct('<IIHH')
+ENTITY_HEADER = struct.Struct('<HB')
+ENTITY_ID = struct.Struct('<H')
+
+# Number of past ticks kept as possible delta baselines
+HISTORY_SIZE = 64
+MAX_ENTITIES = 65535
+
+
+def quantize_position(value: float) -> int:
+    """Quantize a world coordinate to a signed 16-bit integer"""
+    q = int(round(value * POSITION_SCALE))
+    return max(-POSITION_LIMIT, min(POSITION_LIMIT, q))
+
+
+def dequantize_position(value: int) -> float:
+    """Convert a quantized coordinate back to world units"""
+    return value / POSITION_SCALE
+
+
+def quantize_rotation(value: float) -> int:
+    """Quantize a rotation in radians to an unsigned 16-bit integer"""
+    return int(round((value % (2.0 * math.pi)) * ROTATION_SCALE)) & 0xFFFF
+
+
+def dequantize_rotation(value: int) -> float:
+    """Convert a quantized rotation back to radians"""
+    return value / ROTATION_SCALE
+
+
+def quantize_player(player: Dict[str, Any]) -> Tuple[int, int, int, int, int, int]:
+    """Quantize the networked fields of a player record"""
+    return (
+        quantize_position(player['x']),
+        quantize_position(player['y']),
+        quantize_position(player['z']),
+        quantize_rotation(player['rotation']),
+        max(0, min(255, int(player['health']))),
+        int(player.get('input_seq', 0)) & 0xFFFF
+    )
+
+
+def quantize_store(store) -> Tuple[list, list]:
+    """Quantize every active player of a PlayerStore in one vectorized pass
+
+    Returns (player ids, rows of quantized fields) in slot order.
+    """
+    slots = store.active_slots()
+    position, rotation, health, _ = store.arrays()
+    qpos = np.clip(np.rint(position[slots] * POSITION_SCALE), -POSITION_LIMIT, POSITION_LIMIT)
+    qrot = np.rint(np.mod(rotation[slots], 2.0 * math.pi) * ROTATION_SCALE).astype(np.int64) & 0xFFFF
+    qhealth = np.clip(health[slots], 0, 255)
+    qseq = store.input_seq[slots] & 0xFFFF
+    rows = np.column_stack((qpos.astype(np.int64), qrot, qhealth, qseq)).tolist()
+    ids = store.ids
+    return [ids[slot] for slot in slots.tolist()], rows
+
+
+class EntityIdMap:
+    """Maps socket ids to small integer entity ids
+
+    A freed id is only reused once every baseline that could still refer to
+    its previous owner has aged out of the snapshot history.
+    """
+
+    def __init__(self, quarantine_ticks: int = HISTORY_SIZE):
+        self.ids = {}
+        self.free_ids = deque()  # (entity_id, tick it was freed)
+        self.next_id = 1
+        self.quarantine_ticks = quarantine_ticks
+
+    def assign(self, player_id: str, tick: int) -> int:
+        """Return the entity id for a player, allocating one if needed"""
+        entity_id = self.ids.get(player_id)
+        if entity_id is not None:
+            return entity_id
+
+        if self.free_ids and self.free_ids[0][1] + self.quarantine_ticks < tick:
+            entity_id = self.free_ids.popleft()[0]
+        elif self.next_id <= MAX_ENTITIES:
+            entity_id = self.next_id
+            self.next_id += 1
+        else:
+            raise RuntimeError("Out of snapshot entity ids")
+
+        self.ids[player_id] = entity_id
+        return entity_id
+
+    def release(self, player_id: str, tick: int) -> Optional[int]:
+        """Free the entity id of a player that left"""
+        entity_id = self.ids.pop(player_id, None)
+        if entity_id is not None:
+            self.free_ids.append((entity_id, tick))
+        return entity_id
+
+    def get(self, player_id: str) -> Optional[int]:
+        return self.ids.get(player_id)
+
+
+class SnapshotEncoder:
+    """Builds per-client delta snapshots against acknowledged baselines"""
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.entity_ids = EntityIdMap()
+        self.history = OrderedDict()  # tick -> {entity_id: quantized fields}
+        self.history_size = history_size
+        self.acked = {}  # client id -> last acknowledged tick
+        self.visible = {}  # client id -> {tick: entity ids sent, for filtered clients}
+        self.last_tick = 0
+        # Unfiltered clients with the same baseline get the same bytes, so
+        # each is encoded once per tick: baseline tick -> encoded snapshot
+        self.encoded = {}
+        self.encoded_tick = 0
+
+    def entity_id(self, player_id: str) -> int:
+        """Entity id clients use to refer to a player in snapshots"""
+        return self.entity_ids.assign(player_id, self.last_tick)
+
+    def remove_entity(self, player_id: str):
+        self.entity_ids.release(player_id, self.last_tick)
+
+    def capture(self, tick: int, players: Dict[str, Dict[str, Any]]) -> Dict[int, tuple]:
+        """Quantize the current world state and store it as a possible baseline"""
+        self.last_tick = tick
+        state = {}
+        if hasattr(players, 'arrays'):
+            # PlayerStore: quantize straight from its arrays
+            player_ids, rows = quantize_store(players)
+            for player_id, row in zip(player_ids, rows):
+                state[self.entity_ids.assign(player_id, tick)] = tuple(row)
+        else:
+            for player_id, player in players.items():
+                state[self.entity_ids.assign(player_id, tick)] = quantize_player(player)
+
+        self.history[tick] = state
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        return state
+
+    def acknowledge(self, client_id: str, tick: int):
+        """Record that a client has received and applied the snapshot for tick"""
+        if tick in self.history and tick > self.acked.get(client_id, 0):
+            self.acked[client_id] = tick
+
+    def remove_client(self, client_id: str):
+        self.acked.pop(client_id, None)
+        self.visible.pop(client_id, None)
+
+    def baseline_for(self, client_id: str) -> int:
+        """Tick of the baseline a client can decode against, 0 if none"""
+        tick = self.acked.get(client_id, 0)
+        return tick if tick in self.history else 0
+
+    def encode_for(self, client_id: str, tick: int, visible: Optional[set] = None) -> Optional[bytes]:
+        """Encode the snapshot for tick as a delta against the client's baseline
+
+        visible restricts the snapshot to a set of entity ids (area of
+        interest); entities leaving it are sent as removed. Returns None when
+        nothing changed since the baseline. Unfiltered clients that share a
+        baseline get the same bytes object.
+        """
+        state = self.history[tick]
+        baseline_tick = self.baseline_for(client_id)
+        baseline = self.history[baseline_tick] if baseline_tick else None
+
+        sent = self.visible.get(client_id)
+        if visible is None and sent is None:
+            if self.encoded_tick != tick:
+                self.encoded = {}
+                self.encoded_tick = tick
+            if baseline_tick not in self.encoded:
+                self.encoded[baseline_tick] = encode_delta(tick, state, baseline_tick, baseline)
+            return self.encoded[baseline_tick]
+
+        if visible is not None:
+            state = {entity_id: state[entity_id] for entity_id in visible if entity_id in state}
+            if sent is None:
+                sent = self.visible[client_id] = {}
+            sent[tick] = visible
+            # Forget filters of ticks that can no longer be baselines
+            for old_tick in [t for t in sent if t not in self.history]:
+                del sent[old_tick]
+        if baseline is not None and sent is not None and baseline_tick in sent:
+            # Delta against what this client actually received at baseline_tick
+            baseline = {entity_id: baseline[entity_id] for entity_id in sent[baseline_tick]
+                        if entity_id in baseline}
+
+        return encode_delta(tick, state, baseline_tick, baseline)
+
+
+def encode_delta(tick: int, state: Dict[int, tuple], baseline_tick: int = 0,
+                 baseline: Optional[Dict[int, tuple]] = None) -> Optional[bytes]:
+    """Encode state as a delta against baseline (a full snapshot if None)"""
+    updates = []
+    for entity_id, fields in state.items():
+        previous = baseline.get(entity_id) if baseline else None
+        mask = 0
+        values = []
+        for index, (bit, fmt) in enumerate(FIELD_FORMATS):
+            if previous is None or previous[index] != fields[index]:
+                mask |= bit
+                values.append((fmt, fields[index]))
+        if mask:
+            updates.append((entity_id, mask, values))
+
+    removed = [entity_id for entity_id in baseline if entity_id not in state] if baseline else []
+
+    if baseline is not None and not updates and not removed:
+        return None
+
+    parts = [HEADER.pack(tick, baseline_tick, len(updates), len(removed))]
+    for entity_id, mask, values in updates:
+        fmt = '<HB' + ''.join(f for f, _ in values)
+        parts.append(struct.pack(fmt, entity_id, mask, *[v for _, v in values]))
+    for entity_id in removed:
+        parts.append(ENTITY_ID.pack(entity_id))
+    return b''.join(parts)
+
+
+def decode_delta(data: bytes, baselines: Dict[int, Dict[int, tuple]]) -> Tuple[int, Dict[int, tuple]]:
+    """Decode a snapshot into a full quantized state
+
+    baselines maps previously decoded ticks to their states, as a client would
+    keep them. Returns (tick, state).
+    """
+    tick, baseline_tick, update_count, removed_count = HEADER.unpack_from(data, 0)
+    offset = HEADER.size
+
+    if baseline_tick:
+        if baseline_tick not in baselines:
+            raise ValueError(f"Unknown baseline tick {baseline_tick}")
+        state = dict(baselines[baseline_tick])
+    else:
+        state = {}
+
+    for _ in range(update_count):
+        entity_id, mask = ENTITY_HEADER.unpack_from(data, offset)
+        offset += ENTITY_HEADER.size
+        fields = list(state.get(entity_id, (0,) * len(FIELD_FORMATS)))
+        for index, (bit, fmt) in enumerate(FIELD_FORMATS):
+            if mask & bit:
+                fields[index] = struct.unpack_from('<' + fmt, data, offset)[0]
+                offset += struct.calcsize(fmt)
+        state[entity_id] = tuple(fields)
+
+    for _ in range(removed_count):
+        state.pop(ENTITY_ID.unpack_from(data, offset)[0], None)
+        offset += ENTITY_ID.size
+
+    return tick, state
+
+
+def test_snapshot_roundtrip():
+    """Test full and delta snapshot encoding"""
+    print("Testing snapshot encoding...")
+
+    encoder = SnapshotEncoder()
+    players = {
+        'a': {'x': 1.0, 'y': 1.0, 'z': -3.5, 'rotation': 0.25, 'health': 100},
+        'b': {'x': 50.0, 'y': 1.0, 'z': 20.0, 'rotation': 3.0, 'health': 75}
+    }
+
+    client_states = {}
+    state = encoder.capture(1, players)
+    full = encoder.encode_for('client', 1)
+    tick, decoded = decode_delta(full, client_states)
+    client_states[tick] = decoded
+    encoder.acknowledge('client', tick)
+
+    players['a']['x'] = 2.0
+    del players['b']
+    state = encoder.capture(2, players)
+    delta = encoder.encode_for('client', 2)
+    tick, decoded = decode_delta(delta, client_states)
+
+    print(f"Full snapshot: {len(full)} bytes, delta: {len(delta)} bytes")
+
+    return decoded == state and len(delta) < len(full)
+
+
+if __name__ == "__main__":
+    print("Running snapshot tests...")
+    test_snapshot_roundtrip()
+    print("Tests completed!")
@@ -0,0 +1,145 @@
+# timer_wheel.py
+# Hierarchical timing wheel for 3D Arena Shooter's idle player expiry
+#
+# Deadlines are pushed back on every player_move, so rescheduling has to be
+# cheap: schedule() only overwrites the key's deadline when it moves later,
+# and entries are re-filed lazily when their old slot comes up. Expiring
+# costs time proportional to the keys that are due, not to all keys.
+
+import math
+import threading
+from typing import Any, Dict, List, Tuple
+
+
+class TimerWheel:
+    """Expiry scheduler keyed by arbitrary hashable keys
+
+    Time is divided into ticks of resolution seconds. Level 0 has one slot
+    per tick; each higher level has slots spanning a whole turn of the level
+    below, so deadlines up to resolution * slots ** levels ahead are filed
+    directly and later ones are re-filed when they come into range. Keys
+    expire at the first advance() at or after their deadline, rounded up to
+    the resolution. All methods are thread-safe.
+    """
+
+    def __init__(self, resolution: float = 0.1, slots: int = 64, levels: int = 3, start: float = 0.0):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.tick = self._tick_of(start)  # last tick processed
+        self.deadlines = {}  # key -> deadline
+        self.placed = {}     # key -> token of the entry currently filed for it
+        self.next_token = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.deadlines
+
+    def _tick_of(self, when: float) -> int:
+        return math.floor(when / self.resolution)
+
+    def _file(self, key: Any, deadline: float):
+        """File an entry for key in the slot its deadline falls in"""
+        target = max(math.ceil(deadline / self.resolution), self.tick + 1)
+        delta = target - self.tick
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        span = self.slots ** level
+        if delta >= span * self.slots:
+            # Beyond the top level: park it in the furthest slot, re-filed later
+            target = self.tick + span * (self.slots - 1)
+        self.next_token += 1
+        self.placed[key] = self.next_token
+        self.wheels[level][(target // span) % self.slots].append((key, self.next_token))
+
+    def schedule(self, key: Any, deadline: float):
+        """Set the deadline of key, replacing any earlier one"""
+        with self.lock:
+            previous = self.deadlines.get(key)
+            self.deadlines[key] = deadline
+            # A later deadline leaves the filed entry alone; it is re-filed when due
+            if previous is None or deadline < previous:
+                self._file(key, deadline)
+
+    def cancel(self, key: Any):
+        with self.lock:
+            self.deadlines.pop(key, None)
+            self.placed.pop(key, None)
+
+    def advance(self, now: float) -> List[Any]:
+        """Move the wheel to now and return the keys whose deadline has passed"""
+        expired = []
+        with self.lock:
+            target = self._tick_of(now)
+            if not self.deadlines:
+                self.tick = max(self.tick, target)
+                return expired
+
+            while self.tick < target:
+                self.tick += 1
+                # Cascade higher levels whose slot starts at this tick
+                for level in range(self.levels - 1, 0, -1):
+                    span = self.slots ** level
+                    if self.tick % span == 0:
+                        self._refile(self.wheels[level], (self.tick // span) % self.slots, now, expired)
+                self._refile(self.wheels[0], self.tick % self.slots, now, expired)
+        return expired
+
+    def _refile(self, wheel: list, index: int, now: float, expired: list):
+        entries, wheel[index] = wheel[index], []
+        placed = self.placed
+        for key, token in entries:
+            if placed.get(key) != token:
+                continue  # Cancelled, or superseded by an earlier deadline
+            deadline = self.deadlines[key]
+            if deadline <= now:
+                del self.deadlines[key]
+                del placed[key]
+                expired.append(key)
+            else:
+                self._file(key, deadline)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'keys': len(self.deadlines),
+                    'entries': sum(len(slot) for wheel in self.wheels for slot in wheel)}
+
+
+def test_timer_wheel():
+    """Test expiry timing, rescheduling and far deadlines"""
+    print("Testing timer wheel...")
+
+    wheel = TimerWheel(resolution=0.1, slots=8, levels=2)
+    deadlines = {f'player{i}': 1.0 + i * 0.35 for i in range(40)}  # up to ~15 s, past the 6.4 s horizon
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    # Keep one player active: its deadline keeps moving
+    wheel.schedule('active', 2.0)
+
+    expired_at: Dict[Any, float] = {}
+    now = 0.0
+    while now < 20.0:
+        now = round(now + 0.05, 2)
+        if now < 10.0:
+            wheel.schedule('active', now + 2.0)
+        for key in wheel.advance(now):
+            expired_at[key] = now
+
+    late: List[Tuple[Any, float]] = [(key, expired_at.get(key, math.inf) - deadline)
+                                     for key, deadline in deadlines.items()]
+    worst = max(delay for _, delay in late)
+    print(f"Expired {len(expired_at)} keys, worst delay {worst:.2f} s, active expired at {expired_at.get('active')}")
+
+    return (all(0 <= delay <= 0.1 + 1e-9 for _, delay in late)
+            and 11.9 <= expired_at.get('active', 0) <= 12.1 and len(wheel) == 0)
+
+
+if __name__ == "__main__":
+    print("Running timer wheel tests...")
+    test_timer_wheel()
+    print("Tests completed!")
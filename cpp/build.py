@@ -1,19 +1,41 @@
 #!/usr/bin/env python3
 """
 Build script for C++ game logic module using pybind11
+
+Builds an optimized (Release) module and copies it to the backend directory.
+Built modules are cached under build/cache, keyed by a hash of the sources,
+the build options and the Python version, so rebuilding unchanged sources or
+switching back to an earlier version only copies a file. Each build variant
+keeps its own CMake build directory, so real builds are incremental.
+
+    python build.py                 # Release build
+    python build.py --native        # also -march=native (not portable to other CPUs)
+    python build.py --build-type Debug
+    python build.py --force         # ignore the cache
 """
 
+import argparse
+import hashlib
 import os
+import shlex
 import sys
 import subprocess
 import shutil
+import sysconfig
 from pathlib import Path
 
+CPP_DIR = Path(__file__).parent
+BACKEND_DIR = CPP_DIR.parent / "backend"
+MODULE_NAME = "cpp_logic"
+# Files whose content goes into the cache key
+SOURCES = ("cpp_logic.cpp", "CMakeLists.txt")
+CACHE_SIZE = 8  # built modules kept in build/cache
+
 def run_command(command, cwd=None):
     """Run a command and return the result"""
     print(f"Running: {command}")
     try:
-        result = subprocess.run(command, shell=True, cwd=cwd, 
+        result = subprocess.run(command, shell=True, cwd=cwd,
                               capture_output=True, text=True, check=True)
         print(f"Command output: {result.stdout}")
         return True
@@ -23,52 +45,91 @@ def run_command(command, cwd=None):
         return False
 
 def check_pybind11():
-    """Check if pybind11 is available"""
+    """Check if pybind11 is available; returns its CMake directory"""
     try:
         import pybind11
         print(f"pybind11 found: {pybind11.__file__}")
-        return True
+        return pybind11.get_cmake_dir()
     except ImportError:
-        print("pybind11 not found. Installing...")
-        return run_command(f"{sys.executable} -m pip install pybind11")
-
-def build_module():
-    """Build the C++ module"""
-    cpp_dir = Path(__file__).parent
-    backend_dir = cpp_dir.parent / "backend"
-    
-    print(f"Building C++ module in {cpp_dir}")
-    
-    # Check if pybind11 is available
-    if not check_pybind11():
-        print("Failed to install pybind11")
+        print("pybind11 not found. Install the backend requirements first: "
+              "pip install -r backend/requirements.txt")
+        return None
+
+def module_filename():
+    return f"{MODULE_NAME}.pyd" if sys.platform.startswith("win") else f"{MODULE_NAME}.so"
+
+def cache_key(build_type, native):
+    """Hash of everything that affects the built module"""
+    digest = hashlib.sha256()
+    for name in SOURCES:
+        digest.update((CPP_DIR / name).read_bytes())
+    digest.update(f"{build_type}|{native}|{sys.version}|{sysconfig.get_platform()}".encode())
+    try:
+        import pybind11
+        digest.update(pybind11.__version__.encode())
+    except ImportError:
+        pass
+    return digest.hexdigest()[:16]
+
+def install_module(module_file):
+    """Copy a built module to the backend directory"""
+    target_file = BACKEND_DIR / module_filename()
+    shutil.copy2(module_file, target_file)
+    print(f"Module copied to: {target_file}")
+
+def prune_cache(cache_dir):
+    """Keep only the most recently used CACHE_SIZE modules"""
+    entries = sorted(cache_dir.glob(f"*-{module_filename()}"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in entries[CACHE_SIZE:]:
+        old.unlink()
+
+def build_module(build_type="Release", native=False, force=False, jobs=None):
+    """Build the C++ module, or reuse a cached build of the same sources"""
+    print(f"Building C++ module in {CPP_DIR}")
+
+    cache_dir = CPP_DIR / "build" / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = cache_key(build_type, native)
+    cached = cache_dir / f"{key}-{module_filename()}"
+    if cached.exists() and not force:
+        print(f"Sources unchanged since a previous build ({key}); using the cached module")
+        cached.touch()
+        install_module(cached)
+        return True
+
+    pybind11_dir = check_pybind11()
+    if pybind11_dir is None:
         return False
-    
-    # Create build directory
-    build_dir = cpp_dir / "build"
-    build_dir.mkdir(exist_ok=True)
-    
+
+    # One build directory per variant, so CMake only rebuilds what changed
+    variant = build_type.lower() + ("-native" if native else "")
+    build_dir = CPP_DIR / "build" / variant
+    build_dir.mkdir(parents=True, exist_ok=True)
+
     # Configure with CMake
-    if not run_command("cmake ..", cwd=build_dir):
+    configure = (f"cmake {shlex.quote(str(CPP_DIR.resolve()))}"
+                 f" -DCMAKE_BUILD_TYPE={build_type}"
+                 f" -DCPP_LOGIC_NATIVE={'ON' if native else 'OFF'}"
+                 f" -Dpybind11_DIR={shlex.quote(pybind11_dir)}"
+                 f" -DPython_EXECUTABLE={shlex.quote(sys.executable)}")
+    if not run_command(configure, cwd=build_dir):
         print("CMake configuration failed")
         return False
-    
+
     # Build the module
-    if not run_command("cmake --build .", cwd=build_dir):
+    if not run_command(f"cmake --build . --config {build_type} --parallel {jobs or os.cpu_count() or 1}",
+                       cwd=build_dir):
         print("Build failed")
         return False
-    
-    # Copy the built module to backend directory
-    module_name = "cpp_logic"
-    if sys.platform.startswith("win"):
-        module_file = build_dir / f"{module_name}.pyd"
-    else:
-        module_file = build_dir / f"{module_name}.so"
-    
+
+    module_file = build_dir / module_filename()
+    if not module_file.exists():
+        # Multi-config generators (Visual Studio) put it in a per-config folder
+        module_file = build_dir / build_type / module_filename()
     if module_file.exists():
-        target_file = backend_dir / module_file.name
-        shutil.copy2(module_file, target_file)
-        print(f"Module copied to: {target_file}")
+        shutil.copy2(module_file, cached)
+        prune_cache(cache_dir)
+        install_module(module_file)
         return True
     else:
         print(f"Module file not found: {module_file}")
@@ -77,37 +138,38 @@ def build_module():
 def test_module():
     """Test the built module"""
     print("Testing the built module...")
-    
-    # Add backend directory to Python path
-    backend_dir = Path(__file__).parent.parent / "backend"
-    sys.path.insert(0, str(backend_dir))
-    
-    try:
-        import game_logic
-        print("Game logic module imported successfully")
-        
-        # Run tests
-        if hasattr(game_logic, 'test_sphere_intersection'):
-            game_logic.test_sphere_intersection()
-        
-        if hasattr(game_logic, 'test_ray_hit_detection'):
-            game_logic.test_ray_hit_detection()
-        
+
+    # Run the tests in a fresh interpreter, so an already imported module
+    # cannot hide the one just built
+    tests = ("import game_logic; "
+             "assert game_logic.CPP_AVAILABLE, 'cpp_logic did not load'; "
+             "game_logic.test_sphere_intersection(); "
+             "game_logic.test_ray_hit_detection(); "
+             "game_logic.test_sphere_overlaps(); "
+             "game_logic.test_hitboxes()")
+    if run_command(f"{shlex.quote(sys.executable)} -c {shlex.quote(tests)}", cwd=BACKEND_DIR):
         print("All tests passed!")
         return True
-        
-    except Exception as e:
-        print(f"Test failed: {e}")
-        return False
+    print("Test failed")
+    return False
 
 def main():
     """Main build function"""
+    parser = argparse.ArgumentParser(description="Build the cpp_logic module")
+    parser.add_argument("--build-type", default="Release",
+                        choices=["Release", "RelWithDebInfo", "Debug"])
+    parser.add_argument("--native", action="store_true", help="optimize for this machine's CPU")
+    parser.add_argument("--force", action="store_true", help="rebuild even if a cached build exists")
+    parser.add_argument("--jobs", type=int, help="parallel compile jobs")
+    parser.add_argument("--no-test", action="store_true", help="skip the tests after building")
+    args = parser.parse_args()
+
     print("Building C++ game logic module...")
-    
-    if build_module():
+
+    if build_module(args.build_type, args.native, args.force, args.jobs):
         print("Build successful!")
-        
-        if test_module():
+
+        if args.no_test or test_module():
             print("Module tested successfully!")
             return True
         else:
@@ -119,4 +181,4 @@ def main():
 
 if __name__ == "__main__":
     success = main()
-    sys.exit(0 if success else 1) 
\ No newline at end of file
+    sys.exit(0 if success else 1)
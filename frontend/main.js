@@ -16,6 +16,23 @@ class SpaceArena {
         this.bots = []; // AI bots
         this.socket = null;
         this.playerId = null;
+        this.entityPlayers = {}; // Snapshot entity id -> player id
+        this.snapshotStates = new Map(); // Tick -> decoded snapshot state, used as delta baselines
+        this.rtt = 0; // Round trip time to the server in seconds, reported for lag compensation
+        this.pingInterval = null;
+        this.serverWorld = null; // Asteroid field simulated by the server (see WorldSimulation)
+        this.serverWorldReceived = 0; // performance.now() when serverWorld arrived
+        this.obstacleMesh = null; // The map's static obstacles, one instanced mesh
+        
+        // Client-side prediction: movement is applied locally at once and sent
+        // as numbered input frames, batched every inputSendInterval ms
+        this.inputSeq = 0; // Sequence number of the latest input frame
+        this.unsentInputs = []; // [seq, x, y, z, rotation] frames not sent yet
+        this.pendingInputs = []; // { seq, delta } frames the server has not acknowledged
+        this.lastInputSend = 0;
+        this.lastSentRotation = null;
+        this.inputSendInterval = 50;
+        this.maxInputBatch = 16; // Under MAX_INPUTS_PER_MESSAGE in backend/rooms.py
         this.selectedMap = 'nebula'; // Default map
         
         // Player stats
@@ -45,6 +62,7 @@ class SpaceArena {
         // Bot respawning
         this.botRespawnTime = 3000; // 3 seconds (was 5 seconds)
         this.deadBots = []; // Track dead bots for respawning
+        this.serverBots = false; // The room hosts bots on the server, so there are no local ones
         
         // Game pause system
         this.isGamePaused = false;
@@ -222,8 +240,10 @@ class SpaceArena {
         // Create asteroids (common to all maps)
         this.createAsteroids(15);
         
-        // Create AI bots
-        this.createBots(5);
+        // Create AI bots, unless the server already plays them
+        if (!this.serverBots) {
+            this.createBots(5);
+        }
         
         // Create player spaceship
         this.createPlayerSpaceship();
@@ -507,6 +527,27 @@ class SpaceArena {
     }
     
     createAsteroids(count = 15) {
+        // Online, the server owns the asteroid field: build exactly its asteroids
+        if (this.serverWorld) {
+            this.serverWorld.asteroids.forEach(data => {
+                const asteroid = new THREE.Mesh(
+                    new THREE.DodecahedronGeometry(data.radius),
+                    new THREE.MeshPhongMaterial({ color: 0x666666, shininess: 10 })
+                );
+                asteroid.position.set(data.x, data.y, data.z);
+                asteroid.userData.base = { x: data.x, y: data.y, z: data.z };
+                asteroid.userData.orbitSpeed = data.orbit_speed;
+                // Server spin is in rad/s, the local one per frame at ~60 fps
+                asteroid.userData.rotationSpeed = {
+                    x: data.spin.x / 60, y: data.spin.y / 60, z: data.spin.z / 60
+                };
+                this.scene.add(asteroid);
+                this.asteroids.push(asteroid);
+            });
+            this.createObstacles(this.serverWorld.obstacles || []);
+            return;
+        }
+        
         for (let i = 0; i < count; i++) {
             const size = 2 + Math.random() * 8;
             const geometry = new THREE.DodecahedronGeometry(size);
@@ -535,6 +576,30 @@ class SpaceArena {
         }
     }
     
+    createObstacles(obstacles) {
+        // Static rocks baked by the server (see StaticGeometry); they never move,
+        // so all of them share one instanced draw call
+        if (this.obstacleMesh) {
+            this.scene.remove(this.obstacleMesh);
+            this.obstacleMesh = null;
+        }
+        if (obstacles.length === 0) return;
+        
+        const mesh = new THREE.InstancedMesh(
+            new THREE.IcosahedronGeometry(1, 0),
+            new THREE.MeshPhongMaterial({ color: 0x57534e, shininess: 5 }),
+            obstacles.length
+        );
+        const matrix = new THREE.Matrix4();
+        obstacles.forEach(([x, y, z, radius], i) => {
+            matrix.makeScale(radius, radius, radius).setPosition(x, y, z);
+            mesh.setMatrixAt(i, matrix);
+        });
+        mesh.instanceMatrix.needsUpdate = true;
+        this.scene.add(mesh);
+        this.obstacleMesh = mesh;
+    }
+    
     createPlayerSpaceship() {
         // Create player spaceship
         const group = new THREE.Group();
@@ -736,21 +801,86 @@ class SpaceArena {
         }
     }
     
-    setupWebSocket() {
-        this.socket = io('http://localhost:5000');
-        
+    setupWebSocket(serverUrl) {
+        // Join the match given by ?room=... (the server's default room otherwise)
+        const room = new URLSearchParams(window.location.search).get('room');
+        if (!serverUrl) {
+            // Ask which worker process serves the room before connecting
+            fetch(`http://localhost:5000/route?room=${encodeURIComponent(room || '')}`)
+                .then(response => response.json())
+                .then(route => this.setupWebSocket(route.url))
+                .catch(() => this.setupWebSocket('http://localhost:5000'));
+            return;
+        }
+        if (this.socket) this.socket.disconnect();
+        this.socket = io(serverUrl, room ? { query: { room } } : {});
+
+        // Another worker owns the room: reconnect there
+        this.socket.on('connect_error', (error) => {
+            if (error.data && error.data.redirect) {
+                this.setupWebSocket(error.data.redirect);
+            }
+        });
+        this.socket.on('redirect', (data) => {
+            console.log('Room served by another worker:', data);
+            this.setupWebSocket(data.url);
+        });
+
         this.socket.on('connect', () => {
             console.log('Connected to server');
             this.playerId = this.socket.id;
         });
         
+        // Measure latency so the server can rewind targets to what we saw
+        clearInterval(this.pingInterval);
+        this.pingInterval = setInterval(() => {
+            if (this.socket.connected) {
+                this.socket.emit('ping', { client_time: performance.now(), rtt: this.rtt });
+            }
+        }, 2000);
+        
+        this.socket.on('pong', (data) => {
+            if (data.client_time != null) {
+                this.rtt = (performance.now() - data.client_time) / 1000;
+            }
+        });
+        
         this.socket.on('game_state', (data) => {
             console.log('Received game state:', data);
+            // A game state starts a new room session: drop what we knew before
+            Object.keys(this.otherPlayers).forEach(id => {
+                if (!data.players[id]) this.removeOtherPlayer(id);
+            });
+            this.entityPlayers = {};
+            this.snapshotStates.clear();
+            this.unsentInputs = [];
+            this.pendingInputs = [];
+            
+            // Rebuild the asteroid field from the server's simulation
+            if (data.world) {
+                this.serverWorld = data.world;
+                this.serverWorldReceived = performance.now();
+                if (this.asteroids.length > 0) {
+                    this.asteroids.forEach(asteroid => this.scene.remove(asteroid));
+                    this.asteroids = [];
+                    this.createAsteroids();
+                }
+            }
+            
             // Handle other players
+            Object.values(data.players).forEach(player => {
+                if (player.bot) this.useServerBots();
+                this.entityPlayers[player.entity_id] = player.id;
+                if (player.id !== this.playerId && !this.otherPlayers[player.id]) {
+                    this.addOtherPlayer(player.id, player);
+                }
+            });
         });
         
         this.socket.on('player_joined', (data) => {
             console.log('Player joined:', data);
+            if (data.player.bot) this.useServerBots();
+            this.entityPlayers[data.player.entity_id] = data.player.id;
             this.addOtherPlayer(data.player.id, data.player);
         });
         
@@ -759,8 +889,35 @@ class SpaceArena {
             this.removeOtherPlayer(data.player_id);
         });
         
-        this.socket.on('player_moved', (data) => {
-            this.updateOtherPlayerPosition(data.player_id, data.position);
+        // One binary delta snapshot per server tick (see backend/snapshot.py)
+        this.socket.on('world_snapshot', (buffer) => {
+            const snapshot = this.decodeSnapshot(buffer);
+            if (!snapshot) return;
+            
+            this.socket.emit('snapshot_ack', { tick: snapshot.tick });
+            
+            const inSnapshot = new Set();
+            snapshot.state.forEach((fields, entityId) => {
+                const id = this.entityPlayers[entityId];
+                if (!id) return;
+                if (id === this.playerId) {
+                    // Our own entity carries the last input frame the server applied
+                    this.acknowledgeInputs(this.unwrapInputSeq(fields[5]));
+                    return;
+                }
+                inSnapshot.add(id);
+                if (!this.otherPlayers[id]) {
+                    this.addOtherPlayer(id, { x: fields[0], y: fields[1], z: fields[2], health: fields[4] });
+                }
+                this.updateOtherPlayerPosition(id, {
+                    x: fields[0], y: fields[1], z: fields[2], rotation: fields[3]
+                });
+            });
+            
+            // Players outside our area of interest are left out of snapshots
+            Object.entries(this.otherPlayers).forEach(([id, group]) => {
+                group.visible = inSnapshot.has(id);
+            });
         });
         
         this.socket.on('player_shot', (data) => {
@@ -768,16 +925,98 @@ class SpaceArena {
         });
         
         this.socket.on('shot_hit', (data) => {
-            this.createHitEffect(data.hit_position);
+            // Head shots (region from the server's hitboxes) flash yellow
+            this.createHitEffect(data.hit_position, data.region === 'head' ? 0xffee00 : undefined);
         });
+        
+        // Server-simulated projectiles (PROJECTILE_SPEED > 0) land some time after player_shot
+        this.socket.on('projectile_impact', (data) => {
+            this.createHitEffect(data.position);
+        });
+        
+        // The server pushed us out of an asteroid: take its position as authoritative,
+        // then replay the movement it had not seen yet on top of it
+        this.socket.on('asteroid_collision', (data) => {
+            if (!this.player) return;
+            const corrected = new THREE.Vector3(data.position.x, data.position.y, data.position.z);
+            if (data.input_seq != null) {
+                this.acknowledgeInputs(data.input_seq);
+                this.pendingInputs.forEach(input => corrected.add(input.delta));
+            }
+            const pushDirection = corrected.clone().sub(this.player.position).normalize();
+            this.player.position.copy(corrected);
+            if (this.playerVelocity) {
+                this.playerVelocity.add(pushDirection.multiplyScalar(2));
+            }
+            if (data.damage > 0) {
+                this.takeDamage(data.damage);
+            }
+        });
+    }
+    
+    decodeSnapshot(buffer) {
+        // Mirrors encode_delta in backend/snapshot.py
+        const view = new DataView(buffer);
+        const tick = view.getUint32(0, true);
+        const baselineTick = view.getUint32(4, true);
+        const updateCount = view.getUint16(8, true);
+        const removedCount = view.getUint16(10, true);
+        let offset = 12;
+        
+        let state;
+        if (baselineTick === 0) {
+            state = new Map();
+        } else if (this.snapshotStates.has(baselineTick)) {
+            state = new Map(this.snapshotStates.get(baselineTick));
+        } else {
+            return null; // Baseline no longer known, wait for a full snapshot
+        }
+        
+        for (let i = 0; i < updateCount; i++) {
+            const entityId = view.getUint16(offset, true);
+            const mask = view.getUint8(offset + 2);
+            offset += 3;
+            
+            const fields = (state.get(entityId) || [0, 0, 0, 0, 0, 0]).slice();
+            if (mask & 0x01) { fields[0] = view.getInt16(offset, true) / 32; offset += 2; }
+            if (mask & 0x02) { fields[1] = view.getInt16(offset, true) / 32; offset += 2; }
+            if (mask & 0x04) { fields[2] = view.getInt16(offset, true) / 32; offset += 2; }
+            if (mask & 0x08) { fields[3] = view.getUint16(offset, true) * (2 * Math.PI / 65536); offset += 2; }
+            if (mask & 0x10) { fields[4] = view.getUint8(offset); offset += 1; }
+            if (mask & 0x20) { fields[5] = view.getUint16(offset, true); offset += 2; }
+            state.set(entityId, fields);
+        }
+        
+        for (let i = 0; i < removedCount; i++) {
+            state.delete(view.getUint16(offset, true));
+            offset += 2;
+        }
+        
+        // Keep a bounded window of baselines the server may delta against
+        this.snapshotStates.set(tick, state);
+        if (this.snapshotStates.size > 64) {
+            this.snapshotStates.delete(this.snapshotStates.keys().next().value);
+        }
+        
+        return { tick, state };
+    }
+    
+    useServerBots() {
+        // Server bots replace the local ones for the rest of the session
+        if (this.serverBots) return;
+        this.serverBots = true;
+        this.bots.forEach(bot => this.scene.remove(bot));
+        this.deadBots.forEach(bot => this.scene.remove(bot));
+        this.bots = [];
+        this.deadBots = [];
     }
     
     addOtherPlayer(id, playerData) {
-        // Create other player spaceship (different color)
+        // Create other player spaceship (different color; server bots in purple)
         const group = new THREE.Group();
         
         const bodyGeometry = new THREE.ConeGeometry(2, 8, 8);
-        const bodyMaterial = new THREE.MeshPhongMaterial({ color: 0xff6600 });
+        const bodyMaterial = new THREE.MeshPhongMaterial({ color: playerData.bot ? 0xaa44ff : 0xff6600 });
         const body = new THREE.Mesh(bodyGeometry, bodyMaterial);
         body.rotation.x = Math.PI / 2;
         group.add(body);
@@ -948,7 +1187,8 @@ class SpaceArena {
         this.scene.add(trail);
         
         // Animate shot with improved physics
-        const distance = hitData.hit ? hitData.distance : 150;
+        // Misses stopped by an obstacle carry its distance too
+        const distance = hitData.distance != null ? hitData.distance : 150;
         const duration = 800; // Slightly longer for more dramatic effect
         const startTime = Date.now();
         
@@ -986,11 +1226,11 @@ class SpaceArena {
         animateShot();
     }
     
-    createHitEffect(hitPosition) {
+    createHitEffect(hitPosition, color = 0xff6600) {
         // Create explosion effect
         const explosionGeometry = new THREE.SphereGeometry(1, 16, 16);
         const explosionMaterial = new THREE.MeshBasicMaterial({ 
-            color: 0xff6600,
+            color: color,
             transparent: true,
             opacity: 0.8
         });
@@ -1110,16 +1350,42 @@ class SpaceArena {
         if (this.playerVelocity) {
             this.player.position.add(this.playerVelocity);
             
-            // Send position update
-            if (this.socket) {
-                this.socket.emit('player_move', {
-                    x: this.player.position.x,
-                    y: this.player.position.y,
-                    z: this.player.position.z,
-                    rotation: this.mouseX
-                });
+            // Queue the position update; standing still sends nothing
+            if (this.socket && (this.playerVelocity.lengthSq() > 0 || this.mouseX !== this.lastSentRotation)) {
+                this.queueInput(this.playerVelocity.clone());
             }
         }
+        this.flushInputs();
+    }
+    
+    queueInput(delta) {
+        const seq = ++this.inputSeq;
+        const position = this.player.position;
+        this.unsentInputs.push([seq, position.x, position.y, position.z, this.mouseX]);
+        this.pendingInputs.push({ seq, delta });
+        this.lastSentRotation = this.mouseX;
+        // Without acks (e.g. an older server) keep only the recent past
+        if (this.pendingInputs.length > 256) this.pendingInputs.shift();
+    }
+    
+    flushInputs() {
+        if (!this.socket || this.unsentInputs.length === 0) return;
+        const now = performance.now();
+        if (now - this.lastInputSend < this.inputSendInterval && this.unsentInputs.length < this.maxInputBatch) return;
+        this.socket.emit('player_move', { inputs: this.unsentInputs });
+        this.unsentInputs = [];
+        this.lastInputSend = now;
+    }
+    
+    unwrapInputSeq(ack) {
+        // Snapshots carry the low 16 bits; take the latest sequence we sent that matches
+        return this.inputSeq - ((this.inputSeq - ack) & 0xFFFF);
+    }
+    
+    acknowledgeInputs(seq) {
+        while (this.pendingInputs.length > 0 && this.pendingInputs[0].seq <= seq) {
+            this.pendingInputs.shift();
+        }
     }
     
     updateCamera() {
@@ -1168,14 +1434,28 @@ class SpaceArena {
     }
     
     updateAsteroids() {
+        // Server world time, extrapolated since the world description arrived
+        const online = this.socket && this.socket.connected && this.serverWorld;
+        const worldTime = online
+            ? this.serverWorld.time + (performance.now() - this.serverWorldReceived) / 1000
+            : 0;
+        
         this.asteroids.forEach(asteroid => {
             const speed = asteroid.userData.rotationSpeed;
             asteroid.rotation.x += speed.x;
             asteroid.rotation.y += speed.y;
             asteroid.rotation.z += speed.z;
             
-            // Check collision with player
-            if (this.player) {
+            // Orbiting asteroids circle the arena's vertical axis, as on the server
+            const base = asteroid.userData.base;
+            if (base && asteroid.userData.orbitSpeed) {
+                const angle = asteroid.userData.orbitSpeed * worldTime;
+                asteroid.position.x = base.x * Math.cos(angle) - base.z * Math.sin(angle);
+                asteroid.position.z = base.x * Math.sin(angle) + base.z * Math.cos(angle);
+            }
+            
+            // Offline, collide locally; online the server sends asteroid_collision
+            if (this.player && !online) {
                 const distance = this.player.position.distanceTo(asteroid.position);
                 const collisionDistance = 5; // Asteroid radius + player radius
                 